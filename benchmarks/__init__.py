@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks
+
+Scripts in this package measure the hot paths of the app against
+synthetic data. Run them from the repository root, for example:
+
+    python -m benchmarks.bench_auth
+"""
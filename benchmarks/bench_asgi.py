@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Compare the read-only ASGI server with the threaded WSGI server
+
+Each server runs in its own process over the same synthetic catalogue
+and is loaded with increasing numbers of clients, each fetching the
+JSON endpoints one request after another over a keep-alive
+connection. The Werkzeug server closes every connection after one
+response, so its clients connect again each time. Reported are
+the requests served per second, the latency percentiles, failed
+connections, and the threads and memory of the server process.
+
+The ASGI server needs uvicorn (pip install -e .[asgi]).
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from benchmarks.common import (
+    QuietRequestHandler, add_creatures, percentile, temp_app
+)
+
+PATHS = ['/wildlife/JSON', '/wildlife/bird/JSON', '/wildlife/5/JSON',
+         '/wildlife/JSON?ids=1,2,3,4,5']
+
+
+def serve(kind, database, port, threads):
+    """Run a server until it is killed"""
+    from wallowawildlife import create_app
+
+    config = {'DATABASE': database, 'ASGI_READ_THREADS': threads,
+              'TEMPLATE_CACHE': None}
+    if kind == 'asgi':
+        import uvicorn
+        from wallowawildlife.asgi import create_asgi_app
+
+        uvicorn.run(create_asgi_app(config), host='127.0.0.1', port=port,
+                    log_level='warning', backlog=4096)
+    else:
+        from werkzeug.serving import make_server
+
+        server = make_server('127.0.0.1', port, create_app(config),
+                             threaded=True,
+                             request_handler=QuietRequestHandler)
+        server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=10):
+    """Wait until something is listening on port"""
+    end = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            if time.monotonic() > end:
+                raise
+            time.sleep(0.05)
+
+
+def process_status(pid):
+    """Return the thread count and resident MB of a process"""
+    status = {}
+    with open('/proc/%d/status' % pid) as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            status[name] = value.split()[:1]
+
+    return int(status['Threads'][0]), int(status['VmRSS'][0]) / 1024
+
+
+async def client(port, n, end, timings):
+    """Fetch PATHS in turn over one keep-alive connection until end
+
+    The connection is opened again whenever the server closes it, as
+    the Werkzeug server does after every response.
+    """
+    writer = None
+    i = n
+    try:
+        while time.perf_counter() < end:
+            path = PATHS[i % len(PATHS)]
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                               port)
+            writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                          % path).encode('ascii'))
+            head = (await reader.readuntil(b'\r\n\r\n')).lower()
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            timings.append(time.perf_counter() - start)
+            if b'connection: close' in head:
+                writer.close()
+                writer = None
+            i += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def load(port, connections, duration, pid):
+    """Run connections clients at once and return their results
+
+    The server's threads and memory are the most seen while loaded.
+    """
+    timings = []
+    end = time.perf_counter() + duration
+    clients = asyncio.gather(
+        *(client(port, n, end, timings) for n in range(connections)),
+        return_exceptions=True)
+    threads = memory = 0
+    while not clients.done():
+        status = process_status(pid)
+        threads, memory = max(threads, status[0]), max(memory, status[1])
+        await asyncio.wait([clients], timeout=0.2)
+
+    failed = sum(isinstance(r, Exception) for r in clients.result())
+    return timings, failed, threads, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--creatures', type=int, default=10000)
+    parser.add_argument('--connections', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=8,
+                        help='ASGI_READ_THREADS')
+    parser.add_argument('--serve', choices=['sync', 'asgi'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.database, args.port, args.threads)
+        return
+
+    with temp_app() as app:
+        add_creatures(app, args.creatures)
+        app.extensions['db_pool'].close_all()
+
+        print('%-5s %6s %9s %9s %9s %7s %8s %8s'
+              % ('', 'conns', 'req/s', 'p50 ms', 'p95 ms', 'failed',
+                 'threads', 'RSS MB'))
+        for kind in ('sync', 'asgi'):
+            port = free_port()
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.bench_asgi',
+                 '--serve', kind, '--database', app.config['DATABASE'],
+                 '--port', str(port), '--threads', str(args.threads)],
+                env=dict(os.environ, PYTHONPATH=os.getcwd()))
+            try:
+                wait_for(port)
+                for connections in args.connections:
+                    timings, failed, threads, memory = asyncio.run(
+                        load(port, connections, args.duration, server.pid))
+                    print('%-5s %6d %9.0f %9.1f %9.1f %7d %8d %8.0f'
+                          % (kind, connections, len(timings) / args.duration,
+                             percentile(timings, 0.5) * 1e3,
+                             percentile(timings, 0.95) * 1e3,
+                             failed, threads, memory))
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
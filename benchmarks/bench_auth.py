@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Benchmark auth.load_logged_in_user
+
+Time the per-request user lookup as the user table grows, once for
+a session that has already cached its user.id and once for the
+first request after login.
+"""
+
+import argparse
+
+from flask import session
+
+from benchmarks.common import add_users, measure, temp_app
+from wallowawildlife.auth import load_logged_in_user
+
+
+def bench_load_logged_in_user(app, gplus_id, cached):
+    """Return median seconds for one load_logged_in_user call"""
+    def run():
+        with app.test_request_context('/'):
+            session['user_id'] = gplus_id
+            if cached:
+                # init_db adds the admin user first, so user-N is N + 2.
+                session['user_pk'] = int(gplus_id.split('-')[1]) + 2
+            load_logged_in_user()
+
+    return measure(run)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10, 1000, 100000])
+    args = parser.parse_args()
+
+    print('%10s %14s %14s' % ('users', 'cached (us)', 'uncached (us)'))
+    for size in args.sizes:
+        with temp_app() as app:
+            add_users(app, size)
+            gplus_id = 'user-%d' % (size - 1)
+            cached = bench_load_logged_in_user(app, gplus_id, True)
+            uncached = bench_load_logged_in_user(app, gplus_id, False)
+            print('%10d %14.1f %14.1f' % (size, cached * 1e6, uncached * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Benchmark database connection handling under concurrency
+
+Serve the app from a threaded server while reader threads fetch list
+pages, detail pages and JSON, and one writer keeps editing a creature.
+Compare the old settings, with a new connection per request and
+SQLite's defaults, against the pooled, WAL-mode connections.
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks.bench_login import login
+from benchmarks.common import add_creatures, serve, temp_app
+from tests.google_standin import GoogleStandin
+
+SETTINGS = {
+    'before': {'DB_POOL': False, 'DB_JOURNAL_MODE': None,
+               'DB_SYNCHRONOUS': None, 'DB_MMAP_SIZE': None,
+               'DB_CACHE_SIZE': None},
+    'after': {},
+}
+
+READ_PATHS = ['/wildlife/JSON?limit=20', '/wildlife/bird', '/wildlife/5/']
+
+
+def run_load(base_url, writer, readers, duration):
+    """Load the server for duration seconds
+
+    Return the reads and writes completed per second.
+    """
+    stop = threading.Event()
+    counts = {'reads': 0, 'writes': 0}
+    lock = threading.Lock()
+
+    def read():
+        client = requests.Session()
+        done = 0
+        while not stop.is_set():
+            client.get(base_url + READ_PATHS[done % len(READ_PATHS)])
+            done += 1
+        with lock:
+            counts['reads'] += done
+
+    def write():
+        form = dict.fromkeys(['name_latin', 'photo_attr', 'photo_url',
+                              'wiki_url', 'type_id'], '')
+        done = 0
+        while not stop.is_set():
+            form['name_common'] = 'Rocky Mountain Elk %d' % done
+            writer.post(base_url + '/wildlife/1/edit', data=form,
+                        allow_redirects=False)
+            done += 1
+        counts['writes'] = done
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return counts['reads'] / duration, counts['writes'] / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--creatures', type=int, default=10000)
+    args = parser.parse_args()
+
+    standin = GoogleStandin('standin-client').start()
+    secrets_fd, secrets_path = tempfile.mkstemp(suffix='.json')
+    standin.write_client_secrets(secrets_path)
+
+    print('%8s %10s %10s' % ('', 'reads/s', 'writes/s'))
+    try:
+        for name, settings in SETTINGS.items():
+            config = dict(settings, CLIENT_ID=standin.client_id,
+                          CLIENT_SECRETS=secrets_path,
+                          TOKENINFO_URL=standin.tokeninfo_url,
+                          GOOGLE_CERTS_URL=standin.certs_url)
+            with temp_app(**config) as app, serve(app) as base_url:
+                add_creatures(app, args.creatures)
+
+                # The admin user owns creature 1, and the stand-in
+                # treats the authorization code as the gplus id.
+                writer = requests.Session()
+                login(base_url, 'adminpass', writer)
+
+                reads, writes = run_load(base_url, writer, args.readers,
+                                         args.duration)
+                print('%8s %10.1f %10.1f' % (name, reads, writes))
+    finally:
+        standin.stop()
+        os.close(secrets_fd)
+        os.unlink(secrets_path)
+
+
+if __name__ == '__main__':
+    main()
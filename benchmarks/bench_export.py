@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Benchmark full exports from /wildlife/JSON
+
+Compare the old export, which fetched every row and built the whole
+response with jsonify, with the streamed JSON array and NDJSON
+responses. Each measurement runs in a fresh process so that its peak
+RSS belongs to that export alone.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from flask import jsonify
+
+from benchmarks.common import add_creatures
+from wallowawildlife import create_app, creature_json
+from wallowawildlife.db import get_db, init_db
+
+MODES = {
+    'jsonify': ('/legacy/JSON', {}),
+    'stream': ('/wildlife/JSON?all', {}),
+    'ndjson': ('/wildlife/JSON', {'Accept': 'application/x-ndjson'}),
+}
+
+
+def build_database(path, size):
+    """Create a database at path holding size synthetic creatures"""
+    app = create_app({'TESTING': True, 'DATABASE': path})
+    with app.app_context():
+        init_db()
+        get_db().execute('DELETE FROM creature')
+        get_db().commit()
+    add_creatures(app, size)
+
+
+def run_export(path, mode):
+    """Export every creature in the database at path, in this process
+
+    Return the time to first byte, total time, bytes sent, and the
+    growth in peak RSS in KiB.
+    """
+    app = create_app({'TESTING': True, 'DATABASE': path})
+
+    @app.route('/legacy/JSON')
+    def legacyJSON():
+        """The export as it was before it streamed"""
+        creatures = get_db().execute('SELECT * FROM creature').fetchall()
+        return jsonify([creature_json(c) for c in creatures])
+
+    url, headers = MODES[mode]
+    client = app.test_client()
+    client.get('/wildlife/JSON?limit=1')
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    response = client.get(url, headers=headers, buffered=False)
+    size = 0
+    first_byte = None
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {'ttfb': first_byte, 'total': total, 'bytes': size,
+            'rss_kib': rss_after - rss_before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 100000, 1000000])
+    parser.add_argument('--child', nargs=2, metavar=('DATABASE', 'MODE'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_export(*args.child)))
+        return
+
+    print('%9s %8s %10s %10s %10s %12s'
+          % ('rows', 'mode', 'ttfb (ms)', 'total (s)', 'MiB', 'peak RSS MiB'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            path = os.path.join(tmp, '%d.sqlite' % size)
+            build_database(path, size)
+            for mode in MODES:
+                out = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_export',
+                     '--child', path, mode],
+                    check=True, stdout=subprocess.PIPE).stdout
+                r = json.loads(out)
+                print('%9d %8s %10.1f %10.2f %10.1f %12.1f'
+                      % (size, mode, r['ttfb'] * 1e3, r['total'],
+                         r['bytes'] / 2.0 ** 20, r['rss_kib'] / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Time area and map tile queries over synthetic geotagged sightings
+
+Sightings are spread over Wallowa County, most of them clustered
+around a few towns and trailheads. For each number of sightings,
+report how long loading and indexing them took, and the time of
+each query through the test client, next to the same counts made
+by scanning sighting_location without the indexes.
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.common import add_creatures, add_users, measure, temp_app
+from wallowawildlife.db import get_db
+from wallowawildlife.geo import MAX_TILE_ZOOM, tile_bounds, tile_of
+from wallowawildlife.summaries import rebuild_summaries
+
+# West, south, east and north edges of the county.
+COUNTY = (-117.97, 44.95, -116.46, 46.0)
+
+# Joseph, Enterprise, Wallowa Lake and Imnaha.
+HOTSPOTS = [(45.354, -117.230), (45.426, -117.279), (45.300, -117.210),
+            (45.565, -116.834)]
+
+JOSEPH = HOTSPOTS[0]
+
+
+def positions(count, seed=0):
+    """Yield count latitude and longitude pairs"""
+    rng = random.Random(seed)
+    west, south, east, north = COUNTY
+    for _ in range(count):
+        if rng.random() < 0.2:
+            yield rng.uniform(south, north), rng.uniform(west, east)
+        else:
+            lat, lon = rng.choice(HOTSPOTS)
+            yield rng.gauss(lat, 0.05), rng.gauss(lon, 0.07)
+
+
+def add_sightings(db, count, creatures):
+    """Insert count positioned sightings, then index them in one go"""
+    triggers = db.execute("SELECT name, sql FROM sqlite_master \
+                           WHERE type = 'trigger' \
+                           AND tbl_name IN ('sighting', \
+                                            'sighting_location')").fetchall()
+    for t in triggers:
+        db.execute('DROP TRIGGER %s' % t['name'])
+
+    rng = random.Random(count)
+    db.executemany(
+        "INSERT INTO sighting (id, user_id, creature_id, seen_at, count) \
+         VALUES (?, 1, ?, '2024-05-01 00:00:00', ?)",
+        ((i + 1, rng.randrange(creatures) + 1, rng.randrange(3) + 1)
+         for i in range(count)))
+    db.executemany(
+        'INSERT INTO sighting_location (sighting_id, latitude, longitude, \
+                                        tile_x, tile_y) \
+         VALUES (?, ?, ?, ?, ?)',
+        ((i + 1, lat, lon) + tile_of(lat, lon, MAX_TILE_ZOOM)
+         for i, (lat, lon) in enumerate(positions(count))))
+
+    for t in triggers:
+        db.execute(t['sql'])
+    db.commit()
+    rebuild_summaries()
+
+
+def scan_area(db, west, south, east, north):
+    """Count the sightings in a box without the R*Tree"""
+    return db.execute(
+        'SELECT sighting.creature_id, COUNT(*), SUM(sighting.count) \
+         FROM sighting_location NOT INDEXED \
+         JOIN sighting ON sighting.id = sighting_location.sighting_id \
+         WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ? \
+         GROUP BY sighting.creature_id', (south, north, west, east)
+    ).fetchall()
+
+
+def scan_tile(db, zoom, x, y):
+    """Count the sightings per cell of a tile without sighting_tile"""
+    cell_zoom = min(zoom + 3, MAX_TILE_ZOOM)
+    shift = MAX_TILE_ZOOM - cell_zoom
+    size = 1 << (MAX_TILE_ZOOM - zoom)
+    return db.execute(
+        'SELECT tile_x >> ?, tile_y >> ?, COUNT(*) \
+         FROM sighting_location \
+         WHERE tile_x BETWEEN ? AND ? AND tile_y BETWEEN ? AND ? \
+         GROUP BY 1, 2',
+        (shift, shift, x * size, (x + 1) * size - 1,
+         y * size, (y + 1) * size - 1)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sightings', type=int, nargs='+',
+                        default=[100000, 1000000])
+    parser.add_argument('--creatures', type=int, default=500)
+    args = parser.parse_args()
+
+    for count in args.sightings:
+        with temp_app() as app, app.app_context():
+            add_users(app, 1)
+            add_creatures(app, args.creatures)
+            db = get_db()
+            start = time.perf_counter()
+            add_sightings(db, count, args.creatures)
+            load = time.perf_counter() - start
+            client = app.test_client()
+
+            lat, lon = JOSEPH
+            joseph = tile_bounds(14, *tile_of(lat, lon, 14))
+            queries = [
+                ('1 km radius',
+                 'area/JSON?lat=%f&lon=%f&radius=1000' % JOSEPH,
+                 lambda: scan_area(db, lon - 0.013, lat - 0.009,
+                                   lon + 0.013, lat + 0.009)),
+                ('zoom 14 box',
+                 'area/JSON?bbox=%f,%f,%f,%f' % tuple(joseph),
+                 lambda: scan_area(db, *joseph)),
+                ('county box',
+                 'area/JSON?bbox=%f,%f,%f,%f' % COUNTY,
+                 lambda: scan_area(db, *COUNTY)),
+            ]
+            for zoom in (8, 12, 16):
+                x, y = tile_of(lat, lon, zoom)
+                queries.append(
+                    ('zoom %d tile' % zoom,
+                     'tiles/%d/%d/%d/JSON' % (zoom, x, y),
+                     lambda zoom=zoom, x=x, y=y: scan_tile(db, zoom, x, y)))
+
+            print('%d sightings: loaded and indexed in %.1f s'
+                  % (count, load))
+            print('  %-13s %12s %12s  %s'
+                  % ('', 'indexed ms', 'scanned ms', 'approximate'))
+            for name, path, scan in queries:
+                url = '/sightings/' + path
+                response = client.get(url)
+                assert response.status_code == 200
+                print('  %-13s %12.2f %12.2f  %s'
+                      % (name, measure(lambda: client.get(url), 20) * 1e3,
+                         measure(scan, 3) * 1e3,
+                         response.headers.get('X-Sightings-Approximate',
+                                              '')))
+
+            def record():
+                lat, lon = next(points)
+                client.post('/sightings/JSON', json={
+                    'creature_id': 1, 'latitude': lat, 'longitude': lon})
+
+            points = positions(1000, seed=1)
+            with client.session_transaction() as session:
+                session['user_id'] = 'user-0'
+            print('  recording a positioned sighting: %.2f ms'
+                  % (measure(record, 200) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Benchmark 'flask import'
+
+Load a catalogue with init_db, then time importing a copy of its CSV
+in which a fixed number of creatures have changed. Compare with
+rebuilding the whole catalogue with init_db.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.bench_initdb import write_csv
+from benchmarks.common import temp_app
+from wallowawildlife.db import import_creatures, init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--changes', type=int, default=100)
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %s'
+          % ('rows', 'initdb (s)', 'import (s)', 'changes'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            csv_path = os.path.join(tmp, '%d.csv' % size)
+            write_csv(csv_path, size)
+
+            # Rename a few creatures and put them back at the end.
+            with open(csv_path) as f:
+                lines = f.readlines()
+            changed = [line.replace('Creature', 'Renamed', 1)
+                       for line in lines[:args.changes]]
+            changed_path = os.path.join(tmp, '%d-changed.csv' % size)
+            with open(changed_path, 'w') as f:
+                f.writelines(lines[args.changes:] + changed)
+
+            with temp_app() as app, app.app_context():
+                start = time.perf_counter()
+                init_db(csv_path=csv_path)
+                rebuild = time.perf_counter() - start
+
+                start = time.perf_counter()
+                counts, bad_rows = import_creatures(changed_path)
+                incremental = time.perf_counter() - start
+
+            print('%10d %12.2f %12.2f %s' % (size, rebuild, incremental,
+                                             counts))
+
+
+if __name__ == '__main__':
+    main()
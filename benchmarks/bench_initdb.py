@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Benchmark db.init_db
+
+Time loading synthetic creature CSVs of growing size, with and
+without --fast.
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+
+from benchmarks.common import TYPE_IDS, temp_app
+from wallowawildlife.db import init_db
+
+
+def write_csv(path, size):
+    """Write a CSV of size synthetic creatures to path"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(size):
+            writer.writerow(['Creature %07d' % i,
+                             'Creatura synthetica %d' % i,
+                             TYPE_IDS[i % len(TYPE_IDS)],
+                             'https://example.org/%d.jpg' % i,
+                             'Synthetic, CC0',
+                             'https://en.wikipedia.org/wiki/Creature_%d' % i])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    args = parser.parse_args()
+
+    print('%10s %12s %12s' % ('rows', 'default (s)', 'fast (s)'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            csv_path = os.path.join(tmp, '%d.csv' % size)
+            write_csv(csv_path, size)
+
+            timings = []
+            for fast in (False, True):
+                with temp_app() as app, app.app_context():
+                    start = time.perf_counter()
+                    imported, bad_rows = init_db(csv_path=csv_path,
+                                                 fast=fast)
+                    timings.append(time.perf_counter() - start)
+                    assert imported == size and not bad_rows
+
+            print('%10d %12.2f %12.2f' % ((size,) + tuple(timings)))
+
+
+if __name__ == '__main__':
+    main()
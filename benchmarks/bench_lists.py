@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the list pages and JSON endpoints
+
+Time a small category page, the first page of all creatures, and a
+page of /wildlife/JSON from deep in the catalogue while the catalogue
+grows. Each should cost the same at every size.
+"""
+
+import argparse
+
+from benchmarks.common import add_creatures, measure, temp_app
+from wallowawildlife.pagination import encode_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--category-size', type=int, default=200)
+    args = parser.parse_args()
+
+    print('%10s %14s %14s %14s' % ('catalogue', 'category (ms)',
+                                   'all (ms)', 'deep JSON (ms)'))
+    for size in args.sizes:
+        with temp_app() as app:
+            add_creatures(app, args.category_size, ['fish'])
+            add_creatures(app, size - args.category_size, ['bird'])
+            client = app.test_client()
+
+            # A cursor about nine tenths of the way through the list.
+            deep = encode_cursor({'name_common': 'Creature %07d'
+                                  % int(size * 0.9), 'id': 0})
+            timings = [
+                measure(lambda: client.get('/wildlife/fish'), 50),
+                measure(lambda: client.get('/wildlife'), 50),
+                measure(lambda: client.get('/wildlife/JSON?after=' + deep),
+                        50),
+            ]
+            print('%10d %14.2f %14.2f %14.2f'
+                  % ((size,) + tuple(t * 1e3 for t in timings)))
+
+
+if __name__ == '__main__':
+    main()
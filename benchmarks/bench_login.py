@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Load test the Google sign-in flow of auth.login
+
+Fire concurrent logins at a threaded server, with a local stand-in
+for Google's token and tokeninfo endpoints. Half of the logins are
+returning users and half are signing in for the first time. With
+--signed, ID tokens are signed so they can be checked without asking
+the tokeninfo endpoint.
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.common import add_users, percentile, serve, temp_app
+from tests.google_standin import GoogleStandin
+
+STATE_RE = re.compile(r'/auth/login\?state=(\w+)')
+
+
+def login(base_url, gplus_id, client=None):
+    """Sign in as gplus_id and return the seconds it took
+
+    The session cookie is kept in client if one is given.
+    """
+    if client is None:
+        client = requests.Session()
+    start = time.perf_counter()
+    page = client.get(base_url + '/auth/login')
+    state = STATE_RE.search(page.text).group(1)
+    response = client.post(base_url + '/auth/login',
+                           params={'state': state}, data=gplus_id,
+                           allow_redirects=False)
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 302, response.text
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=10000,
+                        help='users already in the user table')
+    parser.add_argument('--logins', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated Google round trip in seconds')
+    parser.add_argument('--signed', action='store_true',
+                        help='sign ID tokens with RS256')
+    args = parser.parse_args()
+
+    standin = GoogleStandin('standin-client', args.latency,
+                            sign=args.signed).start()
+    secrets_fd, secrets_path = tempfile.mkstemp(suffix='.json')
+    standin.write_client_secrets(secrets_path)
+
+    config = {'CLIENT_ID': standin.client_id,
+              'CLIENT_SECRETS': secrets_path,
+              'TOKENINFO_URL': standin.tokeninfo_url,
+              'GOOGLE_CERTS_URL': standin.certs_url}
+    try:
+        with temp_app(**config) as app:
+            add_users(app, args.users)
+            # Even logins are returning users, odd ones are new.
+            gplus_ids = ['user-%d' % (i % args.users) if i % 2 == 0
+                         else 'new-user-%d' % i for i in range(args.logins)]
+
+            with serve(app) as base_url:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(args.concurrency) as pool:
+                    timings = list(pool.map(lambda u: login(base_url, u),
+                                            gplus_ids))
+                wall = time.perf_counter() - start
+    finally:
+        standin.stop()
+        os.close(secrets_fd)
+        os.unlink(secrets_path)
+
+    print('%d logins, %d concurrent, %d existing users'
+          % (args.logins, args.concurrency, args.users))
+    print('throughput: %.1f logins/s' % (args.logins / wall))
+    print('latency p50: %.1f ms  p95: %.1f ms'
+          % (percentile(timings, 0.5) * 1e3, percentile(timings, 0.95) * 1e3))
+    print('requests to Google: %s' % ', '.join(
+        '%s %d' % hit for hit in sorted(standin.hits.items())))
+
+
+if __name__ == '__main__':
+    main()
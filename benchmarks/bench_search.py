@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Benchmark creature search
+
+Compare the FTS5 prefix search behind /wildlife/search with a LIKE
+scan over the creature names, on a catalogue of made-up names.
+"""
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+
+from benchmarks.common import TYPE_IDS, measure, temp_app
+from wallowawildlife.db import get_db, init_db
+from wallowawildlife.search import search_creatures
+
+SYLLABLES = ['ba', 'cor', 'da', 'el', 'fin', 'gra', 'hor', 'is', 'ju',
+             'ka', 'lu', 'mar', 'nor', 'os', 'pen', 'qui', 'ros', 'sta',
+             'tur', 'ul', 'ven', 'wal', 'xan', 'yar', 'zo']
+
+
+def make_word(rng, syllables):
+    """Return a made-up word of the given number of syllables"""
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def write_csv(path, size, seed=0):
+    """Write a CSV of size creatures with made-up names to path"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(size):
+            common = '%s %s' % (make_word(rng, 2).title(), make_word(rng, 3))
+            latin = '%s %s' % (make_word(rng, 3).title(), make_word(rng, 4))
+            writer.writerow([common, latin, TYPE_IDS[i % len(TYPE_IDS)],
+                             'u', 'a', 'w'])
+
+
+def like_search(text, limit):
+    """Search the way it would be done without the full-text index"""
+    pattern = '%' + text + '%'
+    return get_db().execute('SELECT * FROM creature \
+                             WHERE name_common LIKE ? OR name_latin LIKE ? \
+                             LIMIT ?', (pattern, pattern, limit)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    queries = ['wal', 'stavenros', 'gra tur']
+
+    print('%10s %12s %10s %10s %8s'
+          % ('rows', 'query', 'fts (ms)', 'like (ms)', 'hits'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            csv_path = os.path.join(tmp, '%d.csv' % size)
+            write_csv(csv_path, size)
+
+            with temp_app() as app, app.app_context():
+                init_db(csv_path=csv_path)
+                for q in queries:
+                    hits = len(search_creatures(q, args.limit))
+                    fts = measure(lambda: search_creatures(q, args.limit), 20)
+                    like = measure(lambda: like_search(q, args.limit), 5)
+                    print('%10d %12s %10.2f %10.2f %8d'
+                          % (size, q, fts * 1e3, like * 1e3, hits))
+
+
+if __name__ == '__main__':
+    main()
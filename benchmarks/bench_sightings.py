@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Load test recording sightings through the sighting writer
+
+Many signed-in users post one sighting at a time to /sightings/JSON
+on a threaded server, first with every sighting committed on its own
+(SIGHTING_BATCH_SIZE 1) and then with group commit. The same load is
+then put on the writer directly, from as many threads, which shows
+the commits alone once the HTTP server is not the bottleneck.
+Reported are the sightings recorded per second, the latency
+percentiles, and the number of transactions the writer committed.
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.common import (
+    add_creatures, add_users, percentile, serve, temp_app
+)
+from wallowawildlife.sightings import get_writer, record_sightings
+
+
+def session_for(app, base_url, gplus_id):
+    """Return a requests session signed in as gplus_id"""
+    cookie = app.session_interface.get_signing_serializer(app).dumps(
+        {'user_id': gplus_id})
+    client = requests.Session()
+    client.cookies.set(app.config['SESSION_COOKIE_NAME'], cookie)
+    return client
+
+
+def record(client, base_url, creature_id):
+    """Post one sighting and return the seconds it took"""
+    start = time.perf_counter()
+    response = client.post(base_url + '/sightings/JSON',
+                           json={'creature_id': creature_id})
+    elapsed = time.perf_counter() - start
+
+    assert response.json()['results'][0]['status'] == 'created', \
+        response.text
+    return elapsed
+
+
+def load_writer(app, args):
+    """Record the sightings straight through the writer"""
+    def user(i):
+        timings = []
+        with app.app_context():
+            for n in range(i, args.sightings, args.concurrency):
+                start = time.perf_counter()
+                ids = record_sightings([(i + 1, n % args.creatures + 1,
+                                         '2024-05-01 00:00:00', 1, '',
+                                         None, None)])
+                timings.append(time.perf_counter() - start)
+                assert ids[0] is not None
+        return timings
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        return sum(pool.map(user, range(args.concurrency)), [])
+
+
+def load_http(app, args):
+    """Record the sightings by posting them to a threaded server"""
+    with serve(app) as base_url:
+        clients = [session_for(app, base_url, 'user-%d' % i)
+                   for i in range(args.concurrency)]
+        # Sign everyone in first, so that isn't timed.
+        for client in clients:
+            client.get(base_url + '/sightings/JSON')
+
+        def user(i):
+            client = clients[i]
+            return [record(client, base_url, n % args.creatures + 1)
+                    for n in range(i, args.sightings, args.concurrency)]
+
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            return sum(pool.map(user, range(args.concurrency)), [])
+
+
+def run(args, load, batch_size):
+    """Load a fresh app and return its timings, wall time and batches"""
+    with temp_app(SIGHTING_BATCH_SIZE=batch_size, PAGE_CACHE_SIZE=0) \
+            as app:
+        add_users(app, args.concurrency)
+        add_creatures(app, args.creatures)
+
+        start = time.perf_counter()
+        timings = load(app, args)
+        wall = time.perf_counter() - start
+
+        with app.app_context():
+            batches = get_writer().batches
+
+    return timings, wall, batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sightings', type=int, default=4000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--creatures', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    print('%d sightings from %d concurrent users'
+          % (args.sightings, args.concurrency))
+    print('%-7s %6s %12s %9s %9s %9s'
+          % ('', 'batch', 'sightings/s', 'p50 ms', 'p95 ms', 'commits'))
+    for name, load in (('http', load_http), ('writer', load_writer)):
+        for batch_size in (1, args.batch_size):
+            timings, wall, batches = run(args, load, batch_size)
+            print('%-7s %6d %12.0f %9.1f %9.1f %9d'
+                  % (name, batch_size, len(timings) / wall,
+                     percentile(timings, 0.5) * 1e3,
+                     percentile(timings, 0.95) * 1e3, batches))
+
+
+if __name__ == '__main__':
+    main()
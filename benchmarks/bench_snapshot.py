@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Compare the catalogue snapshot with SQLite for the read routes
+
+For each catalogue size, report the memory the snapshot takes, how
+long it takes to read and to patch after one edit, and the time of
+each lookup the read routes make, through SQLite and through the
+snapshot. The last column is /wildlife/JSON through the test client
+with the page cache off.
+"""
+
+import argparse
+import tracemalloc
+
+from benchmarks.common import add_creatures, measure, temp_app
+from wallowawildlife.db import get_creature, get_creatures, get_db
+from wallowawildlife.pagination import select_page
+from wallowawildlife.snapshot import SnapshotHolder, read_snapshot, sort_key
+
+PAGE = 100
+
+
+def lookups(size):
+    """Return the lookups to time, by name"""
+    middle = ('Creature %07d' % (size // 2), size // 2)
+    ids = list(range(1, size, max(size // PAGE, 1)))
+    return [
+        ('by id', lambda: get_creature(size // 2)),
+        ('100 ids', lambda: get_creatures(ids)),
+        ('first page', lambda: select_page(None, None, False, PAGE + 1)),
+        ('deep page', lambda: select_page(None, middle, False, PAGE + 1)),
+        ('type page', lambda: select_page('fish', middle, False, PAGE + 1)),
+    ]
+
+
+def snapshot_lookups(snapshot, size):
+    """Return the same lookups made on a snapshot"""
+    key = sort_key('Creature %07d' % (size // 2), size // 2)
+    ids = list(range(1, size, max(size // PAGE, 1)))
+    return [
+        ('by id', lambda: snapshot.get(size // 2)),
+        ('100 ids', lambda: snapshot.get_many(ids)),
+        ('first page', lambda: snapshot.seek(None, None, False, PAGE + 1)),
+        ('deep page', lambda: snapshot.seek(None, key, False, PAGE + 1)),
+        ('type page', lambda: snapshot.seek('fish', key, False, PAGE + 1)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        with temp_app(PAGE_CACHE_SIZE=0) as app, app.app_context():
+            add_creatures(app, size)
+            db = get_db()
+            # As a write would, so the import isn't a change to patch.
+            db.execute('UPDATE catalogue SET version = version + 1')
+            db.commit()
+
+            tracemalloc.start()
+            snapshot = read_snapshot(db)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            read_time = measure(lambda: read_snapshot(db), 5)
+            db.execute('UPDATE creature SET name_common = ? WHERE id = 1',
+                       ('Edited',))
+            db.execute('UPDATE catalogue SET version = version + 1')
+            db.commit()
+            patch_time = measure(lambda: read_snapshot(db, snapshot), 20)
+
+            print('%d creatures: %.1f MB, read %.1f ms, patch %.2f ms'
+                  % (size, memory / 1e6, read_time * 1e3, patch_time * 1e3))
+            print('  %-12s %12s %12s' % ('', 'SQLite (us)', 'snapshot (us)'))
+            snapshot = read_snapshot(db)
+            for (name, sql), (_, snap) in zip(
+                    lookups(size), snapshot_lookups(snapshot, size)):
+                print('  %-12s %12.1f %12.1f'
+                      % (name, measure(sql, 500) * 1e6,
+                         measure(snap, 500) * 1e6))
+
+            client = app.test_client()
+            sql_page = measure(lambda: client.get('/wildlife/JSON'), 100)
+            app.extensions['catalogue_snapshot'] = SnapshotHolder()
+            snapshot_page = measure(lambda: client.get('/wildlife/JSON'),
+                                    100)
+            print('  %-12s %12.1f %12.1f'
+                  % ('JSON page', sql_page * 1e6, snapshot_page * 1e6))
+
+
+if __name__ == '__main__':
+    main()
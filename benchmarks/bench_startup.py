@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Time how long a new worker takes to serve its first pages
+
+Each run starts a fresh Python process that imports the app, calls
+create_app and fetches a few pages, as a newly forked worker would.
+Runs are made without a template cache, with a warm template cache,
+and with a warm template cache and WARMUP on.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import add_creatures, temp_app
+
+# Run in the new process; prints the seconds to create the app and to
+# serve each page.
+WORKER = '''
+import json, sys, time
+start = time.perf_counter()
+from wallowawildlife import create_app
+app = create_app(json.loads(sys.argv[1]))
+timings = [time.perf_counter() - start]
+client = app.test_client()
+for path in sys.argv[2:]:
+    start = time.perf_counter()
+    assert client.get(path).status_code == 200, path
+    timings.append(time.perf_counter() - start)
+print(json.dumps(timings))
+'''
+
+PATHS = ['/', '/wildlife', '/wildlife/1/', '/auth/login']
+
+
+def start_worker(config):
+    """Run a worker process and return its wall time and its timings"""
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', WORKER, json.dumps(config)] + PATHS)
+    return time.perf_counter() - start, json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--creatures', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    with temp_app() as app, tempfile.TemporaryDirectory() as cache_dir:
+        add_creatures(app, args.creatures)
+        app.extensions['db_pool'].close_all()
+        base = {'TESTING': True, 'DATABASE': app.config['DATABASE']}
+        cached = dict(base, TEMPLATE_CACHE=cache_dir)
+        # Fill the template cache once.
+        start_worker(cached)
+
+        print('%-16s %8s %8s %8s  first requests (ms)'
+              % ('', 'process', 'create', 'pages'))
+        for name, config in [
+                ('no cache', dict(base, TEMPLATE_CACHE=None)),
+                ('template cache', cached),
+                ('cache + warmup', dict(cached, WARMUP=True))]:
+            runs = [start_worker(config) for _ in range(args.runs)]
+            wall = statistics.median(r[0] for r in runs)
+            timings = [statistics.median(r[1][i] for r in runs)
+                       for i in range(len(PATHS) + 1)]
+            print('%-16s %8.1f %8.1f %8.1f  %s'
+                  % (name, wall * 1e3, timings[0] * 1e3,
+                     sum(timings[1:]) * 1e3,
+                     ' '.join('%.1f' % (t * 1e3) for t in timings[1:])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Compare the sighting summaries with counting the sightings
+
+For each number of sightings, spread over many users and the last
+year, report the time of the front page and category page lookups
+read from the summary tables and counted from the sighting table,
+how long 'flask rebuildsummaries' takes, and what the triggers add
+to recording a sighting.
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.common import add_creatures, measure, temp_app
+from wallowawildlife.db import get_db
+from wallowawildlife.summaries import most_seen, rebuild_summaries
+
+USER_ID = 1
+
+
+def add_sightings(db, count, users, creatures):
+    """Insert count random sightings without firing the triggers"""
+    triggers = db.execute("SELECT name, sql FROM sqlite_master \
+                           WHERE type = 'trigger' \
+                           AND tbl_name = 'sighting'").fetchall()
+    for t in triggers:
+        db.execute('DROP TRIGGER %s' % t['name'])
+
+    rng = random.Random(count)
+    now = time.time()
+    db.executemany(
+        'INSERT INTO sighting (user_id, creature_id, seen_at, count) \
+         VALUES (?, ?, ?, ?)',
+        ((rng.randrange(users) + 1, rng.randrange(creatures) + 1,
+          time.strftime('%Y-%m-%d %H:%M:%S',
+                        time.gmtime(now - rng.random() * 365 * 86400)),
+          rng.randrange(5) + 1) for _ in range(count)))
+
+    for t in triggers:
+        db.execute(t['sql'])
+    db.commit()
+
+
+def lookups(db):
+    """Return the dashboard lookups, from the summaries and counted"""
+    return [
+        ('progress',
+         lambda: db.execute('SELECT type_id, seen FROM checklist_progress \
+                             WHERE user_id = ?', (USER_ID,)).fetchall(),
+         lambda: db.execute('SELECT creature.type_id, \
+                                    COUNT(DISTINCT creature.id) \
+                             FROM sighting JOIN creature \
+                             ON creature.id = sighting.creature_id \
+                             WHERE sighting.user_id = ? \
+                             GROUP BY creature.type_id',
+                            (USER_ID,)).fetchall()),
+        ('most seen',
+         most_seen,
+         lambda: db.execute("SELECT creature_id, COUNT(*) AS n \
+                             FROM sighting \
+                             WHERE seen_at > date('now', '-7 days') \
+                             GROUP BY creature_id \
+                             ORDER BY n DESC LIMIT 10").fetchall()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sightings', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--creatures', type=int, default=2000)
+    args = parser.parse_args()
+
+    for count in args.sightings:
+        with temp_app(PAGE_CACHE_SIZE=0) as app, app.app_context():
+            add_creatures(app, args.creatures)
+            db = get_db()
+            add_sightings(db, count, args.users, args.creatures)
+
+            start = time.perf_counter()
+            rebuild_summaries()
+            rebuild = time.perf_counter() - start
+
+            print('%d sightings: rebuild %.2f s' % (count, rebuild))
+            print('  %-10s %14s %14s'
+                  % ('', 'summary (ms)', 'counted (ms)'))
+            for name, summary, counted in lookups(db):
+                print('  %-10s %14.3f %14.3f'
+                      % (name, measure(summary, 50) * 1e3,
+                         measure(counted, 5) * 1e3))
+
+            def insert(table='sighting'):
+                db.execute('INSERT INTO %s (user_id, creature_id, \
+                                            seen_at, count) \
+                            VALUES (?, ?, CURRENT_TIMESTAMP, 1)' % table,
+                           (USER_ID, random.randrange(args.creatures) + 1))
+
+            db.execute('CREATE TEMP TABLE plain AS \
+                        SELECT * FROM sighting WHERE 0')
+            with_triggers = measure(insert, 1000)
+            without = measure(lambda: insert('temp.plain'), 1000)
+            db.rollback()
+            print('  insert: %.1f us, %.1f us without the triggers'
+                  % (with_triggers * 1e6, without * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Benchmark Helpers
+
+Functions shared by the benchmark scripts for building throwaway
+apps and databases and for timing code.
+"""
+
+import os
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from wallowawildlife import create_app
+from wallowawildlife.db import get_db, init_db
+
+
+@contextmanager
+def temp_app(**config):
+    """Yield an app backed by a freshly initialized temporary database"""
+    db_fd, db_path = tempfile.mkstemp(suffix='.sqlite')
+    settings = {'TESTING': True, 'DATABASE': db_path}
+    settings.update(config)
+    app = create_app(settings)
+
+    with app.app_context():
+        init_db()
+
+    try:
+        yield app
+    finally:
+        if 'db_pool' in app.extensions:
+            app.extensions['db_pool'].close_all()
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def add_users(app, count):
+    """Add count synthetic users named user-0, user-1, ...
+
+    The salted hashes use a single PBKDF2 iteration so that large
+    tables can be built quickly; lookups never depend on them.
+    """
+    from wallowawildlife.auth import gplus_digest
+
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO user (gplus_id, gplus_digest) VALUES (?, ?)',
+            ((generate_password_hash('user-%d' % i, 'pbkdf2:sha256:1'),
+              gplus_digest('user-%d' % i)) for i in range(count)))
+        db.commit()
+
+
+TYPE_IDS = ['mammal', 'bird', 'reptile_amphibian', 'tree_shrub', 'fish',
+            'wildflower', 'spider_insect']
+
+
+def add_creatures(app, count, type_ids=TYPE_IDS):
+    """Add count synthetic creatures spread evenly over type_ids"""
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO creature (name_common, name_latin, type_id, \
+                                   photo_url, photo_attr, wiki_url, user_id) \
+             VALUES (?, ?, ?, ?, ?, ?, 1)',
+            (('Creature %07d' % i, 'Creatura synthetica %d' % i,
+              type_ids[i % len(type_ids)],
+              'https://example.org/%d.jpg' % i, 'Synthetic (CC0)',
+              'https://en.wikipedia.org/wiki/Creature_%d' % i)
+             for i in range(count)))
+        db.commit()
+
+
+def measure(func, repeat=200):
+    """Call func repeat times and return the median seconds per call"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that does not log every request"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@contextmanager
+def serve(app):
+    """Serve app with a multi-threaded WSGI server and yield its URL"""
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield 'http://127.0.0.1:%d' % server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def percentile(timings, fraction):
+    """Return the value below which fraction of the timings fall"""
+    ordered = sorted(timings)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
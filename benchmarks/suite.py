@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""Run the benchmark suite and compare it with a baseline
+
+Build a synthetic catalogue and user table, time the hot paths with
+the Flask test client and with a multi-threaded server, and write the
+seconds per operation of each case as JSON. Every case is run in
+several trials, interleaved with the others, and the fastest trial is
+kept: background noise only ever makes a trial slower. Given a
+baseline written by an earlier run, every case that has become slower
+both by more than the tolerance and by more than the floor is reported
+and the run exits with status 1.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline benchmarks/baseline.json
+
+Timings depend on the machine, so compare runs made on the same one.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import requests
+from flask import session
+
+from benchmarks.bench_initdb import write_csv
+from benchmarks.common import (
+    add_creatures, add_users, measure, percentile, serve, temp_app
+)
+from wallowawildlife.auth import gplus_digest, load_logged_in_user
+from wallowawildlife.db import get_db, init_db
+from wallowawildlife.pagecache import PageCache
+
+# Pages fetched by the server throughput case, in turn.
+SERVER_PATHS = ['/wildlife', '/wildlife/mammal', '/wildlife/1/',
+                '/wildlife/JSON', '/wildlife/bird/JSON',
+                '/wildlife/search/JSON?q=creature+12']
+
+
+def client_cases(app, args):
+    """Yield the name and a callable of each test client case"""
+    client = app.test_client()
+
+    def get(path, **kwargs):
+        """Return a callable fetching path, checking it succeeds"""
+        def fetch():
+            response = client.get(path, **kwargs)
+            assert response.status_code in (200, 304), path
+        return fetch
+
+    yield 'list_page', get('/wildlife')
+    yield 'category_page', get('/wildlife/mammal')
+    yield 'creature_page', get('/wildlife/%d/' % (args.creatures // 2))
+    yield 'search_page', get('/wildlife/search?q=creature+12')
+    yield 'json_page', get('/wildlife/JSON')
+    yield 'json_category', get('/wildlife/mammal/JSON')
+    yield 'json_ids', get('/wildlife/JSON?ids=' + ','.join(
+        str(i) for i in range(1, args.creatures, args.creatures // 100)))
+    yield 'json_search', get('/wildlife/search/JSON?q=creature+12')
+
+    etag = client.get('/wildlife/mammal').headers['ETag']
+    yield 'revalidate_304', get('/wildlife/mammal',
+                                headers={'If-None-Match': etag})
+
+    # The rest are served from a page cache.
+    app.extensions['page_cache'] = PageCache(16)
+    yield 'list_page_cached', get('/wildlife')
+    del app.extensions['page_cache']
+
+
+def auth_cases(app, args):
+    """Yield the load_logged_in_user cases"""
+    gplus_id = 'user-%d' % (args.users // 2)
+    with app.app_context():
+        pk = get_db().execute('SELECT id FROM user WHERE gplus_digest = ?',
+                              (gplus_digest(gplus_id),)).fetchone()[0]
+
+    def load(user_pk):
+        """Return a callable loading the user in a fresh request"""
+        def run():
+            with app.test_request_context('/'):
+                session['user_id'] = gplus_id
+                if user_pk is not None:
+                    session['user_pk'] = user_pk
+                load_logged_in_user()
+        return run
+
+    yield 'load_user', load(pk)
+    yield 'load_user_first', load(None)
+
+
+def server_throughput(app, args):
+    """Return the seconds per request and p95 latency of a busy server"""
+    timings = []
+
+    def worker(n):
+        client = requests.Session()
+        end = time.perf_counter() + args.duration
+        i = n
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            response = client.get(base_url
+                                  + SERVER_PATHS[i % len(SERVER_PATHS)])
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200
+            i += 1
+
+    with serve(app) as base_url:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(worker, range(args.concurrency)))
+        wall = time.perf_counter() - start
+
+    return wall / len(timings), percentile(timings, 0.95)
+
+
+def time_init_db(args):
+    """Return the median seconds to load a CSV of args.creatures rows"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'creatures.csv')
+        write_csv(csv_path, args.creatures)
+        with temp_app(PAGE_CACHE_SIZE=0) as app, app.app_context():
+            return measure(lambda: init_db(csv_path), repeat=3)
+
+
+def run(args):
+    """Run every case args.trials times and return the fastest trials"""
+    trials = {}
+
+    def record(name, seconds):
+        trials.setdefault(name, []).append(seconds)
+
+    with temp_app(PAGE_CACHE_SIZE=0) as app:
+        add_creatures(app, args.creatures)
+        add_users(app, args.users)
+
+        for trial in range(args.trials):
+            print('trial %d of %d' % (trial + 1, args.trials),
+                  file=sys.stderr)
+            # The cases are generated afresh, as some set up state
+            # around the ones that follow.
+            for name, func in chain(client_cases(app, args),
+                                    auth_cases(app, args)):
+                func()
+                record(name, measure(func, args.repeat))
+            per_request, p95 = server_throughput(app, args)
+            record('server_request', per_request)
+            record('server_p95', p95)
+
+    for _ in range(args.trials):
+        record('init_db', time_init_db(args))
+
+    results = {}
+    for name, seconds in trials.items():
+        results[name] = min(seconds)
+        print('%-20s %10.3f ms  (slowest trial %.3f ms)'
+              % (name, min(seconds) * 1e3, max(seconds) * 1e3),
+              file=sys.stderr)
+
+    return {
+        'meta': {
+            'creatures': args.creatures,
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'trials': args.trials,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'date': time.strftime('%Y-%m-%d'),
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance, floor):
+    """Print each case against the baseline and return the regressions
+
+    A case regresses when it is slower than the baseline by more than
+    the tolerance, as a fraction, and by more than floor seconds, so
+    that jitter in the fastest cases is not taken for a slowdown.
+    """
+    regressions = []
+    print('%-20s %12s %12s %8s' % ('case', 'baseline ms', 'now ms',
+                                   'change'))
+    for name, seconds in sorted(results['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            print('%-20s %12s %12.3f' % (name, '-', seconds * 1e3))
+            continue
+
+        change = seconds / before - 1
+        flag = ''
+        if change > tolerance and seconds - before > floor:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-20s %12.3f %12.3f %+7.0f%%%s'
+              % (name, before * 1e3, seconds * 1e3, change * 100, flag))
+
+    settings = dict(results['meta'], date=baseline['meta'].get('date'))
+    if baseline['meta'] != settings:
+        print('Note: the baseline was made with different settings.')
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--creatures', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='calls per test client case in each trial')
+    parser.add_argument('--trials', type=int, default=5,
+                        help='times to run every case, keeping the fastest')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds of load on the threaded server in '
+                             'each trial')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--baseline',
+                        help='compare with the results in this file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown allowed before failing, as a '
+                             'fraction (default 0.25)')
+    parser.add_argument('--floor', type=float, default=0.2,
+                        help='slowdown in milliseconds allowed whatever '
+                             'the tolerance (default 0.2)')
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance,
+                              args.floor / 1e3)
+        if regressions:
+            print('%d cases slower than the baseline by more than %d%% '
+                  'and %.1f ms: %s'
+                  % (len(regressions), args.tolerance * 100, args.floor,
+                     ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
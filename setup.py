@@ -14,19 +14,27 @@ setup(
     maintainer_email='jenner@wickerbox.net',
     description='Allows users to log in and maintain wildlife checklists.',
     long_description=readme,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     zip_safe=False,
     install_requires=[
         'flask',
-        'httplib2',
         'requests',
-        'oauth2client'
+        'rsa',
     ],
     extras_require={
         'test': [
             'pytest',
             'coverage',
         ],
+        'images': [
+            'Pillow',
+        ],
+        'brotli': [
+            'brotli',
+        ],
+        'asgi': [
+            'uvicorn',
+        ],
     },
 )
@@ -2,6 +2,7 @@ import os
 import tempfile
 
 import pytest
+from google_standin import GoogleStandin
 from wallowawildlife import create_app
 from wallowawildlife.db import get_db, init_db
 
@@ -16,6 +17,7 @@ def app():
   app = create_app({
     'TESTING': True,
     'DATABASE': db_path,
+    'TEMPLATE_CACHE': None,
   })
 
   with app.app_context():
@@ -24,10 +26,26 @@ def app():
 
   yield app
 
+  if 'db_pool' in app.extensions:
+    app.extensions['db_pool'].close_all()
   os.close(db_fd)
   os.unlink(db_path)
 
 
+@pytest.fixture
+def google(app, tmp_path):
+  standin = GoogleStandin('test-client-id').start()
+  secrets_path = str(tmp_path / 'client_secrets.json')
+  standin.write_client_secrets(secrets_path)
+  app.config.update(CLIENT_SECRETS=secrets_path,
+                    TOKENINFO_URL=standin.tokeninfo_url,
+                    GOOGLE_CERTS_URL=standin.certs_url)
+
+  yield standin
+
+  standin.stop()
+
+
 @pytest.fixture
 def client(app):
   return app.test_client()
@@ -39,19 +57,22 @@ def runner(app):
 
 
 class AuthActions(object):
-    def __init__(self, client):
-        self._client = client
+  """Sign in through the Google stand-in, which takes the code as gplus_id"""
+
+  def __init__(self, client):
+    self._client = client
 
-    def login(self, name='test', password='test'):
-        return self._client.post(
-            '/auth/login',
-            data={'name': name, 'password': password}
-        )
+  def login(self, gplus_id='test-gplus-id', state=None):
+    self._client.get('/auth/login')
+    if state is None:
+      with self._client.session_transaction() as sess:
+        state = sess['state']
+    return self._client.post('/auth/login?state=' + state, data=gplus_id)
 
-    def logout(self):
-        return self._client.get('/auth/logout')
+  def logout(self):
+    return self._client.get('/auth/logout')
 
 
 @pytest.fixture
 def auth(client):
-    return AuthActions(client)
+  return AuthActions(client)
@@ -1,4 +1,7 @@
-INSERT INTO user (name, password)
+-- 'other' predates the gplus_digest column and has no digest yet.
+INSERT INTO user (gplus_id, gplus_digest)
 VALUES
-  ('test', 'pbkdf2:sha256:50000$TCI4GzcX$0de171a4f4dac32e3364c7ddc7c14f3e2fa61f2d17574483f7ffbb431b4acb2f'),
-  ('other', 'pbkdf2:sha256:50000$kJPKsz6N$d2d4784f1b030a9761f5ccaeeaca413f27f2ecb76d6168407af962ddce849f79');
+  ('pbkdf2:sha256:1000$Cefr0NiDkcOYrU3g$8f26f8f410096a1d2a211a289960b9ebf4b30942af3f2e0e37a5535ff2a0fbb2',
+   '57a8e24c347cc4277e1a37d43197df3b2749ab5f4d3880cf113f20a370972e1b'),
+  ('pbkdf2:sha256:1000$tnyXrnCZwPXbQx3x$f704a05d9b47fa479e271bbde422791c2a3d2bb411aa8bb97104be7536db2ddc',
+   NULL);
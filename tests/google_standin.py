@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""Google Sign-In Stand-in
+
+A local HTTP server that answers like Google's OAuth token and
+tokeninfo endpoints, so the login flow can be exercised without
+network access. The authorization code posted to /auth/login is
+treated as the gplus_id of the user signing in.
+
+ID tokens are unsigned unless the stand-in is made with sign=True,
+in which case they are signed with RS256 by a key published at
+/certs, as Google's are.
+"""
+
+import base64
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _b64(data):
+    """Encode a dict as an unpadded base64url JSON segment"""
+    raw = json.dumps(data).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+class GoogleStandin(object):
+    """Serve stand-ins for the /token and /tokeninfo endpoints
+
+    latency is the number of seconds each response is delayed by,
+    to imitate the round trip to Google. hits counts the requests
+    made to each path.
+    """
+
+    def __init__(self, client_id, latency=0.0, sign=False):
+        self.client_id = client_id
+        self.latency = latency
+        self.requests = 0
+        self.hits = Counter()
+        self._server = None
+        self._key = None
+        if sign:
+            import rsa
+            self._key = rsa.newkeys(1024)
+
+    def id_token(self, gplus_id, hash_method='SHA-256', **claims):
+        """Return an ID token for gplus_id, signed if the key is set
+
+        The header always says RS256, whatever hash_method signs it.
+        """
+        claims = dict({'sub': gplus_id,
+                       'aud': self.client_id,
+                       'iss': 'https://accounts.google.com',
+                       'exp': int(time.time()) + 3600}, **claims)
+        if self._key is None:
+            return '.'.join([_b64({'alg': 'none'}), _b64(claims), ''])
+
+        import rsa
+        signed = '.'.join([_b64({'alg': 'RS256', 'kid': 'standin'}),
+                           _b64(claims)])
+        signature = rsa.sign(signed.encode('ascii'), self._key[1],
+                             hash_method)
+        return signed + '.' + base64.urlsafe_b64encode(signature) \
+            .rstrip(b'=').decode('ascii')
+
+    def _jwks(self):
+        """Return the public key as a JSON Web Key Set"""
+        public = self._key[0]
+
+        def b64int(n):
+            raw = n.to_bytes((n.bit_length() + 7) // 8, 'big')
+            return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+        return {'keys': [{'kty': 'RSA', 'alg': 'RS256', 'use': 'sig',
+                          'kid': 'standin',
+                          'n': b64int(public.n), 'e': b64int(public.e)}]}
+
+    @property
+    def url(self):
+        """Base URL of the running server"""
+        host, port = self._server.server_address
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def tokeninfo_url(self):
+        """URL to use for the TOKENINFO_URL config value"""
+        return self.url + '/tokeninfo'
+
+    @property
+    def certs_url(self):
+        """URL to use for the GOOGLE_CERTS_URL config value"""
+        return self.url + '/certs'
+
+    def write_client_secrets(self, path):
+        """Write a client_secrets.json that points at this server"""
+        with open(path, 'w') as f:
+            json.dump({'web': {
+                'client_id': self.client_id,
+                'client_secret': 'standin-secret',
+                'auth_uri': self.url + '/auth',
+                'token_uri': self.url + '/token',
+                'redirect_uris': ['postmessage'],
+            }}, f)
+
+    def start(self):
+        """Start serving on a free local port in a daemon thread"""
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answer token exchanges and tokeninfo lookups"""
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = parse_qs(self.rfile.read(length).decode('utf-8'))
+                gplus_id = form['code'][0]
+                self._reply({'access_token': 'token-' + gplus_id,
+                             'token_type': 'Bearer',
+                             'expires_in': 3600,
+                             'id_token': standin.id_token(gplus_id)})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == '/certs' and standin._key is not None:
+                    self._reply(standin._jwks())
+                    return
+
+                query = parse_qs(url.query)
+                token = query.get('access_token', [''])[0]
+                if not token.startswith('token-'):
+                    self._reply({'error': 'invalid_token'}, 400)
+                    return
+                self._reply({'user_id': token[len('token-'):],
+                             'issued_to': standin.client_id,
+                             'expires_in': 3600})
+
+            def _reply(self, data, status=200):
+                standin.requests += 1
+                standin.hits[urlparse(self.path).path] += 1
+                if standin.latency:
+                    time.sleep(standin.latency)
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    # The client gave up waiting.
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever,
+                         daemon=True).start()
+        return self
+
+    def stop(self):
+        """Shut the server down"""
+        self._server.shutdown()
+        self._server.server_close()
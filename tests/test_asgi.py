@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+from wallowawildlife import asgi
+from wallowawildlife.asgi import ReadOnlyAPI
+
+
+@pytest.fixture
+def api(app):
+  api = ReadOnlyAPI(app)
+  yield api
+  api.executor.shutdown()
+
+
+def call(api, path, method='GET', headers=()):
+  path, _, query = path.partition('?')
+  scope = {'type': 'http', 'method': method, 'path': path,
+           'query_string': query.encode(), 'http_version': '1.1',
+           'scheme': 'http', 'server': ('localhost', 80),
+           'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}
+  messages = []
+
+  async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+  async def send(message):
+    messages.append(message)
+
+  asyncio.run(api(scope, receive, send))
+  start = messages[0]
+  headers = dict((k.decode(), v.decode()) for k, v in start['headers'])
+  return start['status'], headers, messages[1:]
+
+
+def body(messages):
+  return b''.join(m['body'] for m in messages)
+
+
+@pytest.mark.parametrize('path', (
+  '/wildlife/3/JSON',
+  '/wildlife/999/JSON',
+  '/wildlife/bird/JSON?limit=2',
+  '/wildlife/JSON?limit=5',
+  '/wildlife/JSON?ids=1,2',
+  '/wildlife/JSON?ids=x',
+))
+def test_same_as_wsgi(api, client, path):
+  status, headers, messages = call(api, path)
+  expected = client.get(path)
+  assert status == expected.status_code
+  assert body(messages) == expected.data
+  for name in ('Content-Type', 'ETag', 'Link', 'Location'):
+    assert headers.get(name.lower()) == expected.headers.get(name)
+
+
+def test_not_modified(api):
+  _, headers, _ = call(api, '/wildlife/JSON')
+  status, _, messages = call(api, '/wildlife/JSON',
+                             headers=[('If-None-Match', headers['etag'])])
+  assert status == 304
+  assert body(messages) == b''
+
+
+@pytest.mark.parametrize(('path', 'method'), (
+  ('/wildlife', 'GET'),
+  ('/auth/login', 'GET'),
+  ('/wildlife/batch', 'POST'),
+  ('/nowhere', 'GET'),
+))
+def test_other_routes(api, path, method):
+  status, _, messages = call(api, path, method)
+  assert status == 404
+  assert json.loads(body(messages)) == {'error': 'Not found.'}
+
+
+def test_streamed_in_chunks(api, monkeypatch):
+  monkeypatch.setattr(asgi, 'CHUNK_SIZE', 100)
+  status, _, messages = call(api, '/wildlife/JSON?all')
+  assert status == 200
+  assert len(messages) >= 2
+  assert [m['more_body'] for m in messages][-2:] == [True, False]
+  assert len(json.loads(body(messages))) == 22
+  assert api.app.extensions['db_pool'].stats()['in_use'] == 0
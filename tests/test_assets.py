@@ -0,0 +1,43 @@
+import gzip
+import re
+
+from flask import url_for
+from wallowawildlife import create_app
+
+STYLE_RE = re.compile(rb'/static/css/style\.[0-9a-f]{12}\.css')
+
+
+def test_fingerprinted_urls(client):
+  response = client.get('/')
+  assert STYLE_RE.search(response.data)
+  assert b'/static/css/style.css' not in response.data
+
+
+def test_hashed_file_cached_forever(client):
+  path = STYLE_RE.search(client.get('/').data).group().decode()
+  response = client.get(path)
+  assert response.status_code == 200
+  assert response.mimetype == 'text/css'
+  assert 'immutable' in response.headers['Cache-Control']
+  assert 'max-age=31536000' in response.headers['Cache-Control']
+  assert 'Content-Encoding' not in response.headers
+
+  plain = client.get('/static/css/style.css')
+  assert plain.data == response.data
+  assert 'immutable' not in plain.headers.get('Cache-Control', '')
+
+
+def test_compressed_file(client):
+  path = STYLE_RE.search(client.get('/').data).group().decode()
+  plain = client.get(path)
+  response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+  assert response.headers['Content-Encoding'] == 'gzip'
+  assert 'Accept-Encoding' in response.headers['Vary']
+  assert gzip.decompress(response.data) == plain.data
+
+
+def test_fingerprints_off():
+  app = create_app({'TESTING': True, 'ASSET_FINGERPRINTS': False})
+  with app.test_request_context():
+    assert url_for('static', filename='css/style.css') \
+        == '/static/css/style.css'
@@ -3,55 +3,103 @@ from flask import g, session
 from wallowawildlife.db import get_db
 
 
-def test_register(client, app):
-  assert client.get('/auth/register').status_code == 200
-  response = client.post(
-    '/auth/register', data={'name': 'a', 'password': 'a'}
-  )
-  assert 'http://localhost/auth/login' == response.headers['Location']
-
-  with app.app_context():
-    assert get_db().execute(
-      "select * from user where name = 'a'",
-    ).fetchone() is not None
-
-
-@pytest.mark.parametrize(('name', 'password', 'message'), (
-  ('', '', b'Username is required.'),
-  ('a', '', b'Password is required.'),
-  ('test', 'test', b'already registered'),
-))
-def test_register_validate_input(client, name, password, message):
-  response = client.post(
-    '/auth/register',
-    data={'name': name, 'password': password}
-  )
-  assert message in response.data
+def test_login_page(client):
+  with client:
+    response = client.get('/auth/login')
+    assert response.status_code == 200
+    assert session['state'].encode() in response.data
 
 
-def test_login(client, auth):
-  assert client.get('/auth/login').status_code == 200
+def test_login(client, auth, google):
   response = auth.login()
-  assert response.headers['Location'] == 'http://localhost/'
+  assert response.headers['Location'] == '/wildlife'
 
   with client:
     client.get('/')
-    assert session['user_id'] == 1
-    assert g.user['name'] == 'test'
+    assert session['user_id'] == 'test-gplus-id'
+    assert g.user_id == 2
 
 
-@pytest.mark.parametrize(('name', 'password', 'message'), (
-  ('a', 'test', b'Incorrect username.'),
-  ('test', 'a', b'Incorrect password.'),
+@pytest.mark.parametrize(('state', 'client_id', 'message'), (
+  ('wrong-state', None, b'Invalid state parameter.'),
+  (None, 'another-app', b"Token's client ID does not match app's."),
 ))
-def test_login_validate_input(auth, name, password, message):
-  response = auth.login(name, password)
+def test_login_validate_input(client, app, auth, google, state, client_id,
+                              message):
+  if client_id is not None:
+    app.config['CLIENT_ID'] = client_id
+  response = auth.login(state=state)
+  assert response.status_code == 401
   assert message in response.data
 
+  with client:
+    client.get('/')
+    assert g.user_id is None
 
-def test_logout(client, auth):
+
+def test_logout(client, auth, google):
   auth.login()
 
   with client:
     auth.logout()
     assert 'user_id' not in session
+
+
+def test_load_logged_in_user(client):
+  with client:
+    with client.session_transaction() as sess:
+      sess['user_id'] = 'test-gplus-id'
+    client.get('/')
+    assert g.user_id == 2
+    assert session['user_pk'] == 2
+
+
+def test_login_backfills_digest(client, app, auth, google):
+  # Requests only look users up by their digest.
+  with client:
+    with client.session_transaction() as sess:
+      sess['user_id'] = 'other-gplus-id'
+    client.get('/')
+    assert g.user_id is None
+
+  with client:
+    auth.login('other-gplus-id')
+    assert session['user_pk'] == 3
+
+  with app.app_context():
+    assert get_db().execute(
+      'SELECT gplus_digest FROM user WHERE id = 3'
+    ).fetchone()[0] is not None
+
+
+def test_legacy_lookup_off(client, app, auth, google):
+  app.config['LEGACY_GPLUS_LOOKUP'] = False
+  with client:
+    auth.login('other-gplus-id')
+    assert session['user_pk'] == 4
+
+
+def test_load_logged_in_user_unknown(client):
+  with client:
+    with client.session_transaction() as sess:
+      sess['user_id'] = 'nobody'
+    client.get('/')
+    assert g.user_id is None
+    assert 'user_id' not in session
+
+
+@pytest.mark.parametrize(('gplus_id', 'user_pk', 'user_count'), (
+  ('test-gplus-id', 2, 3),
+  ('other-gplus-id', 3, 3),
+  ('new-gplus-id', 4, 4),
+))
+def test_google_login(client, app, auth, google, gplus_id, user_pk,
+                      user_count):
+  with client:
+    response = auth.login(gplus_id)
+    assert response.headers['Location'].endswith('/wildlife')
+    assert session['user_pk'] == user_pk
+
+  with app.app_context():
+    count = get_db().execute('SELECT COUNT(*) FROM user').fetchone()[0]
+    assert count == user_count
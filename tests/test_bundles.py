@@ -0,0 +1,130 @@
+import io
+import json
+import os
+import zipfile
+
+import pytest
+from wallowawildlife.bundles import delta_start
+from wallowawildlife.db import get_db
+from wallowawildlife.images import build_images
+
+
+@pytest.fixture
+def bundle_cache(app, tmp_path):
+  app.config['BUNDLE_CACHE'] = str(tmp_path / 'bundles')
+  return app.config['BUNDLE_CACHE']
+
+
+def read_bundle(response):
+  assert response.status_code == 200
+  assert response.mimetype == 'application/zip'
+  with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+    return json.loads(archive.read('catalogue.json'))
+
+
+def test_delta_start():
+  assert delta_start('abc-3', 'abc-5') == 3
+  assert delta_start('abc-5', 'abc-5') == 5
+  assert delta_start('abc-6', 'abc-5') is None
+  assert delta_start('def-3', 'abc-5') is None
+  assert delta_start('nonsense', 'abc-5') is None
+  assert delta_start(None, 'abc-5') is None
+
+
+def test_full_bundle(client, app, bundle_cache):
+  response = client.get('/wildlife/bundle')
+  bundle = read_bundle(response)
+  assert bundle['version'] == response.headers['X-Catalogue-Version']
+  assert bundle['since'] is None
+  assert bundle['deleted'] == []
+
+  with app.app_context():
+    count = get_db().execute('SELECT COUNT(*) FROM creature').fetchone()[0]
+  assert len(bundle['creatures']) == count
+  elk = dict(zip(bundle['fields'], bundle['creatures'][0]))
+  assert elk['name_common'] == 'Rocky Mountain Elk'
+
+  mammals = read_bundle(client.get('/wildlife/bundle?type=mammal'))
+  assert mammals['type'] == 'mammal'
+  assert 0 < len(mammals['creatures']) < count
+  assert all(c[3] == 'mammal' for c in mammals['creatures'])
+
+
+def test_delta_bundle(client, bundle_cache):
+  version = client.get('/wildlife/bundle').headers['X-Catalogue-Version']
+
+  with client.session_transaction() as sess:
+    sess['user_id'] = 'adminpass'
+  client.post('/wildlife/1/delete')
+  client.post('/wildlife/2/edit', data={
+    'name_common': 'Gray Wolf', 'name_latin': 'Canis lupus',
+    'photo_url': '', 'photo_attr': '', 'wiki_url': '', 'type_id': 'bird'})
+  with client.session_transaction() as sess:
+    sess.clear()
+
+  delta = read_bundle(client.get('/wildlife/bundle?since=' + version))
+  assert delta['since'] == version
+  assert delta['deleted'] == [1]
+  assert [c[0] for c in delta['creatures']] == [2]
+
+  mammals = read_bundle(
+    client.get('/wildlife/bundle?type=mammal&since=' + version))
+  assert mammals['deleted'] == [1, 2]
+  assert mammals['creatures'] == []
+
+  up_to_date = read_bundle(
+    client.get('/wildlife/bundle?since=' + delta['version']))
+  assert up_to_date['deleted'] == []
+  assert up_to_date['creatures'] == []
+
+
+def test_bundle_cached(client, bundle_cache):
+  first = client.get('/wildlife/bundle')
+  assert len(os.listdir(bundle_cache)) == 1
+
+  second = client.get('/wildlife/bundle')
+  assert second.data == first.data
+
+  response = client.get('/wildlife/bundle',
+                        headers={'If-None-Match': second.headers['ETag']})
+  assert response.status_code == 304
+
+  with client.session_transaction() as sess:
+    sess['user_id'] = 'adminpass'
+  client.post('/wildlife/1/delete')
+  client.get('/wildlife/bundle')
+  assert len(os.listdir(bundle_cache)) == 1
+
+
+def test_bundle_invalid_type(client):
+  response = client.get('/wildlife/bundle?type=dragon')
+  assert response.headers['Location'] == '/'
+
+
+def test_bundle_command(runner, tmp_path):
+  output = tmp_path / 'bundle.zip'
+  result = runner.invoke(args=['bundle', str(output), '--type', 'fish'])
+  assert 'Wrote a full bundle of catalogue version' in result.output
+
+  with zipfile.ZipFile(str(output)) as archive:
+    assert json.loads(archive.read('catalogue.json'))['type'] == 'fish'
+
+  result = runner.invoke(args=['bundle', str(output), '--type', 'dragon'])
+  assert 'No such category' in result.output
+
+
+def test_bundle_thumbnails(client, app, tmp_path, bundle_cache):
+  Image = pytest.importorskip('PIL.Image')
+  source = tmp_path / 'img'
+  source.mkdir()
+  Image.new('RGB', (400, 300), 'brown').save(str(source / 'elk.jpg'))
+  app.config['IMAGE_STORE'] = str(tmp_path / 'store')
+  build_images(str(source), app.config['IMAGE_STORE'], workers=1)
+
+  response = client.get('/wildlife/bundle?type=mammal')
+  with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+    bundle = json.loads(archive.read('catalogue.json'))
+    thumb = bundle['creatures'][0][-1]
+    assert thumb.startswith('thumbs/')
+    assert archive.read(thumb)[:2] == b'\xff\xd8'
+    assert archive.namelist() == ['catalogue.json', thumb]
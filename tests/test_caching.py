@@ -0,0 +1,46 @@
+import pytest
+
+
+@pytest.mark.parametrize('path', (
+  '/wildlife',
+  '/wildlife/bird',
+  '/wildlife/1/',
+  '/wildlife/JSON',
+  '/wildlife/bird/JSON',
+  '/wildlife/1/JSON',
+))
+def test_not_modified(client, path):
+  response = client.get(path)
+  etag = response.headers['ETag']
+
+  response = client.get(path, headers={'If-None-Match': etag})
+  assert response.status_code == 304
+  assert response.data == b''
+
+
+def test_etag_varies(client):
+  etags = set(client.get(path).headers['ETag'] for path in (
+    '/wildlife', '/wildlife?limit=5', '/wildlife/bird', '/wildlife/fish'))
+  assert len(etags) == 4
+
+
+def test_write_changes_etag(client):
+  etag = client.get('/wildlife').headers['ETag']
+
+  with client.session_transaction() as sess:
+    sess['user_id'] = 'adminpass'
+  client.post('/wildlife/1/delete')
+  with client.session_transaction() as sess:
+    sess.clear()
+
+  response = client.get('/wildlife', headers={'If-None-Match': etag})
+  assert response.status_code == 200
+  assert b'Rocky Mountain Elk' not in response.data
+
+
+def test_not_modified_skips_creature_table(client, app):
+  app.config['COUNT_QUERIES'] = True
+  etag = client.get('/wildlife').headers['ETag']
+
+  response = client.get('/wildlife', headers={'If-None-Match': etag})
+  assert response.headers['X-Query-Count'] == '1'
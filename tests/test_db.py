@@ -1,10 +1,16 @@
+import datetime
 import sqlite3
 
 import pytest
-from wallowawildlife.db import get_db
+from wallowawildlife.db import (
+  MIGRATIONS, get_catalogue_version, get_creature_type, get_creature_types,
+  get_db, import_creatures, init_db, invalidate_creature_types, migrate_db
+)
 
 
 def test_get_close_db(app):
+  app.extensions.pop('db_pool').close_all()
+
   with app.app_context():
     db = get_db()
     assert db is get_db()
@@ -15,14 +21,198 @@ def test_get_close_db(app):
   assert 'closed' in str(e)
 
 
+def test_pooled_db(app):
+  with app.app_context():
+    db = get_db()
+    db.execute('SELECT 1 FROM creature')
+    assert db.in_transaction is False
+
+  with app.app_context():
+    assert get_db() is db
+    assert get_db().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+  stats = app.extensions['db_pool'].stats()
+  assert stats['idle'] == 1
+  assert stats['in_use'] == 0
+  assert stats['reused'] >= 1
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder(object):
         called = False
 
-    def fake_init_db():
+    def fake_init_db(**kwargs):
         Recorder.called = True
+        return 22, []
 
     monkeypatch.setattr('wallowawildlife.db.init_db', fake_init_db)
     result = runner.invoke(args=['initdb'])
     assert 'initialized' in result.output
     assert Recorder.called
+
+
+def test_migrate_db(app):
+  with app.app_context():
+    db = get_db()
+    db.executescript('''
+      DROP TABLE user;
+      CREATE TABLE user (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                         gplus_id TEXT UNIQUE NOT NULL);
+      PRAGMA user_version = 0;
+    ''')
+
+    assert migrate_db() == len(MIGRATIONS)
+    assert migrate_db() == 0
+    columns = [c['name'] for c in db.execute('PRAGMA table_info(user)')]
+    assert 'gplus_digest' in columns
+
+
+def test_migrate_db_command(runner):
+  result = runner.invoke(args=['migratedb'])
+  assert 'Applied 0 migration(s).' in result.output
+  assert '1 user(s) have no gplus_digest yet' in result.output
+
+
+def test_creature_types_cached(app, client):
+  app.config['COUNT_QUERIES'] = True
+  app.extensions.pop('page_cache')
+
+  first = client.get('/wildlife')
+  second = client.get('/wildlife')
+  assert b'Mammals' in second.data
+  assert (int(second.headers['X-Query-Count'])
+          == int(first.headers['X-Query-Count']) - 1)
+
+
+def test_init_db_invalidates_creature_types(app):
+  with app.app_context():
+    assert len(get_creature_types()) == 7
+    get_db().execute('DELETE FROM creature_type')
+    assert len(get_creature_types()) == 7
+
+    init_db()
+    get_db().execute("DELETE FROM creature_type WHERE url_text = 'fish'")
+    invalidate_creature_types()
+    assert get_creature_type('fish') is None
+    assert len(get_creature_types()) == 6
+
+
+def test_creature_types_follow_catalogue_version(app):
+  with app.app_context():
+    assert get_creature_type('fish') is not None
+
+  # Another process changes the types, as 'flask initdb' would.
+  db = sqlite3.connect(app.config['DATABASE'])
+  db.execute("DELETE FROM creature_type WHERE url_text = 'fish'")
+  db.execute('UPDATE catalogue SET version = version + 1')
+  db.commit()
+  db.close()
+
+  with app.app_context():
+    assert get_creature_type('fish') is None
+
+
+def test_init_db_csv(app, tmp_path):
+  csv_path = tmp_path / 'creatures.csv'
+  csv_path.write_text(
+    '"Elk, Rocky Mountain",Cervus elaphus,mammal,u,"ODFW, PD",w\n'
+    'Dragon,Draco,dragon,u,a,w\n'
+    'Short,row\n'
+    '\n'
+    'Gray Wolf,Canis lupus,mammal,u,a,w\n'
+  )
+
+  with app.app_context():
+    imported, bad_rows = init_db(csv_path=str(csv_path), batch_size=1)
+    creatures = get_db().execute(
+      'SELECT * FROM creature ORDER BY id').fetchall()
+
+  assert imported == 2
+  assert [line for line, reason in bad_rows] == [2, 3]
+  assert creatures[0]['name_common'] == 'Elk, Rocky Mountain'
+  assert creatures[0]['photo_attr'] == 'ODFW, PD'
+  assert creatures[1]['wiki_url'] == 'w'
+
+
+def test_init_db_failure(app, tmp_path):
+  with app.app_context():
+    db = get_db()
+    synchronous = db.execute('PRAGMA synchronous').fetchone()[0]
+    with pytest.raises(OSError):
+      init_db(csv_path=str(tmp_path / 'missing.csv'), fast=True)
+
+    assert db.execute('PRAGMA synchronous').fetchone()[0] == synchronous
+    names = [r[0] for r in db.execute(
+      "SELECT name FROM sqlite_master WHERE tbl_name = 'creature' \
+       AND type IN ('index', 'trigger')")]
+    assert 'creature_fts_insert' in names
+    assert 'creature_name_idx' in names
+
+
+def test_init_db_command_options(runner, tmp_path):
+  csv_path = tmp_path / 'creatures.csv'
+  csv_path.write_text('Gray Wolf,Canis lupus,mammal,u,a,w\nBad\n')
+
+  result = runner.invoke(args=['initdb', '--csv', str(csv_path),
+                               '--batch-size', '10', '--fast'])
+  assert 'initialized with 1 creatures' in result.output
+  assert 'Skipped line 2' in result.output
+
+
+def test_import_creatures(app, tmp_path):
+  with app.app_context():
+    db = get_db()
+    db.execute("INSERT INTO creature (name_common, name_latin, type_id, \
+                photo_url, photo_attr, wiki_url, user_id) \
+                VALUES ('Pet Wolf', 'Canis lupus', 'mammal', '', '', '', 2)")
+    # Someone has seen the Marmot, so it stays though the CSV drops it.
+    db.execute("INSERT INTO sighting (user_id, creature_id, seen_at) \
+                SELECT 2, id, '2024-05-01 00:00:00' FROM creature \
+                WHERE name_latin = 'Marmota flaviventris'")
+    db.commit()
+    elk, wolf = db.execute("SELECT * FROM creature WHERE name_latin IN \
+                            ('Cervus elaphus', 'Canis lupus') AND user_id = 1 \
+                            ORDER BY id").fetchall()
+    version = get_catalogue_version()
+
+  csv_path = tmp_path / 'creatures.csv'
+  csv_path.write_text(
+    ','.join([elk['name_common'], elk['name_latin'], elk['type_id'],
+              elk['photo_url'], elk['photo_attr'], elk['wiki_url']]) + '\n'
+    + 'Grey Wolf,Canis lupus,mammal,u,a,w\n'
+    + 'Wolverine,Gulo gulo,mammal,u,a,w\n'
+  )
+
+  with app.app_context():
+    counts, bad_rows = import_creatures(str(csv_path))
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 19,
+                      'kept': 1}
+    assert get_catalogue_version() != version
+
+    names = [r[0] for r in get_db().execute(
+      'SELECT name_common FROM creature ORDER BY id')]
+    assert names == [elk['name_common'], 'Grey Wolf',
+                     'Yellow-bellied Marmot', 'Pet Wolf', 'Wolverine']
+
+    counts, bad_rows = import_creatures(str(csv_path))
+    assert counts == {'inserted': 0, 'updated': 0, 'deleted': 0,
+                      'kept': 1}
+
+
+def test_import_command(runner, tmp_path):
+  csv_path = tmp_path / 'creatures.csv'
+  csv_path.write_text('Wolverine,Gulo gulo,mammal,u,a,w\n')
+
+  result = runner.invoke(args=['import', str(csv_path), '--keep-missing'])
+  assert 'Inserted 1, updated 0 and deleted 0 creatures' in result.output
+
+
+def test_timestamps_parsed(app):
+  with app.app_context():
+    db = get_db()
+    db.execute('CREATE TEMP TABLE seen (seen_at TIMESTAMP)')
+    for stored in ('2024-05-01 15:30:00', '2024-05-01 15:30:00.250'):
+      db.execute('INSERT INTO seen VALUES (?)', (stored,))
+    assert [r[0] for r in db.execute('SELECT seen_at FROM seen')] == [
+      datetime.datetime(2024, 5, 1, 15, 30),
+      datetime.datetime(2024, 5, 1, 15, 30, 0, 250000)]
@@ -1,3 +1,7 @@
+import json
+
+import pytest
+
 from wallowawildlife import create_app
 
 
@@ -6,6 +10,31 @@ def test_config():
   assert create_app({'TESTING': True}).testing
 
 
-def test_hello(client):
-  response = client.get('/hello')
-  assert response.data == b'Hello, World!'
+def test_digest_key_required():
+  with pytest.raises(RuntimeError, match='GPLUS_DIGEST_KEY'):
+    create_app({'TESTING': True, 'SECRET_KEY': 'production'})
+  create_app({'TESTING': True, 'SECRET_KEY': 'production',
+              'GPLUS_DIGEST_KEY': 'digests'})
+
+
+def test_index(client):
+  response = client.get('/')
+  assert response.status_code == 200
+  assert b'Iwetemlaykin Heritage Site' in response.data
+
+
+def test_wildlife_json_all(client):
+  response = client.get('/wildlife/JSON?all')
+  creatures = response.get_json()
+  assert response.mimetype == 'application/json'
+  assert len(creatures) == 22
+  assert creatures[0]['name_common'] == 'Rocky Mountain Elk'
+
+
+def test_wildlife_json_ndjson(client):
+  response = client.get('/wildlife/JSON',
+                        headers={'Accept': 'application/x-ndjson'})
+  lines = response.data.decode('utf-8').splitlines()
+  assert response.mimetype == 'application/x-ndjson'
+  assert len(lines) == 22
+  assert json.loads(lines[-1])['id'] == 22
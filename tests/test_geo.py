@@ -0,0 +1,149 @@
+import pytest
+from test_lists import login_as
+from test_summaries import record
+from wallowawildlife.db import get_db
+from wallowawildlife.geo import tile_bounds, tile_of
+from wallowawildlife.summaries import check_summaries
+
+JOSEPH = (45.3543, -117.2296)
+ENTERPRISE = (45.4263, -117.2788)
+
+
+def record_at(client, position, *creature_ids, **fields):
+  return record(client, *creature_ids, latitude=position[0],
+                longitude=position[1], **fields)
+
+
+def area(client, query):
+  response = client.get('/sightings/area/JSON?' + query)
+  return dict((c['name_common'], (c['sightings'], c['individuals']))
+              for c in response.get_json())
+
+
+@pytest.fixture
+def sightings(client):
+  login_as(client, 'adminpass')
+  record_at(client, JOSEPH, 1, 4, count=2)
+  # About 1 km north of Joseph.
+  record_at(client, (JOSEPH[0] + 0.009, JOSEPH[1]), 2)
+  record_at(client, ENTERPRISE, 1)
+  record(client, 3)
+
+
+def test_tile_of():
+  assert tile_of(0, 0, 0) == (0, 0)
+  assert tile_of(JOSEPH[0], JOSEPH[1], 16) == (11427, 23483)
+  for zoom in (4, 10, 16):
+    west, south, east, north = tile_bounds(zoom, *tile_of(*JOSEPH, zoom))
+    assert west <= JOSEPH[1] < east and south < JOSEPH[0] <= north
+
+
+@pytest.mark.parametrize(('position', 'message'), (
+  ({'latitude': 45.3}, 'must both be numbers'),
+  ({'latitude': 45.3, 'longitude': '-117'}, 'must both be numbers'),
+  ({'latitude': True, 'longitude': -117}, 'must both be numbers'),
+  ({'latitude': 91, 'longitude': -117}, 'position in degrees'),
+))
+def test_invalid_position(client, position, message):
+  login_as(client, 'adminpass')
+  response = client.post('/sightings/JSON', json=dict(position,
+                                                       creature_id=1))
+  assert message in response.get_json()['results'][0]['error']
+
+
+def test_sighting_json(client, sightings):
+  listed = client.get('/sightings/JSON').get_json()
+  assert (listed[0]['latitude'], listed[0]['longitude']) == (None, None)
+  assert (listed[1]['latitude'], listed[1]['longitude']) == ENTERPRISE
+
+
+def test_bbox(client, sightings):
+  bbox = 'bbox=-117.3,45.3,-117.2,45.4'
+  assert area(client, bbox) == {'Rocky Mountain Elk': (1, 2),
+                                'Gray Wolf': (1, 1),
+                                'Western Rattlesnake': (1, 2)}
+  assert area(client, bbox + '&type=mammal') == {'Rocky Mountain Elk': (1, 2),
+                                                 'Gray Wolf': (1, 1)}
+  assert area(client, 'bbox=-118,45,-117,46')['Rocky Mountain Elk'] == (2, 3)
+
+
+def test_radius(client, sightings):
+  near = 'lat=%f&lon=%f&radius=' % JOSEPH
+  assert 'Gray Wolf' not in area(client, near + '900')
+  assert 'Gray Wolf' in area(client, near + '1100')
+  assert area(client, near + '10000')['Rocky Mountain Elk'] == (2, 3)
+
+
+def test_large_area_from_tiles(client, sightings, monkeypatch):
+  monkeypatch.setattr('wallowawildlife.geo.MAX_AREA_SCAN', 2)
+  response = client.get('/sightings/area/JSON?bbox=-118,45,-117,46')
+  assert 'zoom' in response.headers['X-Sightings-Approximate']
+  assert [(c['name_common'], c['sightings'], c['individuals'])
+          for c in response.get_json()] == [('Rocky Mountain Elk', 2, 3),
+                                            ('Gray Wolf', 1, 1),
+                                            ('Western Rattlesnake', 1, 2)]
+
+  # Boxes with few sightings around them are still counted exactly.
+  response = client.get('/sightings/area/JSON?bbox=-117.3,45.4,-117.2,45.5')
+  assert 'X-Sightings-Approximate' not in response.headers
+  assert [c['name_common'] for c in response.get_json()] \
+      == ['Rocky Mountain Elk']
+
+
+@pytest.mark.parametrize('query', (
+  '',
+  'bbox=1,2,3',
+  'bbox=-117.2,45.3,-117.3,45.4',
+  'lat=45&lon=-117',
+  'lat=45&lon=-117&radius=200000',
+  'bbox=-118,45,-117,46&type=dragon',
+))
+def test_area_invalid(client, query):
+  response = client.get('/sightings/area/JSON?' + query)
+  assert response.status_code == 400
+  assert 'error' in response.get_json()
+
+
+def test_tiles(client, sightings):
+  x, y = tile_of(JOSEPH[0], JOSEPH[1], 8)
+  tile = client.get('/sightings/tiles/8/%d/%d/JSON' % (x, y)).get_json()
+  cells = tile['cells']
+  assert all(c['zoom'] == 11 for c in cells)
+  assert sum(c['sightings'] for c in cells) == 4
+  assert sum(c['individuals'] for c in cells) == 6
+
+  # Every sighting is in one of the zoom 0 cells.
+  world = client.get('/sightings/tiles/0/0/0/JSON').get_json()['cells']
+  assert sum(c['sightings'] for c in world) == 4
+
+  # Cells stop at zoom 16, where only the Elk is a mammal at Joseph.
+  x, y = tile_of(JOSEPH[0], JOSEPH[1], 14)
+  cells = client.get('/sightings/tiles/14/%d/%d/JSON?type=mammal'
+                     % (x, y)).get_json()['cells']
+  x, y = tile_of(JOSEPH[0], JOSEPH[1], 16)
+  cell, = [c for c in cells if (c['x'], c['y']) == (x, y)]
+  assert (cell['zoom'], cell['sightings'], cell['creatures']) == (16, 1, 1)
+  west, south, east, north = cell['bbox']
+  assert west <= JOSEPH[1] < east and south < JOSEPH[0] <= north
+
+
+@pytest.mark.parametrize('path', (
+  '/sightings/tiles/17/0/0/JSON',
+  '/sightings/tiles/2/4/0/JSON',
+))
+def test_tile_not_found(client, path):
+  assert client.get(path).status_code == 404
+
+
+def test_removed_with_sightings(client, app, sightings):
+  ids = [s['id'] for s in client.get('/sightings/JSON').get_json()]
+  client.post('/sightings/%d/delete' % ids[1])
+  assert area(client, 'bbox=-118,45,-117,46')['Rocky Mountain Elk'] == (1, 2)
+  client.post('/sightings/%d/delete' % ids[-1])
+  assert 'Rocky Mountain Elk' not in area(client, 'bbox=-118,45,-117,46')
+
+  with app.app_context():
+    db = get_db()
+    assert db.execute('SELECT COUNT(*) FROM sighting_rtree').fetchone()[0] \
+        == 2
+    assert check_summaries() == {}
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+from wallowawildlife.images import build_images, photo_variants
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def photos(tmp_path):
+  source = tmp_path / 'img'
+  source.mkdir()
+  Image.new('RGB', (1200, 800), 'green').save(str(source / 'elk.jpg'))
+  Image.new('RGB', (100, 100), 'gray').save(str(source / 'gray_wolf.jpg'))
+  return str(source)
+
+
+@pytest.fixture
+def store(app, tmp_path):
+  app.config['IMAGE_STORE'] = str(tmp_path / 'store')
+  return app.config['IMAGE_STORE']
+
+
+def test_build_images(photos, store):
+  assert build_images(photos, store, workers=1) == (2, 0)
+
+  with open(os.path.join(store, 'manifest.json')) as f:
+    manifest = json.load(f)
+  variants = manifest['elk.jpg']['variants']
+  assert variants['thumb']['width'] == 160
+  assert variants['medium']['width'] == 640
+  assert manifest['gray_wolf.jpg']['variants']['medium']['width'] == 100
+  for fmt in ('jpeg', 'webp'):
+    assert os.path.exists(os.path.join(store, variants['thumb'][fmt]))
+
+  assert build_images(photos, store, workers=1) == (0, 2)
+  assert build_images(photos, store, workers=1, force=True) == (2, 0)
+
+
+def test_photo_variants(app, photos, store):
+  build_images(photos, store, workers=1)
+
+  with app.test_request_context():
+    variants = photo_variants('https://example.com/static/img/elk.jpg')
+    assert variants['src'].endswith('/medium.jpg')
+    assert variants['thumb_webp'].endswith('/thumb.webp')
+    assert variants['webp'].endswith('640w')
+    assert photo_variants('https://example.com/static/img/owl.jpg') is None
+    assert photo_variants('') is None
+
+
+def test_pages_use_variants(client, photos, store):
+  response = client.get('/wildlife/1/')
+  assert b'<picture>' not in response.data
+
+  build_images(photos, store, workers=1)
+  response = client.get('/wildlife/1/')
+  assert b'<picture>' in response.data
+  assert b'type="image/webp"' in response.data
+
+  start = response.data.index(b'/images/')
+  path = response.data[start:response.data.index(b' ', start)]
+  response = client.get(path.decode())
+  assert response.status_code == 200
+  assert 'immutable' in response.headers['Cache-Control']
+
+
+def test_images_command(runner, store, photos):
+  result = runner.invoke(args=['images', '--source', photos,
+                               '--workers', '1'])
+  assert 'Made variants of 2 photos, 0 unchanged.' in result.output
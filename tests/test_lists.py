@@ -0,0 +1,175 @@
+from wallowawildlife.db import get_db
+
+
+def test_list_by_type(client):
+  response = client.get('/wildlife/mammal')
+  assert response.status_code == 200
+  assert b'Gray Wolf' in response.data
+  assert b'Western Rattlesnake' not in response.data
+
+
+def test_list_by_type_invalid(client):
+  response = client.get('/wildlife/dragon')
+  assert response.headers['Location'].endswith('/')
+
+
+def follow(client, url, rel):
+  names = []
+  while url:
+    response = client.get(url)
+    names.extend(c['name_common'] for c in response.get_json())
+    links = dict((l.split('; ')[1], l.split('; ')[0].strip('<>'))
+                 for l in response.headers['Link'].split(', ') if l)
+    url = links.get('rel="%s"' % rel)
+  return names, response
+
+
+def test_json_pagination(client):
+  names, last = follow(client, '/wildlife/JSON?limit=5', 'next')
+  assert names == sorted(names, key=str.lower)
+  assert len(names) == len(set(names)) == 22
+
+  back, _ = follow(client, last.request.full_path, 'prev')
+  assert len(back) == 22
+
+
+def test_list_pagination(app, client):
+  app.config['PAGE_SIZE'] = 20
+  first = client.get('/wildlife')
+  assert b'Next' in first.data
+  assert b'Previous' not in first.data
+
+  category = client.get('/wildlife/mammal')
+  assert b'Next' not in category.data
+
+
+def test_type_json(client):
+  names = [c['name_common'] for c in
+           client.get('/wildlife/mammal/JSON?limit=2').get_json()]
+  assert len(names) == 2
+
+  # Unknown types go back to the index, whatever the query.
+  for url in ('/wildlife/dragon/JSON', '/wildlife/dragon/JSON?limit=5'):
+    assert client.get(url).headers['Location'].endswith('/')
+
+
+def test_bad_cursor(client):
+  assert client.get('/wildlife/JSON?after=garbage').status_code == 400
+
+
+def test_search(client):
+  response = client.get('/wildlife/search?q=wol')
+  assert response.status_code == 200
+  assert b'Gray Wolf' in response.data
+  assert b'Rocky Mountain Elk' not in response.data
+
+
+def test_search_json(client):
+  names = [c['name_common'] for c in
+           client.get('/wildlife/search/JSON?q=canis').get_json()]
+  assert names == ['Gray Wolf']
+
+  assert client.get('/wildlife/search/JSON?q=wol&type=bird').get_json() == []
+  assert client.get('/wildlife/search/JSON?q="*').get_json() == []
+
+
+def test_search_finds_whole_word(app, client):
+  # The best match comes after more weaker ones than are ranked.
+  app.config['SEARCH_CANDIDATES'] = 100
+  with app.app_context():
+    db = get_db()
+    db.executemany(
+      "INSERT INTO creature (name_common, name_latin, type_id, photo_url, \
+                             photo_attr, wiki_url, user_id) \
+       VALUES (?, ?, 'mammal', '', '', '', 1)",
+      [('Pikachu Relative %d of the Alpine Meadows' % i,
+        'Ochotona imaginaria %d' % i) for i in range(3000)]
+      + [('Pika', 'Ochotona princeps')])
+    db.commit()
+
+  best = client.get('/wildlife/search/JSON?q=pika&limit=1').get_json()
+  assert [c['name_common'] for c in best] == ['Pika']
+
+  found = client.get('/wildlife/search/JSON?q=pik&limit=1000').get_json()
+  assert len(found) == 100
+  assert client.get('/wildlife/search/JSON?q=pika&type=bird').get_json() \
+      == []
+
+
+def test_json_ids(app, client):
+  response = client.get('/wildlife/JSON?ids=3,1,999')
+  assert [c['id'] for c in response.get_json()] == [1, 3]
+
+  assert client.get('/wildlife/JSON?ids=1,two').status_code == 400
+  app.config['MAX_PAGE_SIZE'] = 2
+  assert client.get('/wildlife/JSON?ids=1,2,3').status_code == 400
+
+
+def login_as(client, gplus_id):
+  with client.session_transaction() as sess:
+    sess['user_id'] = gplus_id
+
+
+def test_batch_requires_login(client):
+  response = client.post('/wildlife/batch', json=[])
+  assert response.headers['Location'] == '/auth/login'
+
+
+def test_batch(client):
+  login_as(client, 'adminpass')
+  response = client.post('/wildlife/batch', json=[
+    {'name_common': 'Pika', 'name_latin': 'Ochotona princeps',
+     'type_id': 'mammal'},
+    {'id': 1, 'name_common': 'Elk'},
+    {'id': 1, 'wiki_url': 'https://en.wikipedia.org/wiki/Wapiti'},
+    {'name_common': 'Nameless'},
+    {'id': 999, 'name_common': 'Ghost'},
+    {'id': 2, 'type_id': 'dragon'},
+  ])
+  results = response.get_json()['results']
+  assert [r['status'] for r in results] == [
+    'created', 'updated', 'updated', 'error', 'error', 'error']
+  assert results[3]['error'] == 'Missing name_latin, type_id.'
+
+  creatures = client.get(
+    '/wildlife/JSON?ids=1,%d' % results[0]['id']).get_json()
+  assert creatures[0]['name_common'] == 'Elk'
+  assert creatures[0]['wiki_url'] == 'https://en.wikipedia.org/wiki/Wapiti'
+  assert creatures[1]['name_common'] == 'Pika'
+
+
+def test_batch_owner_check(client):
+  login_as(client, 'test-gplus-id')
+  results = client.post('/wildlife/batch', json=[
+    {'id': 1, 'name_common': 'Elk'}]).get_json()['results']
+  assert results == [{'status': 'error', 'id': 1,
+                      'error': 'You may only edit an entry you own.'}]
+  assert client.get('/wildlife/1/JSON').get_json()['name_common'] \
+      == 'Rocky Mountain Elk'
+
+
+def test_batch_invalid(client):
+  login_as(client, 'adminpass')
+  assert client.post('/wildlife/batch', json={'id': 1}).status_code == 400
+
+
+def test_batch_invalid_ids(client):
+  login_as(client, 'adminpass')
+  results = client.post('/wildlife/batch', json=[
+    {'id': True, 'name_common': 'Elk'},
+    {'id': [1], 'name_common': 'Elk'},
+    {'id': {}, 'name_common': 'Elk'},
+    {'id': '1', 'name_common': 'Elk'},
+  ]).get_json()['results']
+  assert results == [{'status': 'error',
+                      'error': 'Ids must be integers.'}] * 4
+  assert client.get('/wildlife/1/JSON').get_json()['name_common'] \
+      == 'Rocky Mountain Elk'
+
+
+def test_edit_and_delete_missing(client):
+  login_as(client, 'adminpass')
+  for action in ('edit', 'delete'):
+    response = client.post('/wildlife/999/' + action, follow_redirects=True)
+    assert response.request.path == '/wildlife'
+    assert b'This entry does not exist.' in response.data
@@ -0,0 +1,80 @@
+import os
+import re
+
+import pytest
+from wallowawildlife import create_app
+
+
+@pytest.fixture
+def metrics_app(app):
+  app.config['METRICS'] = True
+  # Connections opened from now on are timed.
+  app.extensions['db_pool'].close_all()
+  return app
+
+
+def timings(response):
+  return dict(re.match(r'(\w+);dur=([\d.]+)', t.strip()).groups()
+              for t in response.headers['Server-Timing'].split(','))
+
+
+def test_metrics_off(client):
+  response = client.get('/wildlife')
+  assert 'Server-Timing' not in response.headers
+  assert client.get('/metrics').status_code == 302
+
+
+def test_server_timing(client, metrics_app):
+  response = client.get('/wildlife')
+  times = timings(response)
+  assert set(times) == {'app', 'db', 'tpl', 'auth'}
+  assert float(times['tpl']) > 0
+  assert float(times['db']) > 0
+  assert float(times['app']) >= float(times['tpl'])
+  assert re.search(r'desc="[1-9]\d* queries"',
+                   response.headers['Server-Timing'])
+
+
+def test_auth_hash_timing(auth, metrics_app, google):
+  # 'other-gplus-id' has no digest yet, so its salted hash is checked.
+  response = auth.login('other-gplus-id')
+  assert float(timings(response)['auth']) > 0
+
+
+def test_metrics_endpoint(client, metrics_app):
+  client.get('/wildlife')
+  client.get('/wildlife')
+  response = client.get('/metrics')
+  assert response.mimetype == 'text/plain'
+  text = response.get_data(as_text=True)
+
+  assert ('wallowawildlife_requests_total{endpoint="lists.listAll",'
+          'method="GET",status="200"} 2') in text
+  assert ('wallowawildlife_request_seconds_count'
+          '{endpoint="lists.listAll"} 2') in text
+  assert 'wallowawildlife_sql_statements_total{endpoint="lists.listAll"}' \
+      in text
+  assert '# TYPE wallowawildlife_page_cache_hits_total counter' in text
+  assert 'wallowawildlife_page_cache_hits_total 1' in text
+  assert '# TYPE wallowawildlife_page_cache_pages gauge' in text
+  assert '# TYPE wallowawildlife_db_connections_opened_total counter' \
+      in text
+  assert '# TYPE wallowawildlife_db_connections_in_use gauge' in text
+  assert '# TYPE wallowawildlife_db_connections_idle gauge' in text
+
+
+def test_slow_request_profile(tmp_path):
+  profile_dir = tmp_path / 'profiles'
+  app = create_app({'TESTING': True, 'METRICS': True,
+                    'DATABASE': str(tmp_path / 'db.sqlite'),
+                    'PROFILE_SLOW_REQUESTS': 0,
+                    'PROFILE_INTERVAL': 0.001,
+                    'PROFILE_DIR': str(profile_dir)})
+  app.add_url_rule('/slow', 'slow', lambda: sum(range(3000000)) and 'ok')
+
+  assert app.test_client().get('/slow').status_code == 200
+  profile, = os.listdir(str(profile_dir))
+  assert profile.endswith('.txt')
+  with open(str(profile_dir / profile)) as f:
+    assert f.readline() == '# GET /slow?\n'
+    assert 'test_metrics.py:<lambda>' in f.read()
@@ -0,0 +1,39 @@
+from wallowawildlife.pagecache import PageCache
+
+
+def test_page_cache_lru():
+  cache = PageCache(2)
+  cache.put('a', 'A')
+  cache.put('b', 'B')
+  assert cache.get('a') == 'A'
+  cache.put('c', 'C')
+
+  assert cache.get('b') is None
+  assert cache.get('c') == 'C'
+  assert cache.stats() == {'hits': 2, 'misses': 1, 'evictions': 1,
+                           'pages': 2}
+
+
+def test_cached_page(client, app):
+  app.config['COUNT_QUERIES'] = True
+  first = client.get('/wildlife/mammal')
+  second = client.get('/wildlife/mammal')
+
+  assert second.data == first.data
+  assert (int(second.headers['X-Query-Count'])
+          < int(first.headers['X-Query-Count']))
+  assert app.extensions['page_cache'].stats()['hits'] == 1
+
+
+def test_write_invalidates_pages(client, app):
+  client.get('/wildlife/mammal')
+
+  with client.session_transaction() as sess:
+    sess['user_id'] = 'adminpass'
+  client.post('/wildlife/1/delete')
+  assert app.extensions['page_cache'].stats()['pages'] == 0
+
+  client.get('/wildlife/mammal')
+  response = client.get('/wildlife/mammal')
+  assert b'Rocky Mountain Elk' not in response.data
+  assert b'Edit' in response.data
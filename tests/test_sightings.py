@@ -0,0 +1,187 @@
+import sqlite3
+import threading
+
+import pytest
+from test_lists import login_as
+from wallowawildlife.db import get_db
+from wallowawildlife.sightings import (
+  get_writer, insert_sighting, record_sightings
+)
+
+
+def sighting(user_id, creature_id, count=1):
+  return (user_id, creature_id, '2024-05-01 00:00:00', count, '', None, None)
+
+
+@pytest.mark.parametrize(('path', 'method'), (
+  ('/wildlife/1/seen', 'POST'),
+  ('/sightings', 'GET'),
+  ('/sightings/1/delete', 'POST'),
+  ('/sightings/JSON', 'GET'),
+  ('/sightings/JSON', 'POST'),
+))
+def test_login_required(client, path, method):
+  response = client.open(path, method=method)
+  assert response.headers['Location'] == '/auth/login'
+
+
+def test_record_and_list(client, app):
+  login_as(client, 'adminpass')
+  assert b'I saw this' in client.get('/wildlife/1/').data
+
+  response = client.post('/wildlife/1/seen',
+                         data={'count': '3', 'notes': 'By the lake'})
+  assert response.headers['Location'] == '/wildlife/1/'
+  assert b'Checked off' in client.get('/wildlife/1/').data
+
+  page = client.get('/sightings').data
+  assert b'By the lake' in page
+  assert b'&times; 3' in page
+
+  with app.app_context():
+    s = get_db().execute('SELECT * FROM sighting').fetchone()
+    assert (s['user_id'], s['creature_id'], s['count']) == (1, 1, 3)
+
+
+@pytest.mark.parametrize(('data', 'message'), (
+  ({'count': '0'}, b'Count must be between 1'),
+  ({'notes': 'x' * 1001}, b'Notes must be text'),
+))
+def test_record_invalid(client, app, data, message):
+  login_as(client, 'adminpass')
+  response = client.post('/wildlife/1/seen', data=data, follow_redirects=True)
+  assert message in response.data
+
+  with app.app_context():
+    assert get_db().execute('SELECT COUNT(*) FROM sighting').fetchone()[0] == 0
+
+
+def test_json(client):
+  login_as(client, 'adminpass')
+  response = client.post('/sightings/JSON', json=[
+    {'creature_id': 1, 'seen_at': '2024-05-01T08:30:00-07:00'},
+    {'creature_id': 999},
+    {'creature_id': 2, 'count': 2, 'notes': 'Pair'},
+    'elk',
+    {'creature_id': 3, 'seen_at': 'yesterday'},
+    {'creature_id': True},
+    {'creature_id': 3, 'count': True},
+  ])
+  results = response.get_json()['results']
+  assert [r['status'] for r in results] == \
+      ['created', 'error', 'created', 'error', 'error', 'error', 'error']
+  assert results[1]['error'] == 'This entry does not exist.'
+
+  sightings = client.get('/sightings/JSON').get_json()
+  assert [s['creature_id'] for s in sightings] == [2, 1]
+  assert sightings[1]['seen_at'] == '2024-05-01T15:30:00Z'
+  assert sightings[0]['notes'] == 'Pair'
+
+
+@pytest.mark.parametrize('data', (None, [], 'elk', [{}] * 1001))
+def test_json_invalid(client, data):
+  login_as(client, 'adminpass')
+  response = client.post('/sightings/JSON', json=data)
+  assert response.status_code == 400
+  assert 'error' in response.get_json()
+
+
+def test_delete(client, app):
+  login_as(client, 'adminpass')
+  client.post('/sightings/JSON', json={'creature_id': 1})
+
+  login_as(client, 'test-gplus-id')
+  response = client.post('/sightings/1/delete', follow_redirects=True)
+  assert b'only remove your own' in response.data
+
+  login_as(client, 'adminpass')
+  response = client.post('/sightings/1/delete', follow_redirects=True)
+  assert b'Sighting removed.' in response.data
+  assert client.get('/sightings/JSON').get_json() == []
+
+
+def test_creature_kept(client, app):
+  login_as(client, 'adminpass')
+  client.post('/sightings/JSON', json={'creature_id': 1})
+  response = client.post('/wildlife/1/delete', follow_redirects=True)
+  assert b'may not be deleted' in response.data
+
+  with app.app_context():
+    db = get_db()
+    with pytest.raises(sqlite3.IntegrityError, match='has sightings'):
+      db.execute('DELETE FROM creature WHERE id = 1')
+    assert db.execute('SELECT COUNT(*) FROM sighting').fetchone()[0] == 1
+
+
+def test_group_commit(app):
+  app.config['SIGHTING_BATCH_SIZE'] = 64
+  ids = []
+
+  def record(user_id):
+    with app.app_context():
+      ids.extend(record_sightings([sighting(user_id, 1)
+                                   for _ in range(20)]))
+
+  threads = [threading.Thread(target=record, args=(i % 2 + 1,))
+             for i in range(10)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+
+  assert len(set(ids)) == 200 and None not in ids
+  with app.app_context():
+    writer = get_writer()
+    assert writer.written == 200
+    assert writer.batches < 200
+    assert get_db().execute('SELECT COUNT(*) FROM sighting').fetchone()[0] \
+        == 200
+
+
+def test_failure_is_isolated(app):
+  with app.app_context():
+    ids = record_sightings([sighting(1, 1), sighting(1, 2, count=None),
+                            sighting(2, 3)])
+    assert ids[0] and ids[2]
+    assert ids[1] is None
+
+
+def test_timed_out_sightings_cancelled(app, monkeypatch):
+  app.config['SIGHTING_WRITE_TIMEOUT'] = 0.1
+  with app.app_context():
+    writer = get_writer()
+    write = writer._write
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_write(db, batch):
+      writing.set()
+      release.wait(5)
+      write(db, batch)
+
+    monkeypatch.setattr(writer, '_write', slow_write)
+    first = writer.submit(sighting(1, 1))
+    writing.wait(5)
+    # Queued behind the first, so it times out and is never written.
+    assert record_sightings([sighting(1, 2)]) == [None]
+    release.set()
+    first.result(5)
+    writer.submit(sighting(1, 3)).result(5)
+
+    creature_ids = [r[0] for r in get_db().execute(
+      'SELECT creature_id FROM sighting ORDER BY id')]
+    assert creature_ids == [1, 3]
+
+
+def test_writer_survives_errors(app, monkeypatch):
+  def insert(db, sighting):
+    if sighting[4] == 'boom':
+      raise RuntimeError('boom')
+    return insert_sighting(db, sighting)
+
+  monkeypatch.setattr('wallowawildlife.sightings.insert_sighting', insert)
+  with app.app_context():
+    writer = get_writer()
+    bad = writer.submit((1, 1, '2024-05-01 00:00:00', 1, 'boom', None, None))
+    with pytest.raises(RuntimeError):
+      bad.result(5)
+    assert writer.submit(sighting(1, 2)).result(5)
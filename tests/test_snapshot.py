@@ -0,0 +1,98 @@
+import pytest
+from test_lists import follow, login_as
+from wallowawildlife.db import get_db, get_snapshot, init_db
+from wallowawildlife.pagination import select_page
+from wallowawildlife.snapshot import SnapshotHolder, read_snapshot, sort_key
+
+
+@pytest.fixture
+def snapshot_app(app):
+  app.extensions['catalogue_snapshot'] = SnapshotHolder()
+  app.config['PAGE_CACHE_SIZE'] = 0
+  app.extensions.pop('page_cache', None)
+  return app
+
+
+def add_names(app, names):
+  with app.app_context():
+    db = get_db()
+    db.executemany('INSERT INTO creature (name_common, name_latin, \
+                                          photo_url, photo_attr, wiki_url, \
+                                          user_id, type_id) \
+                    VALUES (?, ?, "", "", "", 1, "bird")',
+                   [(name, name) for name in names])
+    db.execute('UPDATE catalogue SET version = version + 1')
+    db.commit()
+
+
+def test_seek_matches_sql(snapshot_app):
+  add_names(snapshot_app, ['apple', 'Apple', 'APPLE', 'Äpfel', 'zebra',
+                           '_under', 'élan'])
+  with snapshot_app.app_context():
+    snapshot = get_snapshot()
+    for type_id in (None, 'bird', 'mammal', 'dragon'):
+      first = select_page(type_id, None, False, 1000)
+      assert [c['id'] for c in snapshot.seek(type_id, None, False, 1000)] \
+          == [c['id'] for c in first]
+      for row in first:
+        cursor = (row['name_common'], row['id'])
+        for descending in (False, True):
+          expected = [c['id'] for c in select_page(type_id, cursor,
+                                                   descending, 5)]
+          found = snapshot.seek(type_id, sort_key(*cursor), descending, 5)
+          assert [c['id'] for c in found] == expected
+
+
+def test_pages_match(app, client):
+  def walk():
+    names, last = follow(client, '/wildlife/JSON?limit=5', 'next')
+    back, _ = follow(client, last.request.full_path, 'prev')
+    return names, back, client.get('/wildlife/bird/JSON').get_json()
+
+  sql_pages = walk()
+  app.extensions['catalogue_snapshot'] = SnapshotHolder()
+  assert walk() == sql_pages
+  assert len(client.get('/wildlife/JSON?ids=2,1,999,2').get_json()) == 2
+
+
+def test_patched_after_writes(snapshot_app, client):
+  client.get('/wildlife')
+  holder = snapshot_app.extensions['catalogue_snapshot']
+  first = holder.current
+
+  login_as(client, 'adminpass')
+  results = client.post('/wildlife/batch', json=[
+    {'name_common': 'Pika', 'name_latin': 'Ochotona princeps',
+     'type_id': 'mammal'},
+    {'id': 1, 'name_common': 'Aardvark'},
+  ]).get_json()['results']
+  client.post('/wildlife/2/delete')
+
+  response = client.get('/wildlife/mammal?limit=1')
+  assert b'Aardvark' in response.data
+  assert client.get('/wildlife/2/JSON').status_code == 302
+  assert client.get('/wildlife/%d/' % results[0]['id']).status_code == 200
+
+  # The old snapshot is untouched, and the new one was patched to
+  # match what a full read gives.
+  assert first.get(1)['name_common'] == 'Rocky Mountain Elk'
+  assert len(first) == 22
+  patched = holder.current
+  assert patched.number > first.number
+  with snapshot_app.app_context():
+    fresh = read_snapshot(get_db())
+  assert patched.version == fresh.version
+  for type_id in (None, 'mammal', 'bird'):
+    assert [c.id for c in patched.seek(type_id, None, False, 100)] \
+        == [c.id for c in fresh.seek(type_id, None, False, 100)]
+
+
+def test_read_after_init_db(snapshot_app, client):
+  client.get('/wildlife')
+  first = snapshot_app.extensions['catalogue_snapshot'].current
+  with snapshot_app.app_context():
+    init_db()
+  client.get('/wildlife')
+  current = snapshot_app.extensions['catalogue_snapshot'].current
+  assert current.epoch != first.epoch
+  assert len(current) == 22
@@ -0,0 +1,143 @@
+from test_lists import login_as
+from wallowawildlife.db import MIGRATIONS, get_db, migrate_db
+from wallowawildlife.summaries import check_summaries
+
+
+def record(client, *creature_ids, **fields):
+  response = client.post('/sightings/JSON', json=[
+    dict(fields, creature_id=i) for i in creature_ids])
+  return [r['id'] for r in response.get_json()['results']]
+
+
+def progress(app, user_id=1):
+  with app.app_context():
+    rows = get_db().execute('SELECT type_id, seen FROM checklist_progress \
+                             WHERE user_id = ?', (user_id,)).fetchall()
+    return dict((r['type_id'], r['seen']) for r in rows)
+
+
+def test_progress(client, app):
+  with app.app_context():
+    mammals = get_db().execute("SELECT COUNT(*) FROM creature \
+                                WHERE type_id = 'mammal'").fetchone()[0]
+
+  assert b'You have seen' not in client.get('/wildlife/mammal').data
+
+  login_as(client, 'adminpass')
+  assert b'You have seen 0 of %d.' % mammals \
+      in client.get('/wildlife/mammal').data
+
+  # Seeing the same creature again doesn't count twice.
+  record(client, 1, 1, 2, 4)
+  assert progress(app) == {'mammal': 2, 'reptile_amphibian': 1}
+  assert b'You have seen 2 of %d.' % mammals \
+      in client.get('/wildlife/mammal').data
+  assert b'2 of %d' % mammals in client.get('/').data
+
+  login_as(client, 'test-gplus-id')
+  assert b'You have seen 0 of' in client.get('/wildlife/mammal').data
+
+
+def test_delete(client, app):
+  login_as(client, 'adminpass')
+  first, second, third = record(client, 1, 1, 4)
+
+  client.post('/sightings/%d/delete' % first)
+  assert progress(app) == {'mammal': 1, 'reptile_amphibian': 1}
+  client.post('/sightings/%d/delete' % second)
+  client.post('/sightings/%d/delete' % third)
+  assert progress(app) == {}
+
+  with app.app_context():
+    db = get_db()
+    assert db.execute('SELECT COUNT(*) FROM seen_creature').fetchone()[0] == 0
+    assert db.execute('SELECT COUNT(*) FROM creature_day').fetchone()[0] == 0
+
+
+def test_creature_changes(client, app):
+  login_as(client, 'adminpass')
+  record(client, 1, 2, 3)
+  client.post('/wildlife/1/edit', data={
+    'name_common': '', 'name_latin': '', 'photo_attr': '', 'photo_url': '',
+    'wiki_url': '', 'type_id': 'bird'})
+  assert progress(app) == {'mammal': 2, 'bird': 1}
+
+  client.post('/wildlife/2/delete')
+  assert progress(app) == {'mammal': 2, 'bird': 1}
+
+  with app.app_context():
+    assert check_summaries() == {}
+
+
+def test_most_seen(client, app):
+  login_as(client, 'adminpass')
+  record(client, 2, 2, 1, count=3)
+  record(client, 3, seen_at='2001-01-01T00:00:00')
+
+  with app.app_context():
+    day = get_db().execute('SELECT * FROM creature_day \
+                            WHERE creature_id = 2').fetchone()
+    assert (day['sightings'], day['individuals']) == (2, 6)
+
+  page = client.get('/').data.decode()
+  assert 'Most Seen This Week' in page
+  assert page.index('Gray Wolf') < page.index('Rocky Mountain Elk')
+  assert 'Yellow-bellied Marmot' not in page
+
+
+def test_cached_pages_follow_sightings(client, app):
+  login_as(client, 'adminpass')
+  first = client.get('/wildlife/mammal')
+  assert client.get('/wildlife/mammal', headers={
+    'If-None-Match': first.headers['ETag']}).status_code == 304
+
+  record(client, 1)
+  second = client.get('/wildlife/mammal', headers={
+    'If-None-Match': first.headers['ETag']})
+  assert second.status_code == 200
+  assert b'You have seen 1 of' in second.data
+
+
+def test_check_and_rebuild(client, app, runner):
+  login_as(client, 'adminpass')
+  record(client, 1, 2, 4)
+
+  result = runner.invoke(args=['checksummaries'])
+  assert result.exit_code == 0
+  assert 'consistent' in result.output
+
+  with app.app_context():
+    db = get_db()
+    db.execute("UPDATE checklist_progress SET seen = 5 \
+                WHERE type_id = 'mammal'")
+    db.execute('DELETE FROM creature_day')
+    db.commit()
+
+  result = runner.invoke(args=['checksummaries'])
+  assert result.exit_code == 1
+  assert 'checklist_progress: 1 rows missing or wrong, 1 extra' \
+      in result.output
+  assert 'creature_day: 3 rows missing or wrong, 0 extra' in result.output
+
+  result = runner.invoke(args=['rebuildsummaries'])
+  assert 'Rebuilt' in result.output
+  assert runner.invoke(args=['checksummaries']).exit_code == 0
+  assert progress(app) == {'mammal': 2, 'reptile_amphibian': 1}
+
+
+def test_migration_fills_summaries(client, app):
+  login_as(client, 'adminpass')
+  record(client, 1, 2, 4)
+
+  with app.app_context():
+    db = get_db()
+    db.executescript('''
+      DROP TABLE seen_creature;
+      DROP TABLE checklist_progress;
+      DROP TABLE creature_day;
+      PRAGMA user_version = 8;
+    ''')
+    assert migrate_db() == len(MIGRATIONS) - 8
+    assert check_summaries() == {}
+
+  assert progress(app) == {'mammal': 2, 'reptile_amphibian': 1}
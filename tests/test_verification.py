@@ -0,0 +1,133 @@
+import time
+
+import pytest
+from google_standin import GoogleStandin
+from flask import session
+from wallowawildlife.verification import (
+  TTLCache, VerificationError, get_verifier
+)
+
+
+@pytest.fixture
+def signed_google(app, tmp_path):
+  standin = GoogleStandin('test-client-id', sign=True).start()
+  secrets_path = str(tmp_path / 'client_secrets.json')
+  standin.write_client_secrets(secrets_path)
+  app.config.update(CLIENT_SECRETS=secrets_path,
+                    TOKENINFO_URL=standin.tokeninfo_url,
+                    GOOGLE_CERTS_URL=standin.certs_url)
+
+  yield standin
+
+  standin.stop()
+
+
+def test_ttl_cache(monkeypatch):
+  now = [100.0]
+  monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+  cache = TTLCache(2, 10)
+  cache.put('a', 1)
+  cache.put('b', 2)
+  cache.put('c', 3)
+  assert cache.get('a') is None
+  assert cache.get('b') == 2
+
+  now[0] += 11
+  assert cache.get('c') is None
+
+
+def test_tokeninfo_cached(app, google):
+  with app.app_context():
+    verifier = get_verifier()
+    assert verifier.tokeninfo('token-a')['user_id'] == 'a'
+    assert verifier.tokeninfo('token-a')['user_id'] == 'a'
+    assert google.hits['/tokeninfo'] == 1
+
+    # Errors are not cached.
+    assert verifier.tokeninfo('bad')['error'] == 'invalid_token'
+    verifier.tokeninfo('bad')
+    assert google.hits['/tokeninfo'] == 3
+
+
+def test_connections_reused(app, google):
+  with app.app_context():
+    verifier = get_verifier()
+    verifier.tokeninfo('token-a')
+    verifier.tokeninfo('token-b')
+    assert get_verifier() is verifier
+    pool = verifier.session.get_adapter(google.url).poolmanager
+    assert len(pool.pools) == 1
+
+
+def test_signed_login_skips_tokeninfo(client, auth, signed_google):
+  with client:
+    response = auth.login()
+    assert response.headers['Location'].endswith('/wildlife')
+    assert session['user_pk'] == 2
+
+  auth.login('new-gplus-id')
+  assert signed_google.hits['/certs'] == 1
+  assert signed_google.hits['/tokeninfo'] == 0
+
+
+def test_verify_id_token(app, signed_google):
+  with app.app_context():
+    verifier = get_verifier()
+    token = signed_google.id_token('someone')
+    assert verifier.verify_id_token(token)['sub'] == 'someone'
+
+    header, claims, signature = token.split('.')
+    forged = signed_google.id_token('someone else').split('.')[1]
+    with pytest.raises(VerificationError, match='signature'):
+      verifier.verify_id_token('.'.join([header, forged, signature]))
+
+    # The header says RS256, so other hashes are refused.
+    for hash_method in ('SHA-1', 'MD5'):
+      with pytest.raises(VerificationError, match='signature'):
+        verifier.verify_id_token(
+          signed_google.id_token('someone', hash_method=hash_method))
+
+    with pytest.raises(VerificationError, match='client ID'):
+      verifier.verify_id_token(signed_google.id_token('x', aud='other'))
+
+    with pytest.raises(VerificationError, match='expired'):
+      verifier.verify_id_token(signed_google.id_token('x', exp=1))
+
+    # Clocks a little ahead of Google's still accept a fresh token.
+    late = signed_google.id_token('x', exp=int(time.time()) - 30)
+    assert verifier.verify_id_token(late)['sub'] == 'x'
+    with pytest.raises(VerificationError, match='expired'):
+      verifier.verify_id_token(
+        signed_google.id_token('x', exp=int(time.time()) - 120))
+
+
+def test_login_without_certs(app, client, auth, signed_google):
+  # Google's keys can't be fetched, so tokeninfo is asked instead.
+  app.config['GOOGLE_CERTS_URL'] = signed_google.url + '/missing'
+  with client:
+    response = auth.login()
+    assert response.headers['Location'].endswith('/wildlife')
+    assert session['user_pk'] == 2
+  assert signed_google.hits['/tokeninfo'] == 1
+
+
+@pytest.mark.parametrize('claims', (
+  {'sub': None}, {'sub': ''}, {'sub': ['test-gplus-id']},
+))
+def test_login_without_user_id(app, auth, google, monkeypatch, claims):
+  with app.app_context():
+    verifier = get_verifier()
+  monkeypatch.setattr(verifier, 'exchange', lambda code: {
+    'access_token': 'token-' + code,
+    'id_token': google.id_token(code, **claims)})
+  response = auth.login()
+  assert response.status_code == 401
+  assert b'no user ID' in response.data
+
+
+def test_login_timeout(app, auth, google):
+  google.latency = 0.5
+  app.config['GOOGLE_READ_TIMEOUT'] = 0.1
+  response = auth.login()
+  assert response.status_code == 401
+  assert b'Failed to upgrade' in response.data
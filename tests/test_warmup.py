@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+from wallowawildlife import create_app
+
+
+def test_template_cache(app, tmp_path):
+  cache_dir = str(tmp_path / 'templates')
+  warmed = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'],
+                       'TEMPLATE_CACHE': cache_dir})
+  result = warmed.test_cli_runner().invoke(args=['warmup'])
+  assert 'Compiled 9 templates.' in result.output
+  assert len(os.listdir(cache_dir)) == 9
+
+  # A new worker loads the compiled templates instead of compiling.
+  worker = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'],
+                       'TEMPLATE_CACHE': cache_dir})
+
+  def compile(*args, **kwargs):
+    raise AssertionError('template compiled')
+
+  worker.jinja_env.compile = compile
+  response = worker.test_client().get('/wildlife')
+  assert response.status_code == 200
+  assert b'Rocky Mountain Elk' in response.data
+  worker.extensions['db_pool'].close_all()
+
+
+def test_warmup(app):
+  warmed = create_app({'TESTING': True, 'DATABASE': app.config['DATABASE'],
+                       'TEMPLATE_CACHE': None, 'WARMUP': True})
+  assert len(warmed.jinja_env.cache) == 9
+  assert len(warmed.extensions['creature_types'][1]) == 7
+  # No connection is left open for forked workers to inherit.
+  stats = warmed.extensions['db_pool'].stats()
+  assert (stats['opened'], stats['idle'], stats['in_use']) == (1, 0, 0)
+
+
+def test_startup_is_lazy(tmp_path):
+  # Started from another directory, without loading the sign-in code.
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  output = subprocess.check_output(
+    [sys.executable, '-c', 'import sys; from wallowawildlife import '
+     'create_app; create_app({"TESTING": True, "TEMPLATE_CACHE": None}); '
+     'print("requests" in sys.modules)'],
+    cwd=str(tmp_path), env=dict(os.environ, PYTHONPATH=root))
+  assert output.strip() == b'False'
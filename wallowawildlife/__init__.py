@@ -5,8 +5,21 @@ This is the entry point to the entire application.
 """
 
 import os
-import json
-from flask import Flask, render_template, jsonify, flash, redirect, url_for
+from flask import (
+    Flask, Response, abort, render_template, jsonify, flash, redirect,
+    request, stream_with_context, url_for
+)
+
+
+def creature_json(c):
+    """Return the JSON representation of a creature row"""
+    return {'id': c['id'],
+            'name_common': c['name_common'],
+            'name_latin': c['name_latin'],
+            'photo_url': c['photo_url'],
+            'photo_attr': c['photo_attr'],
+            'wiki_url': c['wiki_url'],
+            'type': c['type_id']}
 
 
 def create_app(test_config=None):
@@ -15,12 +28,83 @@ def create_app(test_config=None):
     app.config.from_mapping(
         # This secret will be overriden with the instance config.
         SECRET_KEY='dev',
+        # Key for the gplus_id lookup digest, kept apart from
+        # SECRET_KEY so rotating that doesn't orphan every user. Must be
+        # overridden with the instance config along with SECRET_KEY.
+        GPLUS_DIGEST_KEY='dev',
+        # Check the salted hash of users who have no digest yet when
+        # someone unknown logs in. Each check is a PBKDF2 hash, so turn
+        # this off once the remaining users are not coming back.
+        LEGACY_GPLUS_LOOKUP=True,
         # Store the database in the instance folder.
         DATABASE=os.path.join(app.instance_path, 'wallowawildlife.sqlite'),
-        # Read in the client_id for google login.
-        CLIENT_ID=json.loads(
-            open('wallowawildlife/client_secrets.json', 'r')
-            .read())['web']['client_id']
+        # Reuse database connections, keeping up to DB_POOL_SIZE idle,
+        # and the SQLite settings applied to each one when it is opened.
+        DB_POOL=True,
+        DB_POOL_SIZE=16,
+        DB_JOURNAL_MODE='wal',
+        DB_SYNCHRONOUS='normal',
+        DB_MMAP_SIZE=64 * 1024 * 1024,
+        DB_CACHE_SIZE=-16000,
+        DB_BUSY_TIMEOUT=5000,
+        DB_STATEMENT_CACHE=256,
+        # Default and largest number of creatures on one list page.
+        PAGE_SIZE=100,
+        MAX_PAGE_SIZE=1000,
+        # Matches of a search ranked against each other, at most.
+        SEARCH_CANDIDATES=1000,
+        # Link static files under hashed names that are cached forever.
+        ASSET_FINGERPRINTS=True,
+        # Resized copies of the creature photos made by 'flask images'.
+        IMAGE_STORE=os.path.join(app.instance_path, 'images'),
+        # Offline bundles kept until the catalogue changes; None turns
+        # this off.
+        BUNDLE_CACHE=os.path.join(app.instance_path, 'bundles'),
+        # Serve the read routes from an in-memory copy of the creature
+        # table, brought up to date as the catalogue changes.
+        CATALOGUE_SNAPSHOT=False,
+        # Rendered list and detail pages kept in memory; 0 turns the
+        # page cache off.
+        PAGE_CACHE_SIZE=256,
+        # Report the number of SQL statements per request in a header.
+        COUNT_QUERIES=False,
+        # Time requests, SQL, templates and hashing for Server-Timing
+        # and /metrics. Requests slower than PROFILE_SLOW_REQUESTS
+        # seconds have their sampled stacks written to PROFILE_DIR.
+        METRICS=False,
+        PROFILE_SLOW_REQUESTS=None,
+        PROFILE_INTERVAL=0.005,
+        PROFILE_DIR=os.path.join(app.instance_path, 'profiles'),
+        # Google OAuth client secrets and token verification endpoint.
+        CLIENT_SECRETS=os.path.join(app.root_path, 'client_secrets.json'),
+        TOKENINFO_URL='https://www.googleapis.com/oauth2/v1/tokeninfo',
+        # Google's keys for checking ID tokens locally; None always asks
+        # the tokeninfo endpoint instead.
+        GOOGLE_CERTS_URL='https://www.googleapis.com/oauth2/v3/certs',
+        # Seconds to wait for Google, and keep-alive connections kept.
+        GOOGLE_CONNECT_TIMEOUT=3.05,
+        GOOGLE_READ_TIMEOUT=10,
+        GOOGLE_POOL_SIZE=10,
+        # Tokeninfo answers kept, and for how many seconds.
+        TOKENINFO_CACHE_SIZE=1024,
+        TOKENINFO_CACHE_TTL=300,
+        # Google OAuth client id; None takes the one in CLIENT_SECRETS,
+        # which is only read when someone first signs in.
+        CLIENT_ID=None,
+        # Compiled templates kept for the next worker; None turns this
+        # off.
+        TEMPLATE_CACHE=os.path.join(app.instance_path, 'templates'),
+        # Sightings committed together by the sighting writer, its
+        # SQLite synchronous setting, and the seconds a request waits
+        # for its sightings to be committed.
+        SIGHTING_BATCH_SIZE=256,
+        SIGHTING_SYNCHRONOUS='full',
+        SIGHTING_WRITE_TIMEOUT=10,
+        # Threads running the views of the read-only ASGI server.
+        ASGI_READ_THREADS=8,
+        # Compile templates and read the creature types in create_app
+        # rather than on the first requests.
+        WARMUP=False,
     )
 
     if test_config is None:
@@ -30,6 +114,15 @@ def create_app(test_config=None):
         # Otherwise, load the test config.
         app.config.update(test_config)
 
+    # Every stored digest depends on this key, so a deployment with a
+    # secret of its own must not quietly use the development one.
+    if app.config['SECRET_KEY'] != 'dev' \
+            and app.config['GPLUS_DIGEST_KEY'] in (None, 'dev'):
+        raise RuntimeError(
+            'Set GPLUS_DIGEST_KEY in the instance config. Databases whose '
+            'users were added when it fell back to SECRET_KEY need it set '
+            'to that SECRET_KEY.')
+
     # Make the instance folder if it doesn't exist.
     try:
         os.makedirs(app.instance_path)
@@ -37,66 +130,116 @@ def create_app(test_config=None):
         pass
 
     # Make the database available.
-    from wallowawildlife.db import get_db
+    from wallowawildlife.caching import conditional
+    from wallowawildlife.db import (
+        get_creature, get_creature_type, get_creatures, get_creature_types,
+        get_db
+    )
+    from wallowawildlife.export import (
+        NDJSON_MIMETYPE, json_array_chunks, ndjson_chunks
+    )
+    from wallowawildlife.pagination import page_size, paginate_creatures
+    from wallowawildlife.search import search_creatures
+    from wallowawildlife.summaries import (
+        get_progress, get_type_totals, most_seen
+    )
+
+    @app.context_processor
+    def inject_creature_types():
+        """Make the creature types available to every template"""
+        return {'types': get_creature_types()}
 
     @app.route('/')
     def index():
-        """Handle the index route"""
-        db = get_db()
-        types = db.execute('SELECT * FROM creature_type').fetchall()
-        return render_template('front_page.html', types=types)
+        """Handle the index route
+
+        The front page shows the most seen creatures, and how far the
+        logged-in user is through each checklist.
+        """
+        return render_template('front_page.html', progress=get_progress(),
+                               totals=get_type_totals(),
+                               most_seen=most_seen())
 
     @app.route('/wildlife/<int:creature_id>/JSON')
+    @conditional
     def wildlifeCreatureJSON(creature_id):
         """Create JSON endpoint"""
-        db = get_db()
-        c = db.execute('SELECT * FROM creature WHERE id = ?',
-                       (creature_id,)).fetchone()
+        c = get_creature(creature_id)
         if c:
-            json_creature = {'id': c['id'],
-                             'name_common': c['name_common'],
-                             'name_latin': c['name_latin'],
-                             'photo_url': c['photo_url'],
-                             'photo_attr': c['photo_attr'],
-                             'wiki_url': c['wiki_url'],
-                             'type': c['type_id']}
-            return jsonify(json_creature)
+            return jsonify(creature_json(c))
         else:
             return redirect(url_for('index'))
 
+    @app.route('/wildlife/search/JSON')
+    @conditional
+    def wildlifeSearchJSON():
+        """Create JSON endpoint
+
+        Return the creatures whose names match the search in ?q=,
+        best match first.
+        """
+        creatures = search_creatures(request.args.get('q', ''), page_size(),
+                                     request.args.get('type') or None)
+        return jsonify([creature_json(c) for c in creatures])
+
     @app.route('/wildlife/<url_text>/JSON')
+    @conditional
     def wildlifeTypeJSON(url_text):
-        """Create JSON endpoint"""
-        db = get_db()
-        creatures = db.execute('SELECT * FROM creature \
-                                WHERE type_id = ?',
-                               (url_text,)).fetchall()
-        if creatures:
-            json_creatures = [{'id': c['id'],
-                               'name_common': c['name_common'],
-                               'name_latin': c['name_latin'],
-                               'photo_url': c['photo_url'],
-                               'photo_attr': c['photo_attr'],
-                               'wiki_url': c['wiki_url'],
-                               'type': c['type_id']} for c in creatures]
-            return jsonify(json_creatures)
-        else:
+        """Create JSON endpoint
+
+        Creatures are returned one page at a time, with links to
+        the neighbouring pages in the Link header.
+        """
+        # If the URL doesn't match a creature type, go back to the index.
+        if get_creature_type(url_text) is None:
             return redirect(url_for('index'))
 
+        page = paginate_creatures(url_text)
+        response = jsonify([creature_json(c) for c in page.items])
+        response.headers['Link'] = page.link_header()
+        return response
+
     @app.route('/wildlife/JSON')
+    @conditional
     def wildlifeJSON():
-        """Create JSON endpoint"""
-        db = get_db()
-        creatures = db.execute('SELECT * FROM creature').fetchall()
-        json_creatures = [{'id': c['id'],
-                           'name_common': c['name_common'],
-                           'name_latin': c['name_latin'],
-                           'photo_url': c['photo_url'],
-                           'photo_attr': c['photo_attr'],
-                           'wiki_url': c['wiki_url'],
-                           'type': c['type_id']} for c in creatures]
-
-        return jsonify(json_creatures)
+        """Create JSON endpoint
+
+        Creatures are returned one page at a time, with links to
+        the neighbouring pages in the Link header. With ?all, every
+        creature is streamed as one JSON array instead, or as
+        NDJSON if the client prefers that. With ?ids=1,2,3, only
+        those creatures are returned, by id, in one query.
+        """
+        if 'ids' in request.args:
+            try:
+                ids = [int(i) for i in request.args['ids'].split(',')]
+            except ValueError:
+                abort(400)
+            if len(ids) > app.config['MAX_PAGE_SIZE']:
+                abort(400)
+
+            return jsonify([creature_json(c) for c in get_creatures(ids)])
+
+        ndjson = request.accept_mimetypes.best_match(
+            ['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+        if ndjson or 'all' in request.args:
+            serialize = ndjson_chunks if ndjson else json_array_chunks
+
+            # stream_with_context keeps the app context, and so the
+            # get_db connection, until the last chunk is sent, so the
+            # rows are read lazily as the response goes out.
+            def chunks():
+                cursor = get_db().execute('SELECT * FROM creature')
+                yield from serialize(cursor, creature_json)
+
+            return Response(stream_with_context(chunks()),
+                            mimetype=NDJSON_MIMETYPE if ndjson
+                            else 'application/json')
+
+        page = paginate_creatures()
+        response = jsonify([creature_json(c) for c in page.items])
+        response.headers['Link'] = page.link_header()
+        return response
 
     @app.errorhandler(404)
     def page_not_found(e):
@@ -107,6 +250,22 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    # Before the blueprints, so their request hooks are measured too.
+    from . import metrics
+    metrics.init_app(app)
+
+    from . import pagecache
+    pagecache.init_app(app)
+
+    from . import images
+    images.init_app(app)
+
+    from . import assets
+    assets.init_app(app)
+
+    from . import bundles
+    bundles.init_app(app)
+
     # Apply blueprints.
     from . import auth
     app.register_blueprint(auth.bp)
@@ -115,4 +274,18 @@ def create_app(test_config=None):
     app.register_blueprint(lists.bp)
     app.add_url_rule('/', endpoint='index')
 
+    from . import sightings
+    sightings.init_app(app)
+
+    from . import summaries
+    summaries.init_app(app)
+
+    from . import geo
+    geo.init_app(app)
+
+    from . import warmup
+    warmup.init_app(app)
+    if app.config['WARMUP']:
+        warmup.warm_up(app)
+
     return app
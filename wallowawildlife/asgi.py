@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""Read-Only API Server
+
+This module describes an ASGI application that serves the read-only
+JSON endpoints on asyncio, for running under an ASGI server such as
+uvicorn:
+
+    uvicorn --factory wallowawildlife.asgi:create_asgi_app
+
+Each connection is a coroutine rather than a thread, so idle
+keep-alive clients and clients slow to read their responses cost
+little. The views themselves still run in Flask, in a pool of
+ASGI_READ_THREADS threads, so the URLs, headers and bodies are the
+same as from the WSGI app. Responses are handed to the server a chunk
+at a time, and no thread waits while a client catches up.
+"""
+
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import HTTPException
+
+from wallowawildlife import create_app
+
+# The endpoints this server answers; any other URL is a 404.
+READ_ENDPOINTS = frozenset(['wildlifeCreatureJSON', 'wildlifeTypeJSON',
+                            'wildlifeJSON'])
+
+# Body bytes gathered in a thread before they are handed to the server.
+CHUNK_SIZE = 64 * 1024
+
+NOT_FOUND = b'{"error": "Not found."}\n'
+
+
+def wsgi_environ(scope):
+    """Return the WSGI environ of an ASGI HTTP request without a body"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8')
+                                                .decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/%s' % scope['http_version'],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+
+    return environ
+
+
+class ResponseReader(object):
+    """A WSGI response, read in the thread pool a chunk at a time"""
+
+    def __init__(self, app, environ):
+        self.status = None
+        self.headers = None
+        self._iterable = app(environ, self._start_response)
+        self._chunks = iter(self._iterable)
+
+    def _start_response(self, status, headers, exc_info=None):
+        self.status = int(status.split(' ', 1)[0])
+        self.headers = [(k.lower().encode('latin-1'), v.encode('latin-1'))
+                        for k, v in headers]
+
+    def read(self):
+        """Return the next CHUNK_SIZE or so bytes and whether more follow"""
+        parts = []
+        size = 0
+        for chunk in self._chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= CHUNK_SIZE:
+                return b''.join(parts), True
+
+        return b''.join(parts), False
+
+    def close(self):
+        """Let the app clean up, as the WSGI server would"""
+        if hasattr(self._iterable, 'close'):
+            self._iterable.close()
+
+
+class ReadOnlyAPI(object):
+    """ASGI application answering the read-only JSON endpoints"""
+
+    def __init__(self, app):
+        self.app = app
+        self.urls = app.url_map.bind('localhost')
+        self.executor = ThreadPoolExecutor(app.config['ASGI_READ_THREADS'],
+                                           thread_name_prefix='read')
+
+    def is_read_route(self, path):
+        """Check whether a path is one of READ_ENDPOINTS"""
+        try:
+            endpoint, _ = self.urls.match(path, 'GET')
+        except HTTPException:
+            return False
+
+        return endpoint in READ_ENDPOINTS
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, send)
+
+    async def lifespan(self, receive, send):
+        """Close the threads and connections when the server stops"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        """Stop the thread pool and close the pooled connections"""
+        self.executor.shutdown()
+        pool = self.app.extensions.get('db_pool')
+        if pool is not None:
+            pool.close_all()
+
+    async def http(self, scope, send):
+        """Answer one request"""
+        if scope['method'] not in ('GET', 'HEAD') \
+                or not self.is_read_route(scope['path']):
+            await send({'type': 'http.response.start', 'status': 404,
+                        'headers': [(b'content-type', b'application/json'),
+                                    (b'content-length',
+                                     str(len(NOT_FOUND)).encode())]})
+            await send({'type': 'http.response.body', 'body': NOT_FOUND})
+            return
+
+        # Flask keeps its request context in context variables, so
+        # every step of one response runs in the same copy of them,
+        # whichever thread it lands on.
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+
+        def run(func, *args):
+            return loop.run_in_executor(self.executor, context.run,
+                                        func, *args)
+
+        reader = await run(ResponseReader, self.app, wsgi_environ(scope))
+        try:
+            body, more = await run(reader.read)
+            await send({'type': 'http.response.start',
+                        'status': reader.status,
+                        'headers': reader.headers})
+            await send({'type': 'http.response.body', 'body': body,
+                        'more_body': more})
+            while more:
+                body, more = await run(reader.read)
+                await send({'type': 'http.response.body', 'body': body,
+                            'more_body': more})
+        finally:
+            await run(reader.close)
+
+
+def create_asgi_app(test_config=None):
+    """Create the read-only API of Wallowa Wildlife Checklists"""
+    return ReadOnlyAPI(create_app(test_config))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Static Assets
+
+This module describes how the files in static are fingerprinted when
+the app starts. url_for('static', ...) then links each file under a
+name containing the hash of its content, which is served with a
+one-year immutable Cache-Control, so browsers never ask for it again
+until the file changes and its name with it.
+
+Text files are also compressed with gzip, and with brotli when that
+package is installed, and sent compressed to clients that accept it.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ONE_YEAR = 31536000
+
+# Files worth compressing. Images are compressed already.
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.json', '.html')
+
+
+class AssetManifest(object):
+    """Fingerprinted names and compressed copies of the static files"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        # Original name to hashed name, and back.
+        self.hashed = {}
+        self.original = {}
+        # Hashed name to a dict of encoding to compressed bytes.
+        self.encoded = {}
+
+        for root, _, files in os.walk(static_folder):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, static_folder) \
+                    .replace(os.sep, '/')
+                self.add(filename, path)
+
+        # Changes whenever any file does, as do pages linking them.
+        self.version = hashlib.sha256(
+            ' '.join(sorted(self.original)).encode('utf-8')).hexdigest()
+
+    def add(self, filename, path):
+        """Fingerprint one file and compress it if it is text"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+
+        base, ext = posixpath.splitext(filename)
+        hashed = '%s.%s%s' % (base, digest, ext)
+        self.hashed[filename] = hashed
+        self.original[hashed] = filename
+
+        if ext.lower() in COMPRESSIBLE:
+            encoded = {'gzip': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                encoded['br'] = brotli.compress(data)
+            # Only keep the copies that are worth sending.
+            self.encoded[hashed] = {k: v for k, v in encoded.items()
+                                    if len(v) < len(data)}
+
+
+def get_manifest():
+    """Return the asset manifest, or None if fingerprinting is off"""
+    return current_app.extensions.get('asset_manifest')
+
+
+def assets_version():
+    """Return a string that changes whenever a static file does"""
+    manifest = get_manifest()
+    return manifest.version if manifest is not None else ''
+
+
+def fingerprint_url(endpoint, values):
+    """Link static files under their hashed names"""
+    manifest = get_manifest()
+    if endpoint == 'static' and manifest is not None:
+        filename = values.get('filename')
+        values['filename'] = manifest.hashed.get(filename, filename)
+
+
+def send_static(filename):
+    """Serve a static file, caching hashed names forever
+
+    Requests for the original names are served as Flask normally
+    would, for links made before the file last changed.
+    """
+    app = current_app._get_current_object()
+    manifest = get_manifest()
+    original = manifest.original.get(filename) if manifest else None
+    if original is None:
+        return app.send_static_file(filename)
+
+    encoded = manifest.encoded.get(filename, {})
+    encoding = request.accept_encodings.best_match(
+        [e for e in ('br', 'gzip') if e in encoded])
+    if encoding is None:
+        response = app.send_static_file(original)
+    else:
+        response = app.response_class(
+            encoded[encoding], mimetype=mimetypes.guess_type(original)[0])
+        response.content_encoding = encoding
+
+    response.cache_control.public = True
+    response.cache_control.max_age = ONE_YEAR
+    response.cache_control.immutable = True
+    if encoded:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    """Fingerprint the static files unless ASSET_FINGERPRINTS is off"""
+    if app.config['ASSET_FINGERPRINTS'] and app.has_static_folder:
+        app.extensions['asset_manifest'] = AssetManifest(app.static_folder)
+        app.url_defaults(fingerprint_url)
+        app.view_functions['static'] = send_static
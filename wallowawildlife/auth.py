@@ -9,21 +9,101 @@ before being modified for this application.
 """
 
 import functools
+import hashlib
+import hmac
 import random
 import string
 import json
-import httplib2
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for,
-    current_app as app
+    Blueprint, flash, g, make_response, redirect, render_template, request,
+    session, url_for, current_app as app
 )
 from werkzeug.security import check_password_hash, generate_password_hash
 from wallowawildlife.db import get_db
-from oauth2client.client import flow_from_clientsecrets, FlowExchangeError
+from wallowawildlife.metrics import timed
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
 
+def gplus_digest(gplus_id):
+    """Return the keyed digest of a gplus_id
+
+    The salted hash in user.gplus_id can only be checked one row at
+    a time. This digest is deterministic, so the user table can be
+    searched for it with a single indexed query.
+    """
+    key = app.config['GPLUS_DIGEST_KEY']
+    with timed('auth'):
+        return hmac.new(key.encode('utf-8'), gplus_id.encode('utf-8'),
+                        hashlib.sha256).hexdigest()
+
+
+def find_user_id(gplus_id):
+    """Find the user.id belonging to a gplus_id
+
+    Return None if there is no such user. This is a single indexed
+    query, whoever asks.
+    """
+    user = get_db().execute('SELECT id FROM user WHERE gplus_digest = ?',
+                            (gplus_digest(gplus_id),)).fetchone()
+    return user['id'] if user is not None else None
+
+
+def find_legacy_user_id(gplus_id):
+    """Find the user.id of a gplus_id among users without a digest
+
+    Users created before the digest existed only have the salted hash,
+    which has to be checked one row at a time, so this is only done
+    at login, and not at all once every such user has logged in again
+    or LEGACY_GPLUS_LOOKUP is turned off. The digest is stored for
+    next time. Return None if there is no such user.
+    """
+    if not app.config['LEGACY_GPLUS_LOOKUP']:
+        return None
+
+    # The index on gplus_digest finds these rows, so this costs
+    # nothing once there are none.
+    db = get_db()
+    legacy_users = db.execute('SELECT id, gplus_id FROM user \
+                               WHERE gplus_digest IS NULL').fetchall()
+    for u in legacy_users:
+        with timed('auth'):
+            matched = check_password_hash(u['gplus_id'], gplus_id)
+        if matched:
+            db.execute('UPDATE user SET gplus_digest = ? WHERE id = ?',
+                       (gplus_digest(gplus_id), u['id']))
+            db.commit()
+            return u['id']
+
+    return None
+
+
+def add_user(gplus_id):
+    """Find or create the user for a gplus_id and return its user.id
+
+    Known users cost one indexed lookup. New users are inserted with
+    an upsert on the digest, so concurrent first logins of the same
+    user cannot create duplicate rows.
+    """
+    user_id = find_user_id(gplus_id)
+    if user_id is None:
+        user_id = find_legacy_user_id(gplus_id)
+    if user_id is not None:
+        return user_id
+
+    db = get_db()
+    digest = gplus_digest(gplus_id)
+    with timed('auth'):
+        gplus_hash = generate_password_hash(gplus_id)
+    db.execute('INSERT INTO user (gplus_id, gplus_digest) VALUES (?, ?) \
+                ON CONFLICT (gplus_digest) DO NOTHING',
+               (gplus_hash, digest))
+    db.commit()
+
+    return db.execute('SELECT id FROM user WHERE gplus_digest = ?',
+                      (digest,)).fetchone()['id']
+
+
 @bp.before_app_request
 def load_logged_in_user():
     """Check current session user when loading every page
@@ -32,39 +112,44 @@ def load_logged_in_user():
     to find the user's id in the 'user' table so the lists
     templates and functions can determine authorization for
     performing CRUD operations.
+
+    The id found is kept in the session, so later requests only
+    need to confirm it by primary key.
     """
     user_id = session.get('user_id')
     if user_id is None:
         g.user_id = None
-    else:
-        users = get_db().execute('SELECT * FROM user').fetchall()
-        user_found_flag = False
-        for u in users:
-            if check_password_hash(u['gplus_id'], user_id):
-                g.user_id = u['id']
-                user_found_flag = True
-                redirect(url_for('lists.listAll'))
+        return
 
-        # If something went wrong with the session, close the
-        # session and redirect the user to the login page.
-        if not user_found_flag:
-            session.clear()
-            g.user_id = None
+    cached_id = session.get('user_pk')
+    if cached_id is not None:
+        user = get_db().execute('SELECT id FROM user \
+                                 WHERE id = ? AND gplus_digest = ?',
+                                (cached_id, gplus_digest(user_id))).fetchone()
+        if user is not None:
+            g.user_id = user['id']
+            return
+
+    g.user_id = find_user_id(user_id)
+
+    # If something went wrong with the session, close the
+    # session and redirect the user to the login page.
+    if g.user_id is None:
+        session.clear()
+    else:
+        session['user_pk'] = g.user_id
 
 
 @bp.route('/login', methods=('GET', 'POST'))
 def login():
     """Handle the GET and POST methods of user login"""
 
-    db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
-
     # Create and store access token in the session.
     if request.method == 'GET':
         state = ''.join(random.choice(string.ascii_uppercase
                                       + string.digits) for x in range(32))
         session['state'] = state
-        return render_template('auth/login.html', types=types,
+        return render_template('auth/login.html',
                                glogin=True, STATE=state)
 
     # The user has logged in with google.
@@ -77,49 +162,68 @@ def login():
             response.headers['Content-Type'] = 'application/json'
             return response
 
+        # Loaded on first use, so workers start without requests.
+        from wallowawildlife.verification import (
+            VerificationError, decode_jwt, get_verifier
+        )
+
         # Obtain authorization code.
-        code = request.data
+        code = request.data.decode('utf-8')
+        verifier = get_verifier()
         try:
-            # Upgrade the authorization code into a credentials object.
-            oauth_flow = flow_from_clientsecrets(
-                app.root_path + '/client_secrets.json', scope=''
-            )
-            oauth_flow.redirect_uri = 'postmessage'
-            credentials = oauth_flow.step2_exchange(code)
-        except FlowExchangeError:
+            # Upgrade the authorization code into tokens.
+            credentials = verifier.exchange(code)
+            id_token = decode_jwt(credentials['id_token'])[1]
+        except VerificationError:
             response = make_response(
                 json.dumps('Failed to upgrade the authorization code.'), 401)
             response.headers['Content-Type'] = 'application/json'
             return response
 
-        # Check that the access token is valid.
-        access_token = credentials.access_token
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-               % access_token)
-        h = httplib2.Http()
-        result = json.loads(h.request(url, 'GET')[1].decode('utf-8'))
-
-        # If there was an error in the access token info, abort.
-        if result.get('error') is not None:
-            response = make_response(json.dumps(result.get('error')), 500)
-            response.headers['Content-Type'] = 'application/json'
-            return response
-
-        # Verify that the access token is used for the intended user.
-        gplus_id = credentials.id_token['sub']
-        if result['user_id'] != gplus_id:
+        gplus_id = id_token.get('sub')
+        if not isinstance(gplus_id, str) or not gplus_id:
             response = make_response(
-                json.dumps("Token's user ID doesn't match user ID."), 401)
+                json.dumps('ID token has no user ID.'), 401)
             response.headers['Content-Type'] = 'application/json'
             return response
 
-        # Verify that the access token is valid for this app.
-        if result['issued_to'] != app.config['CLIENT_ID']:
-            response = make_response(
-                json.dumps("Token's client ID does not match app's."), 401)
+        # A signed ID token can be checked without asking Google.
+        try:
+            verified = verifier.verify_id_token(credentials['id_token'])
+        except VerificationError as e:
+            response = make_response(json.dumps(str(e)), 401)
             response.headers['Content-Type'] = 'application/json'
             return response
 
+        if verified is None:
+            # Otherwise, check that the access token is valid.
+            try:
+                result = verifier.tokeninfo(credentials['access_token'])
+            except VerificationError as e:
+                result = {'error': str(e)}
+
+            # If there was an error in the access token info, abort.
+            if result.get('error') is not None:
+                response = make_response(json.dumps(result.get('error')),
+                                         500)
+                response.headers['Content-Type'] = 'application/json'
+                return response
+
+            # Verify that the access token is used for the intended user.
+            if result['user_id'] != gplus_id:
+                response = make_response(
+                    json.dumps("Token's user ID doesn't match user ID."), 401)
+                response.headers['Content-Type'] = 'application/json'
+                return response
+
+            # Verify that the access token is valid for this app.
+            if result['issued_to'] != verifier.client_id:
+                response = make_response(
+                    json.dumps("Token's client ID does not match app's."),
+                    401)
+                response.headers['Content-Type'] = 'application/json'
+                return response
+
         stored_access_token = session.get('access_token')
         stored_gplus_id = session.get('gplus_id')
         if stored_access_token is not None and gplus_id == stored_gplus_id:
@@ -130,23 +234,11 @@ def login():
             return response
 
         # Store the access token in the session for later use.
-        session['access_token'] = credentials.access_token
+        session['access_token'] = credentials['access_token']
         session['user_id'] = gplus_id
 
         # If the user does not exist in the user table, add them.
-        users = db.execute('SELECT * FROM user').fetchall()
-        user_found_flag = False
-        for u in users:
-            if check_password_hash(u['gplus_id'], gplus_id):
-                user_found_flag = True
-
-        if not user_found_flag:
-            hashed_gplus_id = generate_password_hash(gplus_id)
-            db.execute(
-                'INSERT INTO user (gplus_id) VALUES (?)',
-                (hashed_gplus_id,)
-            )
-            db.commit()
+        session['user_pk'] = add_user(gplus_id)
 
         flash("You are now logged in!")
         return redirect(url_for('lists.listAll'))
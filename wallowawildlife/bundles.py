@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Offline Bundles
+
+This module describes ZIP archives of the catalogue, or of one
+category, for devices that are used in the field without a
+connection. A bundle holds catalogue.json, which lists the creatures
+as compact arrays, and the thumbnail of every creature that has one.
+
+A bundle asked for with since set to the version of an earlier
+bundle only holds the creatures changed since then, and the ids of
+those deleted or moved to another category. Bundles are streamed as
+they are made and kept in the instance folder until the catalogue
+changes.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+
+import click
+from flask import (
+    Blueprint, Response, current_app, redirect, request, send_file,
+    stream_with_context, url_for
+)
+from flask.cli import with_appcontext
+
+from wallowawildlife.caching import conditional
+from wallowawildlife.db import (
+    detached_db, get_catalogue_version, get_creature_type
+)
+from wallowawildlife.export import dumps, iter_rows
+from wallowawildlife.images import get_store, photo_entry
+
+bp = Blueprint('bundles', __name__)
+
+FORMAT = 1
+
+FIELDS = ('id', 'name_common', 'name_latin', 'type_id',
+          'photo_url', 'photo_attr', 'wiki_url', 'thumb')
+
+VERSION_RE = re.compile(r'^([0-9a-f]+)-([0-9]+)$')
+
+# Every member gets the same timestamp, so the same catalogue always
+# makes the same archive.
+DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+class ChunkWriter(object):
+    """File-like object collecting what a ZipFile writes to it"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return and forget everything written so far"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def delta_start(since, version):
+    """Return the catalogue version number a delta from since starts at
+
+    Return None if a full bundle is needed instead, because since is
+    missing or malformed, or comes from another epoch or the future.
+    """
+    match = VERSION_RE.match(since or '')
+    epoch, current = version.split('-')
+    if match is None or match.group(1) != epoch \
+            or int(match.group(2)) > int(current):
+        return None
+
+    return int(match.group(2))
+
+
+def bundle_name(version, type_id, start):
+    """Return the file name of a bundle"""
+    return 'wildlife_%s_%s_%s.zip' % (version, type_id or 'all',
+                                      'full' if start is None else start)
+
+
+def select_creatures(db, type_id, start):
+    """Return a cursor over the creatures a bundle holds, by id"""
+    columns = ', '.join('creature.' + f for f in FIELDS[:-1])
+    if start is None:
+        sql = 'SELECT %s FROM creature' % columns
+        where, params = [], []
+    else:
+        sql = 'SELECT %s FROM creature_change \
+               JOIN creature ON creature.id = creature_change.creature_id' \
+            % columns
+        where, params = ['creature_change.version >= ?'], [start]
+    if type_id is not None:
+        where.append('creature.type_id = ?')
+        params.append(type_id)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+
+    return db.execute(sql + ' ORDER BY creature.id', params)
+
+
+def select_deleted(db, type_id, start):
+    """Return the ids a delta removes from a device
+
+    These are the creatures deleted since start and, for a category,
+    those changed since start that are now in another category.
+    """
+    if start is None:
+        return []
+
+    sql = 'SELECT creature_change.creature_id FROM creature_change \
+           LEFT JOIN creature ON creature.id = creature_change.creature_id \
+           WHERE creature_change.version >= ? AND (creature.id IS NULL'
+    params = [start]
+    if type_id is not None:
+        sql += ' OR creature.type_id IS NOT ?'
+        params.append(type_id)
+    sql += ') ORDER BY creature_change.creature_id'
+
+    return [r[0] for r in db.execute(sql, params)]
+
+
+def bundle_chunks(version, type_id=None, start=None):
+    """Yield the bytes of a bundle as it is made
+
+    The creatures are read in one transaction so the bundle is
+    consistent even if the catalogue changes while it is streamed.
+    """
+    out = ChunkWriter()
+    thumbs = {}
+
+    def creature_row(row):
+        """Return a creature as a list, noting its thumbnail"""
+        entry = photo_entry(row['photo_url'])
+        thumb = None
+        if entry is not None:
+            thumb = 'thumbs/%s.jpg' % entry['hash']
+            thumbs[thumb] = entry['variants']['thumb']['jpeg']
+        return list(row) + [thumb]
+
+    # The connection is rolled back when it is handed back.
+    with detached_db() as db:
+        db.execute('BEGIN')
+        with zipfile.ZipFile(out, 'w') as archive:
+            info = zipfile.ZipInfo('catalogue.json', DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w') as f:
+                header = {
+                    'format': FORMAT,
+                    'version': version,
+                    'since': None if start is None
+                    else '%s-%d' % (version.split('-')[0], start),
+                    'type': type_id,
+                    'types': [list(t) for t in db.execute(
+                        'SELECT url_text, name FROM creature_type')],
+                    'fields': FIELDS,
+                    'deleted': select_deleted(db, type_id, start),
+                }
+                # Leave the object open so the creatures can follow.
+                f.write(dumps(header)[:-1].encode('utf-8'))
+                f.write(b',"creatures":[')
+
+                separator = b''
+                cursor = select_creatures(db, type_id, start)
+                for rows in iter_rows(cursor):
+                    f.write(separator + b','.join(
+                        dumps(creature_row(r)).encode('utf-8')
+                        for r in rows))
+                    separator = b','
+                    yield out.take()
+                f.write(b']}\n')
+            yield out.take()
+
+            # Thumbnails are compressed already, so they are stored.
+            store = get_store()
+            for name, variant in sorted(thumbs.items()):
+                info = zipfile.ZipInfo(name, DATE_TIME)
+                with archive.open(info, 'w') as f, \
+                        open(os.path.join(store, variant), 'rb') as src:
+                    shutil.copyfileobj(src, f)
+                yield out.take()
+        yield out.take()
+
+
+def cached_chunks(chunks, path):
+    """Yield chunks while saving them to path
+
+    The file only appears under path once every chunk is written, and
+    files of older catalogue versions are removed then.
+    """
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+        tmp_path = None
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+
+    # Names start with wildlife_<version>_.
+    prefix = '_'.join(name.split('_')[:2]) + '_'
+    for old in os.listdir(directory):
+        if old.endswith('.zip') and not old.startswith(prefix):
+            try:
+                os.unlink(os.path.join(directory, old))
+            except FileNotFoundError:
+                pass
+
+
+@bp.route('/wildlife/bundle')
+@conditional
+def downloadBundle():
+    """Send a bundle of the catalogue, or of ?type=<url_text>
+
+    With ?since=<version>, only what changed after that version is
+    sent. The catalogue version is in the X-Catalogue-Version header.
+    """
+    type_id = request.args.get('type')
+    if type_id is not None and get_creature_type(type_id) is None:
+        return redirect(url_for('index'))
+
+    version = get_catalogue_version()
+    start = delta_start(request.args.get('since'), version)
+    name = bundle_name(version, type_id, start)
+
+    cache = current_app.config['BUNDLE_CACHE']
+    path = os.path.join(cache, name) if cache else None
+    if path is not None and os.path.exists(path):
+        response = send_file(path, mimetype='application/zip', etag=False)
+    else:
+        # The chunks need the app context for the pool and the image
+        # manifest. The bundle reads in a transaction of its own, on a
+        # detached connection rather than the request's.
+        chunks = bundle_chunks(version, type_id, start)
+        if path is not None:
+            chunks = cached_chunks(chunks, path)
+        response = Response(stream_with_context(chunks),
+                            mimetype='application/zip')
+
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="%s"' % name
+    response.headers['X-Catalogue-Version'] = version
+    return response
+
+
+@click.command('bundle')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--type', 'type_id', help='Only include this category.')
+@click.option('--since', help='Only include changes after this version.')
+@with_appcontext
+def bundle_command(output, type_id, since):
+    """Write an offline bundle of the catalogue to OUTPUT"""
+    if type_id is not None and get_creature_type(type_id) is None:
+        raise click.BadParameter('No such category.', param_hint='--type')
+
+    version = get_catalogue_version()
+    start = delta_start(since, version)
+    with open(output, 'wb') as f:
+        for chunk in bundle_chunks(version, type_id, start):
+            f.write(chunk)
+
+    click.echo('Wrote %s bundle of catalogue version %s to %s.'
+               % ('a full' if start is None else 'a delta', version, output))
+
+
+def init_app(app):
+    """Register the bundle route and command"""
+    app.register_blueprint(bp)
+    app.cli.add_command(bundle_command)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""HTTP Caching
+
+This module describes a decorator that lets clients revalidate
+catalogue reads with If-None-Match. The ETag is derived from the
+catalogue version instead of the response body, so an unchanged page
+is answered with 304 Not Modified before the view runs at all.
+"""
+
+import functools
+import hashlib
+
+from flask import g, make_response, request, session
+
+from wallowawildlife.assets import assets_version
+from wallowawildlife.db import get_catalogue_version
+from wallowawildlife.images import manifest_version
+from wallowawildlife.summaries import get_checklist_version
+
+
+def catalogue_etag():
+    """Return the ETag for the current request of a catalogue read
+
+    Besides the catalogue version, the tag covers everything else a
+    page depends on: the URL, the logged-in user, who sees Edit and
+    Delete buttons for their own entries, that user's sightings, which
+    decide the checklist progress shown, the requested type, the
+    image manifest, which decides which photo variants are linked, and
+    the fingerprints of the static files the page links.
+
+    Return None if the response must not be cached, which is the
+    case while flashed messages are waiting to be shown.
+    """
+    if session.get('_flashes'):
+        return None
+
+    key = '\n'.join([get_catalogue_version(),
+                     manifest_version(),
+                     assets_version(),
+                     request.full_path,
+                     str(g.user_id),
+                     get_checklist_version(),
+                     request.headers.get('Accept', '')])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional(view):
+    """Answer a matching If-None-Match with 304 Not Modified
+
+    Successful responses are sent with a strong ETag and must be
+    revalidated each time they are used.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        """Define the wrapped view to check the catalogue version"""
+        etag = catalogue_etag()
+        if etag is None:
+            return view(**kwargs)
+
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(**kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.update(['Accept', 'Cookie'])
+        return response
+
+    return wrapped_view
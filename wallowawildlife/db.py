@@ -5,93 +5,890 @@ This module describes functions for initializing and
 accessing the sqlite database.
 """
 
+import contextlib
+import csv
+import datetime
+import itertools
+import json
 import sqlite3
+import threading
+import time
 
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
 from werkzeug.security import generate_password_hash
 
+from wallowawildlife.metrics import TimedConnection
+from wallowawildlife.snapshot import SnapshotHolder
+
+
+def convert_timestamp(value):
+    """Parse a TIMESTAMP column, stored as SQLite's CURRENT_TIMESTAMP is"""
+    return datetime.datetime.fromisoformat(value.decode('ascii'))
+
+
+# sqlite3's own TIMESTAMP converter is deprecated as of Python 3.12.
+sqlite3.register_converter('TIMESTAMP', convert_timestamp)
+
+
+class ConnectionPool(object):
+    """Keep open connections to the database for reuse between requests
+
+    A connection is used by one thread at a time. Reusing it saves
+    opening the database and applying its settings on every request,
+    and the statements it has already prepared stay in its statement
+    cache. Up to size idle connections are kept; any more are closed
+    when they are released.
+    """
+
+    def __init__(self, config, size):
+        self.config = config
+        self.size = size
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.in_use = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Return an idle connection, or a new one if there is none"""
+        with self._lock:
+            self.in_use += 1
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.opened += 1
+
+        return connect(self.config)
+
+    def release(self, db):
+        """Hand a connection back at the end of a request"""
+        if db.in_transaction:
+            db.rollback()
+        db.set_trace_callback(None)
+
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.size:
+                self._idle.append(db)
+                return
+            self.closed += 1
+        db.close()
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.closed += len(idle)
+        for db in idle:
+            db.close()
+
+    def stats(self):
+        """Return counts of the connections opened, reused and closed,
+        and of those in use and idle now
+        """
+        with self._lock:
+            return {'opened': self.opened,
+                    'reused': self.reused,
+                    'closed': self.closed,
+                    'in_use': self.in_use,
+                    'idle': len(self._idle)}
+
+
+def connect(config):
+    """Open a connection to the database with the configured settings"""
+    db = sqlite3.connect(
+        config['DATABASE'],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=config['DB_STATEMENT_CACHE'],
+        # Time each statement when METRICS is on.
+        factory=TimedConnection if config['METRICS'] else sqlite3.Connection,
+        # Pooled connections are used by one thread at a time, but
+        # not always the same one.
+        check_same_thread=False
+    )
+    db.row_factory = sqlite3.Row
+
+    db.execute('PRAGMA busy_timeout = %d' % config['DB_BUSY_TIMEOUT'])
+    if config['DB_JOURNAL_MODE']:
+        db.execute('PRAGMA journal_mode = %s' % config['DB_JOURNAL_MODE'])
+    if config['DB_SYNCHRONOUS']:
+        db.execute('PRAGMA synchronous = %s' % config['DB_SYNCHRONOUS'])
+    if config['DB_MMAP_SIZE'] is not None:
+        db.execute('PRAGMA mmap_size = %d' % config['DB_MMAP_SIZE'])
+    if config['DB_CACHE_SIZE'] is not None:
+        db.execute('PRAGMA cache_size = %d' % config['DB_CACHE_SIZE'])
+
+    return db
+
+
+def get_pool():
+    """Return the connection pool of the current app
+
+    Return None if connections are not pooled.
+    """
+    return current_app.extensions.get('db_pool')
+
 
 def get_db():
     """Make the database available in current app context"""
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        pool = get_pool()
+        if pool is not None:
+            g.db = pool.acquire()
+        else:
+            g.db = connect(current_app.config)
+
+        # Count the statements run during this request.
+        if current_app.config['COUNT_QUERIES']:
+            g.query_count = 0
+            g.db.set_trace_callback(_count_query)
 
     return g.db
 
 
+@contextlib.contextmanager
+def detached_db():
+    """Lend a connection that is not tied to the app context
+
+    Work that needs a transaction of its own, such as building a
+    bundle or a catalogue snapshot, uses this instead of get_db and
+    hands the connection back when it finishes.
+    """
+    pool = get_pool()
+    db = pool.acquire() if pool is not None else connect(current_app.config)
+    try:
+        yield db
+    finally:
+        if pool is not None:
+            pool.release(db)
+        else:
+            db.close()
+
+
+def _count_query(statement):
+    """Trace callback that counts each statement run"""
+    g.query_count += 1
+
+
+def add_query_count_header(response):
+    """Report the number of statements run in an X-Query-Count header"""
+    if current_app.config['COUNT_QUERIES']:
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+
+    return response
+
+
 def close_db(e=None):
     """Remove database from current app context"""
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        pool = get_pool()
+        if pool is not None:
+            pool.release(db)
+        else:
+            db.close()
+
+
+def get_creature_types():
+    """Return the creature types, reading them from the database once
+
+    The rows are kept instead of being queried for every page that
+    renders the nav bar, and read again once per catalogue version,
+    so a 'flask initdb' run elsewhere reaches every worker.
+    """
+    version = get_catalogue_version()
+    cached = current_app.extensions.get('creature_types')
+    if cached is None or cached[0] != version:
+        types = get_db().execute('SELECT * FROM creature_type').fetchall()
+        cached = (version, types)
+        current_app.extensions['creature_types'] = cached
+
+    return cached[1]
+
+
+def get_creature_type(url_text):
+    """Return the creature type with the given url_text, or None"""
+    for t in get_creature_types():
+        if t['url_text'] == url_text:
+            return t
+
+    return None
+
+
+def invalidate_creature_types():
+    """Forget the cached creature types after they have changed"""
+    current_app.extensions.pop('creature_types', None)
+
+
+def get_snapshot():
+    """Return the catalogue snapshot, or None if it is turned off
+
+    The snapshot is brought up to this request's catalogue version
+    first.
+    """
+    holder = current_app.extensions.get('catalogue_snapshot')
+    if holder is None:
+        return None
+
+    return holder.get(get_catalogue_version(), detached_db)
+
+
+def get_creature(creature_id):
+    """Return the creature with the given id, or None"""
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get(creature_id)
+
+    return get_db().execute('SELECT * FROM creature WHERE id = ?',
+                            (creature_id,)).fetchone()
+
+
+def get_creatures(ids):
+    """Return the creatures with the given ids, ordered by id
+
+    The ids are passed as one JSON array, so a single prepared
+    statement serves any number of them. Missing ids are left out.
+    """
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        return snapshot.get_many(ids)
+
+    return get_db().execute(
+        'SELECT * FROM creature \
+         WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id',
+        (json.dumps(list(ids)),)).fetchall()
+
 
+def get_catalogue_version():
+    """Return a string identifying the current state of the catalogue
 
-def init_db():
+    The version is read once per request.
+    """
+    if 'catalogue_version' not in g:
+        row = get_db().execute('SELECT epoch, version \
+                                FROM catalogue').fetchone()
+        g.catalogue_version = '%s-%d' % (row['epoch'], row['version'])
+
+    return g.catalogue_version
+
+
+def bump_catalogue_version():
+    """Record that the creature catalogue has changed
+
+    Call this from every write to creature or creature_type, before
+    committing, so that the change and the new version are saved
+    together.
+    """
+    get_db().execute('UPDATE catalogue SET version = version + 1')
+    g.pop('catalogue_version', None)
+
+
+# Creatures inserted per executemany call while importing a CSV.
+IMPORT_BATCH_SIZE = 10000
+
+# The columns of the creature CSV, in order.
+CSV_FIELDS = ('name_common', 'name_latin', 'type_id',
+              'photo_url', 'photo_attr', 'wiki_url')
+
+
+def read_creature_csv(path, type_ids, bad_rows):
+    """Yield the creatures in a CSV file as tuples of CSV_FIELDS
+
+    Rows that cannot be imported are skipped and appended to
+    bad_rows as (line number, reason) instead.
+    """
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        for row in reader:
+            row = [field.strip() for field in row]
+            if not any(row):
+                continue
+
+            if len(row) != len(CSV_FIELDS):
+                bad_rows.append((reader.line_num,
+                                 'expected %d fields, found %d'
+                                 % (len(CSV_FIELDS), len(row))))
+            elif not row[0] or not row[1]:
+                bad_rows.append((reader.line_num, 'missing name'))
+            elif row[2] not in type_ids:
+                bad_rows.append((reader.line_num,
+                                 'unknown type %r' % row[2]))
+            else:
+                yield tuple(row)
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_catalogue(db, csv_path, batch_size):
+    """Load the creature types, creatures and admin user of init_db
+
+    Everything is done in one transaction and rolled back if any of
+    it fails.
+    """
+    db.execute('BEGIN')
+    try:
+        # Manually add list of creature types.
+        types = [('Mammals', 'mammal'),
+                 ('Birds', 'bird'),
+                 ('Reptiles & Amphibians', 'reptile_amphibian'),
+                 ('Trees & Shrubs', 'tree_shrub'),
+                 ('Fishes', 'fish'),
+                 ('Wildflowers', 'wildflower'),
+                 ('Spiders & Insects', 'spider_insect')]
+        db.executemany(
+            'INSERT INTO creature_type (name, url_text) VALUES (?, ?)', types)
+
+        # Building the indexes once the table is full is much faster
+        # than updating them for every row, and the same goes for the
+        # search index the triggers maintain. The change log needs no
+        # entries for the load since a new database has a new epoch.
+        # They are dropped inside the transaction, so a failed load
+        # leaves them in place.
+        deferred = db.execute("SELECT type, name, sql FROM sqlite_master \
+                               WHERE type IN ('index', 'trigger') \
+                               AND tbl_name = 'creature' \
+                               AND sql IS NOT NULL").fetchall()
+        for d in deferred:
+            db.execute('DROP %s %s' % (d['type'].upper(), d['name']))
+
+        # Load the list of creatures from the CSV file.
+        # The user id of '1' is the administrative user.
+        bad_rows = []
+        imported = 0
+        creatures = read_creature_csv(csv_path, set(t[1] for t in types),
+                                      bad_rows)
+        for batch in batched(creatures, batch_size):
+            db.executemany('INSERT INTO creature (name_common, \
+                                                  name_latin,  \
+                                                  type_id,     \
+                                                  photo_url,   \
+                                                  photo_attr,  \
+                                                  wiki_url,    \
+                                                  user_id)     \
+                            VALUES (?,?,?,?,?,?,1)', batch)
+            imported += len(batch)
+
+        for d in deferred:
+            db.execute(d['sql'])
+        db.execute("INSERT INTO creature_fts (creature_fts) \
+                    VALUES ('rebuild')")
+
+        bump_catalogue_version()
+
+        # Manually add the admin user.
+        from wallowawildlife.auth import gplus_digest
+        db.execute(
+            'INSERT INTO user (gplus_id, gplus_digest) VALUES (?, ?)',
+            (generate_password_hash('adminpass'), gplus_digest('adminpass'))
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return imported, bad_rows
+
+
+def init_db(csv_path='db.csv', batch_size=IMPORT_BATCH_SIZE, fast=False):
     """Create the database from the schema
          and populate it with the input CSV
+
+    Everything is loaded in a single transaction. If fast is set,
+    the database is not synced to disk until the load is finished.
+
+    Return the number of creatures imported and a list of the
+    (line number, reason) of each CSV row that was skipped.
     """
     db = get_db()
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf-8'))
 
-    # Manually add list of creature types.
-    types = [('Mammals', 'mammal'),
-             ('Birds', 'bird'),
-             ('Reptiles & Amphibians', 'reptile_amphibian'),
-             ('Trees & Shrubs', 'tree_shrub'),
-             ('Fishes', 'fish'),
-             ('Wildflowers', 'wildflower'),
-             ('Spiders & Insects', 'spider_insect')]
-    for t in types:
-        db.execute(
-            'INSERT INTO creature_type (name, url_text) VALUES (?, ?)',
-            (t[0], t[1]))
+    if fast:
+        synchronous = db.execute('PRAGMA synchronous').fetchone()[0]
+        db.execute('PRAGMA synchronous = OFF')
+    try:
+        imported, bad_rows = load_catalogue(db, csv_path, batch_size)
+    finally:
+        # The connection goes back to the pool afterwards, so it must
+        # sync again even if the load failed.
+        if fast:
+            db.execute('PRAGMA synchronous = %d' % synchronous)
+    invalidate_creature_types()
+
+    return imported, bad_rows
+
+
+def import_creatures(csv_path, batch_size=IMPORT_BATCH_SIZE,
+                     delete_missing=True):
+    """Bring the catalogue in line with a CSV without rebuilding it
+
+    Creatures owned by the admin user are matched to CSV rows by
+    name_latin. Matches that differ are updated, CSV rows with no
+    match are inserted and, if delete_missing is set, admin-owned
+    creatures missing from the CSV are deleted, unless someone has
+    recorded a sighting of them. Creatures added by other users are
+    never touched. All changes are made in a single transaction, and
+    rows that are already up to date are not written.
+
+    Return a dict counting the creatures inserted, updated, deleted
+    and kept for their sightings, and a list of the (line number,
+    reason) of each CSV row that was skipped. If name_latin repeats,
+    the last row wins.
+    """
+    db = get_db()
+    db.execute('CREATE TEMP TABLE incoming (name_common TEXT NOT NULL, \
+                                            name_latin TEXT PRIMARY KEY, \
+                                            type_id TEXT NOT NULL, \
+                                            photo_url TEXT NOT NULL, \
+                                            photo_attr TEXT NOT NULL, \
+                                            wiki_url TEXT NOT NULL)')
+    try:
+        bad_rows = []
+        type_ids = set(t['url_text'] for t in get_creature_types())
+        creatures = read_creature_csv(csv_path, type_ids, bad_rows)
+        for batch in batched(creatures, batch_size):
+            db.executemany('INSERT OR REPLACE INTO incoming \
+                            VALUES (?,?,?,?,?,?)', batch)
+
+        counts = {}
+        counts['updated'] = db.execute(
+            'UPDATE creature SET name_common = i.name_common, \
+                                 type_id = i.type_id, \
+                                 photo_url = i.photo_url, \
+                                 photo_attr = i.photo_attr, \
+                                 wiki_url = i.wiki_url \
+             FROM incoming AS i \
+             WHERE creature.user_id = 1 \
+               AND creature.name_latin = i.name_latin \
+               AND (creature.name_common IS NOT i.name_common \
+                    OR creature.type_id IS NOT i.type_id \
+                    OR creature.photo_url IS NOT i.photo_url \
+                    OR creature.photo_attr IS NOT i.photo_attr \
+                    OR creature.wiki_url IS NOT i.wiki_url)').rowcount
+
+        counts['deleted'] = counts['kept'] = 0
+        if delete_missing:
+            missing = 'user_id = 1 AND NOT EXISTS \
+                       (SELECT 1 FROM incoming \
+                        WHERE incoming.name_latin = creature.name_latin)'
+            seen = 'EXISTS (SELECT 1 FROM sighting \
+                            WHERE sighting.creature_id = creature.id)'
+            counts['kept'] = db.execute(
+                'SELECT COUNT(*) FROM creature WHERE %s AND %s'
+                % (missing, seen)).fetchone()[0]
+            counts['deleted'] = db.execute(
+                'DELETE FROM creature WHERE %s AND NOT %s' % (missing, seen)
+            ).rowcount
+
+        counts['inserted'] = db.execute(
+            'INSERT INTO creature (name_common, name_latin, type_id, \
+                                   photo_url, photo_attr, wiki_url, \
+                                   user_id) \
+             SELECT name_common, name_latin, type_id, \
+                    photo_url, photo_attr, wiki_url, 1 \
+             FROM incoming AS i WHERE NOT EXISTS \
+             (SELECT 1 FROM creature \
+              WHERE user_id = 1 AND name_latin = i.name_latin)').rowcount
+
+        if any(counts.values()):
+            bump_catalogue_version()
         db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.execute('DROP TABLE temp.incoming')
+
+    return counts, bad_rows
 
-    # Load the list of creatures from the CSV file.
-    with open('db.csv', 'r') as f:
-        for line in f:
-            line = line.split(',')
-
-            # Load this into the creature table.
-            # The user id of '1' is the administrative user.
-            db.execute('INSERT INTO creature (name_common, \
-                                              name_latin,  \
-                                              type_id,     \
-                                              photo_url,   \
-                                              photo_attr,  \
-                                              wiki_url,    \
-                                              user_id)     \
-                       VALUES (?,?,?,?,?,?,?)',
-                       (line[0], line[1], line[2],
-                        line[3], line[4], line[5], 1))
-            db.commit()
-
-    # Manually add the admin user.
-    db.execute(
-        'INSERT INTO user (gplus_id) VALUES (?)',
-        (generate_password_hash('adminpass'),)
-    )
-    db.commit()
+
+# Each migration upgrades a database created by an older schema.sql
+# by one step. The position in this list plus one is the user_version
+# the database has once the migration has been applied, and schema.sql
+# sets user_version to the length of this list.
+MIGRATIONS = [
+    # 1: Keyed digest of gplus_id so users can be found with one query.
+    # Existing rows keep a NULL digest until their next login.
+    '''ALTER TABLE user ADD COLUMN gplus_digest TEXT;
+       CREATE UNIQUE INDEX IF NOT EXISTS user_gplus_digest_idx
+           ON user (gplus_digest);''',
+    # 2: Indexes for listing creatures by category and by owner.
+    '''CREATE INDEX IF NOT EXISTS creature_type_id_idx
+           ON creature (type_id);
+       CREATE INDEX IF NOT EXISTS creature_user_id_idx
+           ON creature (user_id);''',
+    # 3: Indexes in list order for keyset pagination. The category
+    # index replaces the plain type_id index from migration 2.
+    '''CREATE INDEX IF NOT EXISTS creature_name_idx
+           ON creature (name_common COLLATE NOCASE, id);
+       CREATE INDEX IF NOT EXISTS creature_type_name_idx
+           ON creature (type_id, name_common COLLATE NOCASE, id);
+       DROP INDEX IF EXISTS creature_type_id_idx;''',
+    # 4: Version counter for the creature catalogue.
+    '''CREATE TABLE IF NOT EXISTS catalogue (
+           id INTEGER PRIMARY KEY CHECK (id = 1),
+           epoch TEXT NOT NULL,
+           version INTEGER NOT NULL
+       );
+       INSERT OR IGNORE INTO catalogue (id, epoch, version)
+           VALUES (1, lower(hex(randomblob(8))), 1);''',
+    # 5: Index on the natural key used by 'flask import'.
+    '''CREATE INDEX IF NOT EXISTS creature_name_latin_idx
+           ON creature (name_latin);''',
+    # 6: Full-text search over creature names.
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS creature_fts USING fts5(
+           name_common, name_latin,
+           content='creature', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+       );
+       CREATE TRIGGER IF NOT EXISTS creature_fts_insert
+       AFTER INSERT ON creature BEGIN
+           INSERT INTO creature_fts (rowid, name_common, name_latin)
+           VALUES (new.id, new.name_common, new.name_latin);
+       END;
+       CREATE TRIGGER IF NOT EXISTS creature_fts_delete
+       AFTER DELETE ON creature BEGIN
+           INSERT INTO creature_fts (creature_fts, rowid,
+                                     name_common, name_latin)
+           VALUES ('delete', old.id, old.name_common, old.name_latin);
+       END;
+       CREATE TRIGGER IF NOT EXISTS creature_fts_update
+       AFTER UPDATE OF name_common, name_latin ON creature BEGIN
+           INSERT INTO creature_fts (creature_fts, rowid,
+                                     name_common, name_latin)
+           VALUES ('delete', old.id, old.name_common, old.name_latin);
+           INSERT INTO creature_fts (rowid, name_common, name_latin)
+           VALUES (new.id, new.name_common, new.name_latin);
+       END;
+       INSERT INTO creature_fts (creature_fts) VALUES ('rebuild');''',
+    # 7: The catalogue version at which each creature last changed, so
+    # offline bundles can carry only what changed. Changes made before
+    # this were not recorded, so the epoch is renewed and devices fetch
+    # a full bundle next time.
+    '''CREATE TABLE IF NOT EXISTS creature_change (
+           creature_id INTEGER PRIMARY KEY,
+           version INTEGER NOT NULL,
+           deleted INTEGER NOT NULL
+       );
+       CREATE INDEX IF NOT EXISTS creature_change_version_idx
+           ON creature_change (version);
+       CREATE TRIGGER IF NOT EXISTS creature_change_insert
+       AFTER INSERT ON creature BEGIN
+           INSERT INTO creature_change (creature_id, version, deleted)
+           VALUES (new.id, (SELECT version FROM catalogue), 0)
+           ON CONFLICT (creature_id) DO UPDATE
+           SET version = excluded.version, deleted = 0;
+       END;
+       CREATE TRIGGER IF NOT EXISTS creature_change_update
+       AFTER UPDATE ON creature BEGIN
+           INSERT INTO creature_change (creature_id, version, deleted)
+           VALUES (new.id, (SELECT version FROM catalogue), 0)
+           ON CONFLICT (creature_id) DO UPDATE
+           SET version = excluded.version, deleted = 0;
+       END;
+       CREATE TRIGGER IF NOT EXISTS creature_change_delete
+       AFTER DELETE ON creature BEGIN
+           INSERT INTO creature_change (creature_id, version, deleted)
+           VALUES (old.id, (SELECT version FROM catalogue), 1)
+           ON CONFLICT (creature_id) DO UPDATE
+           SET version = excluded.version, deleted = 1;
+       END;
+       UPDATE catalogue SET epoch = lower(hex(randomblob(8)));''',
+    # 8: Creatures users have seen, removed along with the creature.
+    '''CREATE TABLE IF NOT EXISTS sighting (
+           id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER NOT NULL,
+           creature_id INTEGER NOT NULL,
+           seen_at TIMESTAMP NOT NULL,
+           count INTEGER NOT NULL DEFAULT 1,
+           notes TEXT NOT NULL DEFAULT '',
+           FOREIGN KEY (user_id) REFERENCES user (id),
+           FOREIGN KEY (creature_id) REFERENCES creature (id)
+       );
+       CREATE INDEX IF NOT EXISTS sighting_user_seen_idx
+           ON sighting (user_id, seen_at);
+       CREATE INDEX IF NOT EXISTS sighting_creature_id_idx
+           ON sighting (creature_id);
+       CREATE TRIGGER IF NOT EXISTS sighting_creature_delete
+       AFTER DELETE ON creature BEGIN
+           DELETE FROM sighting WHERE creature_id = old.id;
+       END;''',
+    # 9: Summaries of the sightings kept up to date by triggers, filled
+    # in from the sightings already recorded.
+    '''CREATE TABLE IF NOT EXISTS seen_creature (
+           user_id INTEGER NOT NULL,
+           creature_id INTEGER NOT NULL,
+           type_id TEXT NOT NULL,
+           sightings INTEGER NOT NULL,
+           PRIMARY KEY (user_id, creature_id)
+       ) WITHOUT ROWID;
+       CREATE INDEX IF NOT EXISTS seen_creature_creature_id_idx
+           ON seen_creature (creature_id);
+       CREATE TABLE IF NOT EXISTS checklist_progress (
+           user_id INTEGER NOT NULL,
+           type_id TEXT NOT NULL,
+           seen INTEGER NOT NULL,
+           PRIMARY KEY (user_id, type_id)
+       ) WITHOUT ROWID;
+       CREATE TABLE IF NOT EXISTS checklist_version (
+           user_id INTEGER PRIMARY KEY,
+           version INTEGER NOT NULL
+       );
+       CREATE TABLE IF NOT EXISTS creature_day (
+           creature_id INTEGER NOT NULL,
+           day TEXT NOT NULL,
+           sightings INTEGER NOT NULL,
+           individuals INTEGER NOT NULL,
+           PRIMARY KEY (day, creature_id)
+       ) WITHOUT ROWID;
+       CREATE TRIGGER IF NOT EXISTS sighting_summary_insert
+       AFTER INSERT ON sighting BEGIN
+           INSERT INTO seen_creature (user_id, creature_id, type_id,
+                                      sightings)
+           SELECT new.user_id, id, type_id, 1 FROM creature
+           WHERE id = new.creature_id
+           ON CONFLICT (user_id, creature_id) DO UPDATE
+           SET sightings = sightings + 1;
+           INSERT INTO checklist_progress (user_id, type_id, seen)
+           SELECT user_id, type_id, 1 FROM seen_creature
+           WHERE user_id = new.user_id AND creature_id = new.creature_id
+           AND sightings = 1
+           ON CONFLICT (user_id, type_id) DO UPDATE SET seen = seen + 1;
+           INSERT INTO creature_day (creature_id, day, sightings,
+                                     individuals)
+           VALUES (new.creature_id, date(new.seen_at), 1, new.count)
+           ON CONFLICT (day, creature_id) DO UPDATE
+           SET sightings = sightings + 1,
+               individuals = individuals + excluded.individuals;
+           INSERT INTO checklist_version (user_id, version)
+           VALUES (new.user_id, 1)
+           ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+       END;
+       CREATE TRIGGER IF NOT EXISTS sighting_summary_delete
+       AFTER DELETE ON sighting BEGIN
+           UPDATE checklist_progress SET seen = seen - 1
+           WHERE (user_id, type_id) = (
+               SELECT user_id, type_id FROM seen_creature
+               WHERE user_id = old.user_id
+               AND creature_id = old.creature_id AND sightings = 1);
+           DELETE FROM checklist_progress
+           WHERE user_id = old.user_id AND seen = 0;
+           DELETE FROM seen_creature
+           WHERE user_id = old.user_id AND creature_id = old.creature_id
+           AND sightings = 1;
+           UPDATE seen_creature SET sightings = sightings - 1
+           WHERE user_id = old.user_id AND creature_id = old.creature_id;
+           UPDATE creature_day
+           SET sightings = sightings - 1,
+               individuals = individuals - old.count
+           WHERE creature_id = old.creature_id
+           AND day = date(old.seen_at);
+           DELETE FROM creature_day
+           WHERE creature_id = old.creature_id
+           AND day = date(old.seen_at) AND sightings = 0;
+           UPDATE checklist_version SET version = version + 1
+           WHERE user_id = old.user_id;
+       END;
+       CREATE TRIGGER IF NOT EXISTS seen_creature_retype
+       AFTER UPDATE OF type_id ON creature
+       WHEN new.type_id IS NOT old.type_id BEGIN
+           UPDATE checklist_progress SET seen = seen - 1
+           WHERE type_id = old.type_id AND user_id IN (
+               SELECT user_id FROM seen_creature
+               WHERE creature_id = old.id);
+           DELETE FROM checklist_progress
+           WHERE type_id = old.type_id AND seen = 0;
+           INSERT INTO checklist_progress (user_id, type_id, seen)
+           SELECT user_id, new.type_id, 1 FROM seen_creature
+           WHERE creature_id = new.id
+           ON CONFLICT (user_id, type_id) DO UPDATE SET seen = seen + 1;
+           UPDATE seen_creature SET type_id = new.type_id
+           WHERE creature_id = new.id;
+       END;
+       DELETE FROM seen_creature;
+       INSERT INTO seen_creature (user_id, creature_id, type_id, sightings)
+       SELECT sighting.user_id, sighting.creature_id, creature.type_id,
+              COUNT(*)
+       FROM sighting JOIN creature ON creature.id = sighting.creature_id
+       GROUP BY sighting.user_id, sighting.creature_id;
+       DELETE FROM checklist_progress;
+       INSERT INTO checklist_progress (user_id, type_id, seen)
+       SELECT user_id, type_id, COUNT(*) FROM seen_creature
+       GROUP BY user_id, type_id;
+       DELETE FROM creature_day;
+       INSERT INTO creature_day (creature_id, day, sightings, individuals)
+       SELECT creature_id, date(seen_at), COUNT(*), SUM(count)
+       FROM sighting GROUP BY creature_id, date(seen_at);''',
+    # 10: Positions of sightings, indexed for area queries and counted
+    # in map tiles.
+    '''CREATE TABLE IF NOT EXISTS sighting_location (
+           sighting_id INTEGER PRIMARY KEY,
+           latitude REAL NOT NULL,
+           longitude REAL NOT NULL,
+           tile_x INTEGER NOT NULL,
+           tile_y INTEGER NOT NULL
+       );
+       CREATE VIRTUAL TABLE IF NOT EXISTS sighting_rtree USING rtree(
+           id, min_lat, max_lat, min_lon, max_lon,
+           +latitude, +longitude, +creature_id, +count
+       );
+       CREATE TABLE IF NOT EXISTS tile_zoom (zoom INTEGER PRIMARY KEY);
+       INSERT OR IGNORE INTO tile_zoom (zoom)
+       VALUES (0), (1), (2), (3), (4), (5), (6), (7), (8),
+              (9), (10), (11), (12), (13), (14), (15), (16);
+       CREATE TABLE IF NOT EXISTS sighting_tile (
+           zoom INTEGER NOT NULL,
+           x INTEGER NOT NULL,
+           y INTEGER NOT NULL,
+           creature_id INTEGER NOT NULL,
+           sightings INTEGER NOT NULL,
+           individuals INTEGER NOT NULL,
+           PRIMARY KEY (zoom, x, y, creature_id)
+       ) WITHOUT ROWID;
+       CREATE TRIGGER IF NOT EXISTS sighting_location_insert
+       AFTER INSERT ON sighting_location BEGIN
+           INSERT INTO sighting_rtree (id, min_lat, max_lat,
+                                       min_lon, max_lon, latitude,
+                                       longitude, creature_id, count)
+           SELECT id, new.latitude, new.latitude,
+                  new.longitude, new.longitude, new.latitude,
+                  new.longitude, creature_id, count
+           FROM sighting WHERE id = new.sighting_id;
+           INSERT INTO sighting_tile (zoom, x, y, creature_id,
+                                      sightings, individuals)
+           SELECT zoom, new.tile_x >> (16 - zoom),
+                  new.tile_y >> (16 - zoom), creature_id, 1, count
+           FROM sighting, tile_zoom WHERE sighting.id = new.sighting_id
+           ON CONFLICT (zoom, x, y, creature_id) DO UPDATE
+           SET sightings = sightings + 1,
+               individuals = individuals + excluded.individuals;
+       END;
+       CREATE TRIGGER IF NOT EXISTS sighting_location_delete
+       AFTER DELETE ON sighting BEGIN
+           UPDATE sighting_tile
+           SET sightings = sightings - 1,
+               individuals = individuals - old.count
+           WHERE (zoom, x, y, creature_id) IN (
+               SELECT zoom, tile_x >> (16 - zoom), tile_y >> (16 - zoom),
+                      old.creature_id
+               FROM sighting_location, tile_zoom
+               WHERE sighting_id = old.id);
+           DELETE FROM sighting_tile
+           WHERE (zoom, x, y, creature_id) IN (
+               SELECT zoom, tile_x >> (16 - zoom), tile_y >> (16 - zoom),
+                      old.creature_id
+               FROM sighting_location, tile_zoom
+               WHERE sighting_id = old.id)
+           AND sightings = 0;
+           DELETE FROM sighting_rtree WHERE id = old.id;
+           DELETE FROM sighting_location WHERE sighting_id = old.id;
+       END;''',
+    # 11: Creatures with sightings can no longer be deleted, rather
+    # than taking everyone's sightings of them along.
+    '''DROP TRIGGER IF EXISTS sighting_creature_delete;
+       CREATE TRIGGER IF NOT EXISTS sighting_creature_keep
+       BEFORE DELETE ON creature
+       WHEN EXISTS (SELECT 1 FROM sighting WHERE creature_id = old.id)
+       BEGIN
+           SELECT RAISE(ABORT, 'Creature has sightings.');
+       END;''',
+]
+
+
+def migrate_db():
+    """Apply any migrations the database has not seen yet
+
+    Return the number of migrations applied.
+    """
+    db = get_db()
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+
+    for i, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        db.executescript('BEGIN;' + script
+                         + 'PRAGMA user_version = %d; COMMIT;' % i)
+
+    return max(len(MIGRATIONS) - version, 0)
 
 
 @click.command('initdb')
+@click.option('--csv', 'csv_path', default='db.csv', show_default=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='CSV file of creatures to load.')
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+              type=click.IntRange(min=1),
+              help='Creatures inserted per statement batch.')
+@click.option('--fast', is_flag=True,
+              help="Don't sync to disk until the load has finished.")
 @with_appcontext
-def init_db_command():
+def init_db_command(csv_path, batch_size, fast):
     """Clear the existing data and create new tables"""
-    init_db()
-    click.echo('Database initialized.')
+    imported, bad_rows = init_db(csv_path=csv_path, batch_size=batch_size,
+                                 fast=fast)
+    for line, reason in bad_rows:
+        click.echo('Skipped line %d: %s' % (line, reason), err=True)
+    click.echo('Database initialized with %d creatures.' % imported)
+
+
+@click.command('migratedb')
+@with_appcontext
+def migrate_db_command():
+    """Upgrade an existing database to the current schema"""
+    applied = migrate_db()
+    click.echo('Applied %d migration(s).' % applied)
+    waiting = get_db().execute('SELECT COUNT(*) FROM user \
+                                WHERE gplus_digest IS NULL').fetchone()[0]
+    if waiting:
+        click.echo('%d user(s) have no gplus_digest yet; it is filled in '
+                   'when they next log in.' % waiting)
+
+
+@click.command('import')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=IMPORT_BATCH_SIZE, show_default=True,
+              type=click.IntRange(min=1),
+              help='Creatures staged per statement batch.')
+@click.option('--keep-missing', is_flag=True,
+              help="Don't delete creatures that are missing from the CSV.")
+@with_appcontext
+def import_creatures_command(csv_path, batch_size, keep_missing):
+    """Apply only the changes in a creature CSV to the catalogue"""
+    start = time.perf_counter()
+    counts, bad_rows = import_creatures(csv_path, batch_size=batch_size,
+                                        delete_missing=not keep_missing)
+    elapsed = time.perf_counter() - start
+
+    for line, reason in bad_rows:
+        click.echo('Skipped line %d: %s' % (line, reason), err=True)
+    click.echo('Inserted %(inserted)d, updated %(updated)d and deleted '
+               '%(deleted)d creatures' % counts
+               + ' in %.2f seconds.' % elapsed)
+    if counts['kept']:
+        click.echo('Kept %d creatures missing from the CSV that have '
+                   'sightings.' % counts['kept'])
 
 
 def init_app(app):
     """Take the application and register the function"""
+    if app.config['DB_POOL']:
+        app.extensions['db_pool'] = ConnectionPool(app.config,
+                                                   app.config['DB_POOL_SIZE'])
+    if app.config['CATALOGUE_SNAPSHOT']:
+        app.extensions['catalogue_snapshot'] = SnapshotHolder()
     app.teardown_appcontext(close_db)
+    app.after_request(add_query_count_header)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(import_creatures_command)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Streaming Export
+
+This module describes generators that serialize creatures straight
+from a database cursor, a batch of rows at a time, so that full
+exports never hold the whole table in memory.
+"""
+
+import json
+
+# Rows fetched from the cursor and written out per chunk.
+BATCH_SIZE = 500
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def dumps(obj):
+    """Serialize obj as compact JSON, as jsonify does"""
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def iter_rows(cursor, batch_size=BATCH_SIZE):
+    """Yield lists of rows from cursor until it is exhausted"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+def json_array_chunks(cursor, to_json):
+    """Yield a JSON array of to_json(row) for every row in cursor"""
+    yield '['
+    separator = ''
+    for rows in iter_rows(cursor):
+        yield separator + ','.join(dumps(to_json(r)) for r in rows)
+        separator = ','
+    yield ']\n'
+
+
+def ndjson_chunks(cursor, to_json):
+    """Yield to_json(row) for every row in cursor, one per line"""
+    for rows in iter_rows(cursor):
+        yield ''.join(dumps(to_json(r)) + '\n' for r in rows)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""Geo Blueprint
+
+This module describes the blueprint for finding out what has been
+seen where. Sightings recorded with a latitude and longitude are
+indexed in an R*Tree, sighting_rtree, which answers bounding box and
+radius queries without scanning the other sightings.
+
+For maps, sightings are also counted per creature in grid cells at
+every zoom level in tile_zoom. The cells are Web Mercator map tiles,
+so the cells of a tile at any zoom are read from sighting_tile
+rather than counted from the sightings. Large areas are counted from
+there too. The triggers that keep both up to date are in schema.sql.
+"""
+
+import math
+
+from flask import Blueprint, jsonify, request
+
+from wallowawildlife.db import get_creature_type, get_db
+from wallowawildlife.pagination import page_size
+
+bp = Blueprint('geo', __name__)
+
+# The zoom at which tile_x and tile_y of sighting_location are stored,
+# and the most detailed level in tile_zoom. The triggers in schema.sql
+# shift by this.
+MAX_TILE_ZOOM = 16
+
+# Cells of a tile are this many zoom levels more detailed, so a tile
+# has up to 8 by 8 of them.
+TILE_DETAIL = 3
+
+# Web Mercator stops short of the poles.
+MAX_LATITUDE = 85.0511287798
+
+# Largest radius in metres. Distances are measured on a plane tangent
+# at the centre, which is within half a percent at this distance.
+MAX_RADIUS = 100000
+
+# Metres per degree of latitude, and of longitude at the equator.
+METRES_PER_DEGREE = 111195.0
+
+# Area queries with more sightings than this around them are counted
+# from the sighting_tile cells of at most MAX_AREA_TILES tiles
+# covering the area, rather than one sighting at a time.
+MAX_AREA_SCAN = 50000
+MAX_AREA_TILES = 16
+
+
+def tile_of(latitude, longitude, zoom):
+    """Return the x and y of the map tile containing a point"""
+    n = 1 << zoom
+    latitude = max(-MAX_LATITUDE, min(latitude, MAX_LATITUDE))
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi)
+            / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(zoom, x, y):
+    """Return the west, south, east and north edges of a map tile"""
+    n = 1 << zoom
+
+    def latitude(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2.0 * y / n))))
+
+    return [x * 360.0 / n - 180.0, latitude(y + 1),
+            (x + 1) * 360.0 / n - 180.0, latitude(y)]
+
+
+def covering_tiles(west, south, east, north):
+    """Return the zoom and x and y ranges of the tiles covering a box
+
+    The zoom is the most detailed at which there are no more than
+    MAX_AREA_TILES of them.
+    """
+    for zoom in range(MAX_TILE_ZOOM, -1, -1):
+        x0, y0 = tile_of(north, west, zoom)
+        x1, y1 = tile_of(south, east, zoom)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= MAX_AREA_TILES:
+            return zoom, (x0, x1), (y0, y1)
+
+
+def read_area():
+    """Read the area of a query from ?bbox= or ?lat=, ?lon= and ?radius=
+
+    Return the west, south, east and north edges to search, the
+    centre and radius if one was given, or an error message.
+    """
+    if 'bbox' in request.args:
+        try:
+            west, south, east, north = [
+                float(v) for v in request.args['bbox'].split(',')]
+        except ValueError:
+            return 'bbox must be west,south,east,north.'
+        if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+            return 'bbox must be west,south,east,north.'
+
+        return (west, south, east, north), None
+
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius = request.args.get('radius', type=float)
+    if lat is None or lon is None or radius is None:
+        return 'Give a bbox, or a lat, lon and radius.'
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return 'lat and lon must be a position in degrees.'
+    if not 0 < radius <= MAX_RADIUS:
+        return 'radius must be up to %d metres.' % MAX_RADIUS
+
+    dlat = radius / METRES_PER_DEGREE
+    dlon = dlat / max(math.cos(math.radians(lat)), 0.01)
+    return ((max(lon - dlon, -180), max(lat - dlat, -90),
+             min(lon + dlon, 180), min(lat + dlat, 90)),
+            (lat, lon, radius))
+
+
+def read_type():
+    """Return the url_text of ?type=, None if absent, or False if unknown"""
+    url_text = request.args.get('type') or None
+    if url_text is not None and get_creature_type(url_text) is None:
+        return False
+
+    return url_text
+
+
+@bp.route('/sightings/area/JSON')
+def areaSightingsJSON():
+    """Create JSON endpoint
+
+    Return the creatures seen within ?bbox=west,south,east,north, or
+    within ?radius= metres of ?lat= and ?lon=, with how often and how
+    many were seen, most seen first. ?type= limits them to one
+    category.
+
+    Where more than MAX_AREA_SCAN sightings are around the area, they
+    are counted from the map tiles covering it instead, which may take
+    in sightings just outside it, and the X-Sightings-Approximate
+    header says so.
+    """
+    area = read_area()
+    type_id = read_type()
+    if isinstance(area, str):
+        return jsonify(error=area), 400
+    if type_id is False:
+        return jsonify(error='This category does not exist.'), 400
+
+    (west, south, east, north), circle = area
+    db = get_db()
+    zoom, (x0, x1), (y0, y1) = covering_tiles(west, south, east, north)
+    params = {'west': west, 'south': south, 'east': east, 'north': north,
+              'zoom': zoom, 'x0': x0, 'x1': x1, 'y0': y0, 'y1': y1,
+              'type_id': type_id, 'limit': page_size()}
+    tiles = 't.zoom = :zoom AND t.x BETWEEN :x0 AND :x1 \
+             AND t.y BETWEEN :y0 AND :y1'
+    nearby = db.execute('SELECT SUM(t.sightings) FROM sighting_tile AS t \
+                         WHERE ' + tiles, params).fetchone()[0] or 0
+
+    approximate = nearby > MAX_AREA_SCAN
+    if approximate:
+        sql = 'SELECT creature.id, creature.name_common, creature.type_id, \
+                      SUM(t.sightings) AS sightings, \
+                      SUM(t.individuals) AS individuals \
+               FROM sighting_tile AS t \
+               JOIN creature ON creature.id = t.creature_id \
+               WHERE ' + tiles
+    else:
+        # The R*Tree rounds its boxes outwards, so the exact position
+        # in the auxiliary columns decides.
+        sql = 'SELECT creature.id, creature.name_common, creature.type_id, \
+                      COUNT(*) AS sightings, SUM(r.count) AS individuals \
+               FROM sighting_rtree AS r \
+               JOIN creature ON creature.id = r.creature_id \
+               WHERE r.min_lat <= :north AND r.max_lat >= :south \
+               AND r.min_lon <= :east AND r.max_lon >= :west \
+               AND r.latitude BETWEEN :south AND :north \
+               AND r.longitude BETWEEN :west AND :east'
+        if circle is not None:
+            lat, lon, radius = circle
+            sql += ' AND ((r.latitude - :lat) * (r.latitude - :lat) \
+                          + (r.longitude - :lon) * (r.longitude - :lon) \
+                            * :scale) * :metres <= :radius_squared'
+            params.update(lat=lat, lon=lon, radius_squared=radius * radius,
+                          scale=math.cos(math.radians(lat)) ** 2,
+                          metres=METRES_PER_DEGREE ** 2)
+    if type_id is not None:
+        sql += ' AND creature.type_id = :type_id'
+    sql += ' GROUP BY creature.id \
+             ORDER BY sightings DESC, creature.name_common LIMIT :limit'
+
+    response = jsonify([{'id': c['id'],
+                         'name_common': c['name_common'],
+                         'type': c['type_id'],
+                         'sightings': c['sightings'],
+                         'individuals': c['individuals']}
+                        for c in db.execute(sql, params)])
+    if approximate:
+        response.headers['X-Sightings-Approximate'] = 'zoom %d tiles' % zoom
+    return response
+
+
+@bp.route('/sightings/tiles/<int:zoom>/<int:x>/<int:y>/JSON')
+def tileSightingsJSON(zoom, x, y):
+    """Create JSON endpoint
+
+    Return the sightings in the cells of map tile zoom/x/y, each
+    TILE_DETAIL levels more detailed, up to MAX_TILE_ZOOM, with its
+    bounds and the number of sightings, individuals and creatures.
+    Cells with no sightings are left out. ?type= limits them to one
+    category.
+    """
+    if zoom > MAX_TILE_ZOOM or x >= 1 << zoom or y >= 1 << zoom:
+        return jsonify(error='Not found.'), 404
+    type_id = read_type()
+    if type_id is False:
+        return jsonify(error='This category does not exist.'), 400
+
+    cell_zoom = min(zoom + TILE_DETAIL, MAX_TILE_ZOOM)
+    shift = cell_zoom - zoom
+    sql = 'SELECT t.x, t.y, SUM(t.sightings) AS sightings, \
+                  SUM(t.individuals) AS individuals, \
+                  COUNT(*) AS creatures \
+           FROM sighting_tile AS t \
+           JOIN creature ON creature.id = t.creature_id \
+           WHERE t.zoom = ? AND t.x BETWEEN ? AND ? AND t.y BETWEEN ? AND ?'
+    params = [cell_zoom, x << shift, ((x + 1) << shift) - 1,
+              y << shift, ((y + 1) << shift) - 1]
+    if type_id is not None:
+        sql += ' AND creature.type_id = ?'
+        params.append(type_id)
+    sql += ' GROUP BY t.x, t.y'
+
+    return jsonify(zoom=zoom, x=x, y=y,
+                   cells=[{'zoom': cell_zoom, 'x': c['x'], 'y': c['y'],
+                           'bbox': tile_bounds(cell_zoom, c['x'], c['y']),
+                           'sightings': c['sightings'],
+                           'individuals': c['individuals'],
+                           'creatures': c['creatures']}
+                          for c in get_db().execute(sql, params)])
+
+
+def init_app(app):
+    """Take the application and register the blueprint"""
+    app.register_blueprint(bp)
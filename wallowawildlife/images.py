@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Image Variants
+
+This module describes the 'flask images' command, which makes
+resized and recompressed copies of the creature photos in
+static/img, and the helpers that let templates serve them.
+
+Variants are written to a store in the instance folder under the
+hash of their source, so they can be cached by browsers forever, and
+a manifest maps each source photo to its variants. Sources that have
+not changed since the last run are skipped.
+"""
+
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+import click
+from flask import Blueprint, current_app, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+bp = Blueprint('images', __name__)
+
+# Each variant's name, maximum width in pixels, and JPEG and WebP
+# quality.
+VARIANTS = [('thumb', 160, 75, 70),
+            ('medium', 640, 80, 75)]
+
+SOURCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+MANIFEST = 'manifest.json'
+
+# Photos under this path are ones we have variants for, whether they
+# are linked from this site or from the repository on GitHub.
+STATIC_IMG = '/static/img/'
+
+
+def get_store():
+    """Return the directory the variants are written to"""
+    return current_app.config['IMAGE_STORE']
+
+
+def make_variants(source, store):
+    """Write every variant of the image at source into store
+
+    Return the manifest entry describing them. This runs in a worker
+    process, so it only depends on its arguments.
+    """
+    from PIL import Image, ImageOps
+
+    with open(source, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    os.makedirs(os.path.join(store, digest), exist_ok=True)
+
+    original = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    original = original.convert('RGB')
+
+    variants = {}
+    for name, width, jpeg_quality, webp_quality in VARIANTS:
+        image = original.copy()
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+
+        jpeg = '%s/%s.jpg' % (digest, name)
+        image.save(os.path.join(store, jpeg), 'JPEG', quality=jpeg_quality,
+                   optimize=True, progressive=True)
+        webp = '%s/%s.webp' % (digest, name)
+        image.save(os.path.join(store, webp), 'WEBP', quality=webp_quality,
+                   method=4)
+
+        variants[name] = {'jpeg': jpeg, 'webp': webp, 'width': image.width}
+
+    stat = os.stat(source)
+    return {'hash': digest, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'variants': variants}
+
+
+def is_current(entry, source, store):
+    """Check whether a manifest entry is up to date with its source"""
+    stat = os.stat(source)
+    if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+        return False
+
+    files = [v[fmt] for v in entry['variants'].values()
+             for fmt in ('jpeg', 'webp')]
+    return all(os.path.exists(os.path.join(store, f)) for f in files)
+
+
+def read_manifest(store):
+    """Return the manifest in store, or an empty one"""
+    try:
+        with open(os.path.join(store, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def build_images(source_dir, store, workers=None, force=False):
+    """Make variants of every photo in source_dir that needs them
+
+    Return the number of photos processed and skipped.
+    """
+    os.makedirs(store, exist_ok=True)
+    manifest = read_manifest(store)
+
+    sources = {}
+    for name in sorted(os.listdir(source_dir)):
+        if name.lower().endswith(SOURCE_EXTENSIONS):
+            path = os.path.join(source_dir, name)
+            if force or name not in manifest \
+                    or not is_current(manifest[name], path, store):
+                sources[name] = path
+
+    with ProcessPoolExecutor(workers) as pool:
+        entries = pool.map(make_variants, sources.values(),
+                           [store] * len(sources))
+        manifest.update(zip(sources, entries))
+
+    # Replace the manifest in one step so the app never reads half.
+    tmp_path = os.path.join(store, MANIFEST + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(store, MANIFEST))
+
+    return len(sources), len(manifest) - len(sources)
+
+
+def manifest_version():
+    """Return a string that changes whenever the manifest is rewritten
+
+    Pages show the variants listed in the manifest, so this is part of
+    their cache keys and ETags.
+    """
+    try:
+        return repr(os.stat(os.path.join(get_store(), MANIFEST)).st_mtime)
+    except FileNotFoundError:
+        return ''
+
+
+def get_manifest():
+    """Return the manifest, rereading it if 'flask images' has rewritten it"""
+    path = os.path.join(get_store(), MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return {}
+
+    cached = current_app.extensions.get('image_manifest')
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = (mtime, json.load(f))
+        current_app.extensions['image_manifest'] = cached
+
+    return cached[1]
+
+
+def photo_entry(photo_url):
+    """Return the manifest entry for a creature photo, or None"""
+    path = urlparse(photo_url or '').path
+    if STATIC_IMG not in path:
+        return None
+
+    return get_manifest().get(path.split(STATIC_IMG, 1)[1])
+
+
+def photo_variants(photo_url):
+    """Return URLs for the variants of a creature photo
+
+    The result has the URLs of the JPEG and WebP thumbnails and of the
+    medium JPEG, and srcset strings listing every JPEG and every WebP
+    variant. Return None if there are no variants of the photo, in
+    which case photo_url should be used as it is.
+    """
+    entry = photo_entry(photo_url)
+    if entry is None:
+        return None
+
+    def variant_url(name, fmt):
+        """Return the URL of one variant"""
+        return url_for('images.variant',
+                       filename=entry['variants'][name][fmt])
+
+    def srcset(fmt):
+        """Return every variant in one format as a srcset"""
+        return ', '.join('%s %dw' % (variant_url(name, fmt),
+                                     entry['variants'][name]['width'])
+                         for name, _, _, _ in VARIANTS)
+
+    return {'src': variant_url('medium', 'jpeg'),
+            'thumb': variant_url('thumb', 'jpeg'),
+            'thumb_webp': variant_url('thumb', 'webp'),
+            'jpeg': srcset('jpeg'),
+            'webp': srcset('webp')}
+
+
+@bp.route('/images/<path:filename>')
+def variant(filename):
+    """Serve an image variant
+
+    The file names contain the hash of their source, so they never
+    change and may be cached for a year.
+    """
+    response = send_from_directory(get_store(), filename, max_age=31536000)
+    response.cache_control.immutable = True
+    return response
+
+
+@click.command('images')
+@click.option('--source', 'source_dir', type=click.Path(file_okay=False),
+              help='Directory of photos. Defaults to static/img.')
+@click.option('--workers', type=click.IntRange(min=1),
+              help='Worker processes. Defaults to one per CPU.')
+@click.option('--force', is_flag=True,
+              help='Remake variants of photos that have not changed.')
+@with_appcontext
+def build_images_command(source_dir, workers, force):
+    """Make resized copies of the creature photos"""
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise click.ClickException(
+            'Pillow is needed to make images: pip install -e .[images]')
+
+    if source_dir is None:
+        source_dir = os.path.join(current_app.static_folder, 'img')
+    processed, skipped = build_images(source_dir, get_store(), workers, force)
+    click.echo('Made variants of %d photos, %d unchanged.'
+               % (processed, skipped))
+
+
+def init_app(app):
+    """Register the image route, command and template helper"""
+    app.register_blueprint(bp)
+    app.cli.add_command(build_images_command)
+    app.jinja_env.globals['photo_variants'] = photo_variants
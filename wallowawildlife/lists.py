@@ -9,50 +9,76 @@ before being modified for this application.
 """
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, current_app, flash, g, jsonify, redirect, render_template,
+    request, url_for
 )
 
 from wallowawildlife.auth import login_required
-from wallowawildlife.db import get_db
+from wallowawildlife.caching import conditional
+from wallowawildlife.db import (
+    CSV_FIELDS, bump_catalogue_version, get_creature, get_creature_type,
+    get_creature_types, get_creatures, get_db
+)
+from wallowawildlife.pagecache import cached_page, invalidate_pages
+from wallowawildlife.pagination import page_size, paginate_creatures
+from wallowawildlife.search import search_creatures
+from wallowawildlife.summaries import get_progress, get_type_totals
 
 bp = Blueprint('lists', __name__)
 
+# Fields a new creature can't do without.
+REQUIRED_FIELDS = ('name_common', 'name_latin', 'type_id')
+
+
+def owns(creature):
+    """Check whether the logged-in user owns a creature"""
+    return creature['user_id'] == g.user_id
+
 
 @bp.route('/wildlife')
+@conditional
+@cached_page
 def listAll():
-    """List all creatures in all categories"""
-    db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
-    creatures = db.execute('SELECT * FROM creature').fetchall()
-    return render_template('lists/list.html', types=types,
-                           creatures=creatures, page_title='All')
+    """List all creatures in all categories, one page at a time"""
+    page = paginate_creatures()
+    return render_template('lists/list.html', creatures=page.items,
+                           page=page, page_title='All')
+
+
+@bp.route('/wildlife/search')
+@conditional
+def searchCreatures():
+    """List the creatures whose names match the search in ?q="""
+    q = request.args.get('q', '')
+    creatures = search_creatures(q, page_size(),
+                                 request.args.get('type') or None)
+    return render_template('lists/list.html', creatures=creatures,
+                           page_title='Search', q=q)
 
 
 @bp.route('/wildlife/<url_text>')
+@conditional
+@cached_page
 def listByType(url_text):
-    """List only the creatures of the requested category"""
-    db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
-    creatures = db.execute('SELECT * FROM creature').fetchall()
-    creaturesDisplayable = []
-
-    title = ''
-    # Check to see if URL is looking for a valid creature type.
-    for t in types:
-        if url_text == t['url_text']:
-            title = t['name']
-
-    # If there's no title, the URL doesn't match possible creature types.
-    if title == '':
+    """List only the creatures of the requested category
+
+    The creatures are listed one page at a time, under how many of
+    them the logged-in user has seen.
+    """
+    # If the URL doesn't match a creature type, go back to the index.
+    creature_type = get_creature_type(url_text)
+    if creature_type is None:
         return redirect(url_for('index'))
 
     # Otherwise, only show the creatures of the desired type.
-    for c in creatures:
-        if c['type_id'] == url_text:
-            creaturesDisplayable.append(c)
-
-    return render_template('lists/list.html', types=types,
-                           creatures=creaturesDisplayable, page_title=title)
+    page = paginate_creatures(url_text)
+    progress = None
+    if g.user_id is not None:
+        progress = (get_progress().get(url_text, 0),
+                    get_type_totals().get(url_text, 0))
+    return render_template('lists/list.html', creatures=page.items,
+                           page=page, page_title=creature_type['name'],
+                           progress=progress)
 
 
 @bp.route('/wildlife/add', methods=['GET', 'POST'])
@@ -60,7 +86,6 @@ def listByType(url_text):
 def addCreature():
     """Render and handle the form to add an creature"""
     db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
 
     # If the form has been submitted, add the item to the table.
     if request.method == 'POST':
@@ -79,24 +104,25 @@ def addCreature():
                     request.form['wiki_url'],
                     g.user_id,
                     request.form['type_id']))
+        bump_catalogue_version()
         db.commit()
+        invalidate_pages()
         flash("Successfully added " + request.form['name_common'])
         return redirect(url_for('lists.listAll'))
 
     # Otherwise, render the form.
-    return render_template('/lists/creature_add.html', types=types)
+    return render_template('/lists/creature_add.html')
 
 
 @bp.route('/wildlife/<int:creature_id>/')
+@conditional
+@cached_page
 def showCreature(creature_id):
     """Show the requested creature information"""
-    db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
-    creature = db.execute('SELECT * FROM creature WHERE id = ?',
-                          (creature_id,)).fetchone()
+    creature = get_creature(creature_id)
 
     if creature:
-        return render_template('/lists/creature_show.html', types=types,
+        return render_template('/lists/creature_show.html',
                                creature=creature)
     else:
         flash("This entry does not exist.")
@@ -108,12 +134,15 @@ def showCreature(creature_id):
 def editCreature(creature_id):
     """Render and handle the form to edit a creature"""
     db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
     creature = db.execute('SELECT * FROM creature WHERE id = ?',
                           (creature_id,)).fetchone()
 
+    if creature is None:
+        flash("This entry does not exist.")
+        return redirect(url_for('lists.listAll'))
+
     # Only the owner of a creature may edit its entry.
-    if g.user_id is not creature['user_id']:
+    if not owns(creature):
         flash("You may only edit an entry you own.")
         return redirect(url_for('lists.listAll'))
 
@@ -170,12 +199,14 @@ def editCreature(creature_id):
                                   user_id,
                                   type_id,
                                   creature_id))
+        bump_catalogue_version()
         db.commit()
+        invalidate_pages()
         flash("Successfully edited " + creature['name_common'])
         return redirect(url_for('lists.listAll'))
 
     # Otherwise, render the form.
-    return render_template('/lists/creature_edit.html', types=types,
+    return render_template('/lists/creature_edit.html',
                            creature=creature)
 
 
@@ -184,22 +215,121 @@ def editCreature(creature_id):
 def deleteCreature(creature_id):
     """Render and handle the form to delete a creature"""
     db = get_db()
-    types = db.execute('SELECT * FROM creature_type').fetchall()
     creature = db.execute('SELECT * FROM creature WHERE id = ?',
                           (creature_id,)).fetchone()
 
+    if creature is None:
+        flash("This entry does not exist.")
+        return redirect(url_for('lists.listAll'))
+
     # Only the owner of a creature may edit its entry.
-    if g.user_id is not creature['user_id']:
+    if not owns(creature):
         flash("You may only delete an entry you own.")
         return redirect(url_for('lists.listAll'))
 
     # If the form has been submitted, delete the entry from its table.
     if request.method == 'POST':
+        # Users' sightings are never deleted along with a creature.
+        if db.execute('SELECT 1 FROM sighting WHERE creature_id = ?',
+                      (creature_id,)).fetchone():
+            flash(creature['name_common'] + " has been seen, so it may not "
+                  "be deleted.")
+            return redirect(url_for('lists.showCreature',
+                                    creature_id=creature_id))
         db.execute('DELETE FROM creature where id = ?', (creature_id,))
+        bump_catalogue_version()
         db.commit()
+        invalidate_pages()
         flash("Successfully deleted " + creature['name_common'])
         return redirect(url_for('lists.listAll'))
 
     # Otherwise, render the form.
-    return render_template('/lists/creature_delete.html', types=types,
+    return render_template('/lists/creature_delete.html',
                            creature=creature)
+
+
+def write_creature(db, item, creatures, type_ids):
+    """Add or edit one creature of a batch
+
+    creatures maps ids to the stored creatures, and is kept up to date.
+    Return the result to report for the item.
+    """
+    if not isinstance(item, dict):
+        return {'status': 'error', 'error': 'Not a creature.'}
+
+    fields = {f: item[f] for f in CSV_FIELDS if item.get(f)}
+    if not all(isinstance(v, str) for v in fields.values()):
+        return {'status': 'error', 'error': 'Fields must be strings.'}
+    if 'type_id' in fields and fields['type_id'] not in type_ids:
+        return {'status': 'error', 'error': 'No such category.'}
+
+    if 'id' not in item:
+        missing = [f for f in REQUIRED_FIELDS if f not in fields]
+        if missing:
+            return {'status': 'error',
+                    'error': 'Missing ' + ', '.join(missing) + '.'}
+
+        values = [fields.get(f, '') for f in CSV_FIELDS]
+        cursor = db.execute('INSERT INTO creature (%s, user_id) \
+                             VALUES (?,?,?,?,?,?,?)' % ', '.join(CSV_FIELDS),
+                            values + [g.user_id])
+        creatures[cursor.lastrowid] = dict(zip(CSV_FIELDS, values),
+                                           id=cursor.lastrowid,
+                                           user_id=g.user_id)
+        return {'status': 'created', 'id': cursor.lastrowid}
+
+    # JSON true would otherwise stand for creature 1.
+    if not isinstance(item['id'], int) or isinstance(item['id'], bool):
+        return {'status': 'error', 'error': 'Ids must be integers.'}
+    creature = creatures.get(item['id'])
+    if creature is None:
+        return {'status': 'error', 'id': item['id'],
+                'error': 'This entry does not exist.'}
+    # Only the owner of a creature may edit its entry.
+    if not owns(creature):
+        return {'status': 'error', 'id': item['id'],
+                'error': 'You may only edit an entry you own.'}
+
+    # Only use new values if they were submitted, and never change
+    # the owner.
+    if fields:
+        creature.update(fields)
+        db.execute('UPDATE creature SET %s WHERE id = ?'
+                   % ', '.join(f + ' = ?' for f in fields),
+                   list(fields.values()) + [item['id']])
+    return {'status': 'updated', 'id': item['id']}
+
+
+@bp.route('/wildlife/batch', methods=['POST'])
+@login_required
+def batchCreatures():
+    """Add and edit many creatures in one transaction
+
+    The body is a JSON list of creatures. Those with an id are edited
+    as editCreature would, and the others are added. The response
+    lists the result of each item, in order; items with errors are
+    skipped and the rest are still saved.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify(error='Expected a JSON list of creatures.'), 400
+    if len(items) > current_app.config['MAX_PAGE_SIZE']:
+        return jsonify(error='At most %d creatures per batch.'
+                       % current_app.config['MAX_PAGE_SIZE']), 400
+
+    db = get_db()
+    ids = [i['id'] for i in items
+           if isinstance(i, dict) and isinstance(i.get('id'), int)
+           and not isinstance(i['id'], bool)]
+    creatures = {c['id']: dict(c) for c in get_creatures(ids)}
+    type_ids = set(t['url_text'] for t in get_creature_types())
+
+    results = [write_creature(db, item, creatures, type_ids)
+               for item in items]
+
+    if any(r['status'] != 'error' for r in results):
+        bump_catalogue_version()
+        db.commit()
+        invalidate_pages()
+
+    return jsonify(results=results)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""Request Metrics
+
+This module describes opt-in instrumentation of each request: its
+wall time, the number and time of its SQL statements, the time spent
+rendering templates and the time spent hashing gplus_ids. With
+METRICS on, every response carries these in a Server-Timing header,
+and /metrics reports totals for the worker in the Prometheus text
+format, along with the connection pool and page cache counters.
+
+With PROFILE_SLOW_REQUESTS set to a number of seconds, the stacks of
+requests in progress are also sampled, and those of requests slower
+than that are written to PROFILE_DIR as collapsed stacks, one line
+per stack with its sample count, as flame graph tools read them.
+"""
+
+import contextlib
+import contextvars
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import (
+    abort, before_render_template, current_app, g, request,
+    template_rendered
+)
+
+# The RequestMetrics of the request running in this context, if any.
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+# Upper bounds of the request duration histogram, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4'
+
+# Connection pool and page cache stats that are levels, rather than
+# counts that only go up.
+GAUGES = ('in_use', 'idle', 'pages')
+
+
+class RequestMetrics(object):
+    """Times and counts gathered during one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.auth_time = 0.0
+        self._template_starts = []
+
+
+@contextlib.contextmanager
+def timed(kind):
+    """Add the time spent in the block to the request's kind_time"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        name = kind + '_time'
+        setattr(metrics, name,
+                getattr(metrics, name) + time.perf_counter() - start)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor adding its statements and fetches to the request's SQL time
+
+    SQLite does most of the work of a query while rows are fetched,
+    so fetches are timed as well as execution.
+    """
+
+    def execute(self, *args):
+        metrics = _current.get()
+        if metrics is None:
+            return super().execute(*args)
+
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            metrics.sql_count += 1
+            metrics.sql_time += time.perf_counter() - start
+
+    def executemany(self, *args):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.sql_count += 1
+        with timed('sql'):
+            return super().executemany(*args)
+
+    def executescript(self, *args):
+        with timed('sql'):
+            return super().executescript(*args)
+
+    def fetchone(self):
+        with timed('sql'):
+            return super().fetchone()
+
+    def fetchmany(self, *args):
+        with timed('sql'):
+            return super().fetchmany(*args)
+
+    def fetchall(self):
+        with timed('sql'):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors are TimedCursors
+
+    The shortcut methods are redefined as sqlite3 describes them, since
+    the built-in ones make plain cursors.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+
+class Registry(object):
+    """Totals of the requests served by this worker, by endpoint"""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.buckets = {}
+        self.durations = Counter()
+        self.totals = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, duration, metrics):
+        """Add one finished request"""
+        with self._lock:
+            self.requests[(endpoint, method, status)] += 1
+            buckets = self.buckets.setdefault(endpoint,
+                                              [0] * (len(BUCKETS) + 1))
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+            buckets[-1] += 1
+            self.durations[endpoint] += duration
+            self.totals[('sql_statements_total', endpoint)] += \
+                metrics.sql_count
+            self.totals[('sql_seconds_total', endpoint)] += metrics.sql_time
+            self.totals[('template_seconds_total', endpoint)] += \
+                metrics.template_time
+            self.totals[('auth_hash_seconds_total', endpoint)] += \
+                metrics.auth_time
+
+    def render(self, stats):
+        """Return the totals and stats in the Prometheus text format
+
+        stats lists the name, type, help and value of other metrics.
+        """
+        lines = []
+
+        def family(name, kind, help):
+            lines.append('# HELP wallowawildlife_%s %s' % (name, help))
+            lines.append('# TYPE wallowawildlife_%s %s' % (name, kind))
+
+        with self._lock:
+            family('requests_total', 'counter', 'Requests served.')
+            for (endpoint, method, status), n in sorted(
+                    self.requests.items()):
+                lines.append('wallowawildlife_requests_total{endpoint="%s",'
+                             'method="%s",status="%d"} %d'
+                             % (endpoint, method, status, n))
+
+            family('request_seconds', 'histogram',
+                   'Time to handle a request.')
+            for endpoint, buckets in sorted(self.buckets.items()):
+                for bound, n in zip(BUCKETS + ('+Inf',), buckets):
+                    lines.append('wallowawildlife_request_seconds_bucket'
+                                 '{endpoint="%s",le="%s"} %d'
+                                 % (endpoint, bound, n))
+                lines.append('wallowawildlife_request_seconds_sum'
+                             '{endpoint="%s"} %f'
+                             % (endpoint, self.durations[endpoint]))
+                lines.append('wallowawildlife_request_seconds_count'
+                             '{endpoint="%s"} %d' % (endpoint, buckets[-1]))
+
+            for name, help in [
+                    ('sql_statements_total', 'SQL statements run.'),
+                    ('sql_seconds_total', 'Time spent in SQLite.'),
+                    ('template_seconds_total', 'Time rendering templates.'),
+                    ('auth_hash_seconds_total', 'Time hashing gplus_ids.')]:
+                family(name, 'counter', help)
+                for (total, endpoint), value in sorted(self.totals.items()):
+                    if total == name:
+                        lines.append('wallowawildlife_%s{endpoint="%s"} %g'
+                                     % (name, endpoint, value))
+
+        for name, kind, help, value in stats:
+            family(name, kind, help)
+            lines.append('wallowawildlife_%s %g' % (name, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def collapse(frame):
+    """Return a stack as one line, outermost call first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.basename(code.co_filename),
+                                code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SlowRequestProfiler(object):
+    """Sample the stacks of the threads handling requests"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}
+        self._wake = threading.Condition()
+        self._thread = None
+
+    def begin(self):
+        """Start sampling the current thread"""
+        with self._wake:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def end(self):
+        """Stop sampling the current thread and return its samples"""
+        with self._wake:
+            return self._active.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        """Take a sample of every active thread each interval"""
+        while True:
+            with self._wake:
+                while not self._active:
+                    self._wake.wait()
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+            time.sleep(self.interval)
+
+
+def dump_profile(samples, duration):
+    """Write the samples of a slow request to PROFILE_DIR"""
+    directory = current_app.config['PROFILE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    name = '%s-%s-%dms.txt' % (time.strftime('%Y%m%d-%H%M%S'),
+                               request.endpoint, duration * 1000)
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write('# %s %s\n' % (request.method, request.full_path))
+        for stack, n in samples.most_common():
+            f.write('%s %d\n' % (stack, n))
+
+
+def start_request():
+    """Begin measuring a request if METRICS is on"""
+    if not current_app.config['METRICS']:
+        return
+
+    g.metrics = RequestMetrics()
+    g.metrics_token = _current.set(g.metrics)
+    profiler = current_app.extensions.get('profiler')
+    if profiler is not None:
+        profiler.begin()
+
+
+def finish_request(response):
+    """Record a measured request and add its Server-Timing header"""
+    metrics = g.get('metrics')
+    if metrics is None:
+        return response
+
+    duration = time.perf_counter() - metrics.start
+    current_app.extensions['metrics'].observe(
+        request.endpoint or 'none', request.method, response.status_code,
+        duration, metrics)
+
+    response.headers['Server-Timing'] = ', '.join([
+        'app;dur=%.2f' % (duration * 1000),
+        'db;dur=%.2f;desc="%d queries"' % (metrics.sql_time * 1000,
+                                           metrics.sql_count),
+        'tpl;dur=%.2f' % (metrics.template_time * 1000),
+        'auth;dur=%.2f' % (metrics.auth_time * 1000),
+    ])
+
+    profiler = current_app.extensions.get('profiler')
+    if profiler is not None:
+        samples = profiler.end()
+        if duration >= current_app.config['PROFILE_SLOW_REQUESTS']:
+            dump_profile(samples, duration)
+
+    return response
+
+
+def stop_request(e=None):
+    """Stop attributing work in this context to the request"""
+    token = g.pop('metrics_token', None)
+    if token is not None:
+        _current.reset(token)
+        profiler = current_app.extensions.get('profiler')
+        if profiler is not None:
+            profiler.end()
+
+
+def template_started(sender, template, context, **extra):
+    """Note when a template starts rendering"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics._template_starts.append(time.perf_counter())
+
+
+def template_finished(sender, template, context, **extra):
+    """Add the time a template took to render"""
+    metrics = _current.get()
+    if metrics is not None and metrics._template_starts:
+        metrics.template_time += \
+            time.perf_counter() - metrics._template_starts.pop()
+
+
+def metrics_view():
+    """Report this worker's metrics in the Prometheus text format"""
+    if not current_app.config['METRICS']:
+        abort(404)
+
+    stats = []
+
+    def add(prefix, help, values):
+        for name, value in sorted(values.items()):
+            if name in GAUGES:
+                stats.append((prefix + name, 'gauge',
+                              help % name.replace('_', ' '), value))
+            else:
+                stats.append((prefix + name + '_total', 'counter',
+                              help % name, value))
+
+    pool = current_app.extensions.get('db_pool')
+    if pool is not None:
+        add('db_connections_', 'Database connections %s.', pool.stats())
+    cache = current_app.extensions.get('page_cache')
+    if cache is not None:
+        add('page_cache_', 'Page cache %s.', cache.stats())
+
+    text = current_app.extensions['metrics'].render(stats)
+    return current_app.response_class(text, mimetype=PROMETHEUS_MIMETYPE)
+
+
+def init_app(app):
+    """Register the instrumentation hooks and the /metrics route
+
+    The hooks do nothing unless METRICS is on.
+    """
+    app.extensions['metrics'] = Registry()
+    if app.config['PROFILE_SLOW_REQUESTS'] is not None:
+        app.extensions['profiler'] = SlowRequestProfiler(
+            app.config['PROFILE_INTERVAL'])
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(stop_request)
+    before_render_template.connect(template_started, app)
+    template_rendered.connect(template_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Page Cache
+
+This module describes a bounded, in-process cache of rendered list
+and detail pages. A page depends only on the state of the catalogue,
+the URL, the logged-in user and that user's sightings, so it is
+stored under those and served again until one of them changes.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, request, session
+
+from wallowawildlife.db import get_catalogue_version
+from wallowawildlife.images import manifest_version
+from wallowawildlife.summaries import get_checklist_version
+
+
+class PageCache(object):
+    """Least-recently-used cache holding up to size rendered pages"""
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the page stored under key, or None"""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._pages.move_to_end(key)
+
+            return page
+
+    def put(self, key, page):
+        """Store a page, evicting the least recently used if full"""
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every stored page"""
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self):
+        """Return counts of hits, misses, evictions and stored pages"""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'pages': len(self._pages)}
+
+
+def get_page_cache():
+    """Return the page cache of the current app, or None if disabled"""
+    return current_app.extensions.get('page_cache')
+
+
+def invalidate_pages():
+    """Drop every cached page after the catalogue has changed
+
+    Pages rendered for an older catalogue version could never be
+    served again anyway; this frees their memory straight away.
+    """
+    cache = get_page_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def cached_page(view):
+    """Serve a page rendered earlier for the same catalogue, URL and user
+
+    Pages are rendered again once the user's sightings change. Only
+    rendered pages are cached, not redirects. Nothing is cached while
+    flashed messages are waiting to be shown.
+    """
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        """Define the wrapped view to look up the page cache first"""
+        cache = get_page_cache()
+        if cache is None or session.get('_flashes'):
+            return view(**kwargs)
+
+        key = (get_catalogue_version(), manifest_version(),
+               request.full_path, g.user_id, get_checklist_version())
+        page = cache.get(key)
+        if page is None:
+            page = view(**kwargs)
+            if isinstance(page, str):
+                cache.put(key, page)
+
+        return page
+
+    return wrapped_view
+
+
+def init_app(app):
+    """Give the app a page cache unless PAGE_CACHE_SIZE is 0"""
+    if app.config['PAGE_CACHE_SIZE']:
+        app.extensions['page_cache'] = PageCache(app.config['PAGE_CACHE_SIZE'])
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""Keyset Pagination
+
+This module describes functions for paging through creatures in
+alphabetical order. Pages are found by seeking the
+(name_common, id) index from the last row seen rather than with
+OFFSET, so every page costs the same no matter how deep it is.
+"""
+
+import base64
+import json
+
+from flask import abort, current_app, request, url_for
+
+from wallowawildlife.db import get_db, get_snapshot
+from wallowawildlife.snapshot import sort_key
+
+# Case-insensitive to match the order the list pages have always used.
+ORDER_KEY = 'name_common COLLATE NOCASE'
+
+
+class Page(object):
+    """One page of creatures and the cursors for its neighbours"""
+
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def next_url(self):
+        """URL of the following page, or None on the last page"""
+        return _page_url('after', self.next_cursor)
+
+    @property
+    def prev_url(self):
+        """URL of the preceding page, or None on the first page"""
+        return _page_url('before', self.prev_cursor)
+
+    def link_header(self):
+        """Return the neighbouring pages as an RFC 8288 Link header"""
+        links = []
+        if self.next_url:
+            links.append('<%s>; rel="next"' % self.next_url)
+        if self.prev_url:
+            links.append('<%s>; rel="prev"' % self.prev_url)
+
+        return ', '.join(links)
+
+
+def _page_url(direction, cursor):
+    """Return the current URL moved to the page beside cursor"""
+    if cursor is None:
+        return None
+
+    args = dict(request.view_args)
+    if 'limit' in request.args:
+        args['limit'] = page_size()
+    args[direction] = cursor
+
+    return url_for(request.endpoint, **args)
+
+
+def encode_cursor(creature):
+    """Return an opaque cursor pointing at a creature"""
+    key = json.dumps([creature['name_common'], creature['id']])
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return the (name_common, id) a cursor points at
+
+    Abort with 400 Bad Request if the cursor is malformed.
+    """
+    try:
+        name, creature_id = json.loads(base64.urlsafe_b64decode(cursor))
+    except (ValueError, TypeError):
+        abort(400)
+
+    if not isinstance(name, str) or not isinstance(creature_id, int):
+        abort(400)
+
+    return name, creature_id
+
+
+def page_size():
+    """Return the page size requested with ?limit=, within bounds"""
+    limit = request.args.get('limit', type=int)
+    if limit is None or limit < 1:
+        return current_app.config['PAGE_SIZE']
+
+    return min(limit, current_app.config['MAX_PAGE_SIZE'])
+
+
+def select_page(type_id, cursor, descending, limit):
+    """Return up to limit creatures beside a cursor's (name, id)
+
+    The creatures after it are returned in name order, or those
+    before it in reverse if descending is set.
+    """
+    where = []
+    params = []
+    if type_id is not None:
+        where.append('type_id = ?')
+        params.append(type_id)
+
+    # Spelled out rather than as a row value so that SQLite can seek
+    # the index on the name.
+    if cursor is not None:
+        op = '<' if descending else '>'
+        where.append('%s %s= ? AND (%s %s ? OR id %s ?)'
+                     % (ORDER_KEY, op, ORDER_KEY, op, op))
+        name, creature_id = cursor
+        params.extend([name, name, creature_id])
+    if descending:
+        order = '%s DESC, id DESC' % ORDER_KEY
+    else:
+        order = '%s, id' % ORDER_KEY
+
+    sql = 'SELECT * FROM creature'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY %s LIMIT ?' % order
+    params.append(limit)
+    return get_db().execute(sql, params).fetchall()
+
+
+def paginate_creatures(type_id=None):
+    """Return the page of creatures selected by the request arguments
+
+    ?after=<cursor> returns the page following a cursor and
+    ?before=<cursor> the page preceding it. With neither, the first
+    page is returned. Only creatures of type_id are included if
+    it is given.
+    """
+    limit = page_size()
+    after = request.args.get('after')
+    before = request.args.get('before')
+    cursor = None
+    if before is not None:
+        cursor = decode_cursor(before)
+    elif after is not None:
+        cursor = decode_cursor(after)
+
+    # Fetch one extra row to find out whether there is another page.
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        key = None if cursor is None else sort_key(*cursor)
+        rows = snapshot.seek(type_id, key, before is not None, limit + 1)
+    else:
+        rows = select_page(type_id, cursor, before is not None, limit + 1)
+
+    more = len(rows) > limit
+    items = rows[:limit]
+    if before is not None:
+        items.reverse()
+        next_cursor = encode_cursor(items[-1]) if items else before
+        prev_cursor = encode_cursor(items[0]) if more else None
+    else:
+        next_cursor = encode_cursor(items[-1]) if more else None
+        prev_cursor = encode_cursor(items[0]) if after and items else None
+
+    return Page(items, next_cursor, prev_cursor)
@@ -1,12 +1,27 @@
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS creature_type;
 DROP TABLE IF EXISTS creature;
+DROP TABLE IF EXISTS catalogue;
+DROP TABLE IF EXISTS creature_fts;
+DROP TABLE IF EXISTS creature_change;
+DROP TABLE IF EXISTS sighting;
+DROP TABLE IF EXISTS seen_creature;
+DROP TABLE IF EXISTS checklist_progress;
+DROP TABLE IF EXISTS checklist_version;
+DROP TABLE IF EXISTS creature_day;
+DROP TABLE IF EXISTS sighting_location;
+DROP TABLE IF EXISTS sighting_rtree;
+DROP TABLE IF EXISTS tile_zoom;
+DROP TABLE IF EXISTS sighting_tile;
 
 CREATE TABLE user (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
-  gplus_id TEXT UNIQUE NOT NULL
+  gplus_id TEXT UNIQUE NOT NULL,
+  gplus_digest TEXT
 );
 
+CREATE UNIQUE INDEX user_gplus_digest_idx ON user (gplus_digest);
+
 CREATE TABLE creature_type (
 	id INTEGER PRIMARY KEY AUTOINCREMENT,
   name TEXT UNIQUE NOT NULL,
@@ -26,3 +41,264 @@ CREATE TABLE creature (
   FOREIGN KEY (user_id) REFERENCES user (id)
 );
 
+CREATE INDEX creature_user_id_idx ON creature (user_id);
+CREATE INDEX creature_name_idx ON creature (name_common COLLATE NOCASE, id);
+CREATE INDEX creature_type_name_idx
+  ON creature (type_id, name_common COLLATE NOCASE, id);
+CREATE INDEX creature_name_latin_idx ON creature (name_latin);
+
+-- Full-text index of creature names, kept in step by the triggers below.
+CREATE VIRTUAL TABLE creature_fts USING fts5(
+  name_common, name_latin,
+  content='creature', content_rowid='id',
+  tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER creature_fts_insert AFTER INSERT ON creature BEGIN
+  INSERT INTO creature_fts (rowid, name_common, name_latin)
+  VALUES (new.id, new.name_common, new.name_latin);
+END;
+
+CREATE TRIGGER creature_fts_delete AFTER DELETE ON creature BEGIN
+  INSERT INTO creature_fts (creature_fts, rowid, name_common, name_latin)
+  VALUES ('delete', old.id, old.name_common, old.name_latin);
+END;
+
+CREATE TRIGGER creature_fts_update
+AFTER UPDATE OF name_common, name_latin ON creature BEGIN
+  INSERT INTO creature_fts (creature_fts, rowid, name_common, name_latin)
+  VALUES ('delete', old.id, old.name_common, old.name_latin);
+  INSERT INTO creature_fts (rowid, name_common, name_latin)
+  VALUES (new.id, new.name_common, new.name_latin);
+END;
+
+-- The catalogue version at which each creature was last inserted,
+-- updated or deleted, for building delta bundles. Deleted creatures
+-- stay here with deleted = 1.
+CREATE TABLE creature_change (
+  creature_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL,
+  deleted INTEGER NOT NULL
+);
+
+CREATE INDEX creature_change_version_idx ON creature_change (version);
+
+CREATE TRIGGER creature_change_insert AFTER INSERT ON creature BEGIN
+  INSERT INTO creature_change (creature_id, version, deleted)
+  VALUES (new.id, (SELECT version FROM catalogue), 0)
+  ON CONFLICT (creature_id) DO UPDATE
+  SET version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER creature_change_update AFTER UPDATE ON creature BEGIN
+  INSERT INTO creature_change (creature_id, version, deleted)
+  VALUES (new.id, (SELECT version FROM catalogue), 0)
+  ON CONFLICT (creature_id) DO UPDATE
+  SET version = excluded.version, deleted = 0;
+END;
+
+CREATE TRIGGER creature_change_delete AFTER DELETE ON creature BEGIN
+  INSERT INTO creature_change (creature_id, version, deleted)
+  VALUES (old.id, (SELECT version FROM catalogue), 1)
+  ON CONFLICT (creature_id) DO UPDATE
+  SET version = excluded.version, deleted = 1;
+END;
+
+-- Creatures users have seen. A creature with sightings can't be deleted.
+CREATE TABLE sighting (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NOT NULL,
+  creature_id INTEGER NOT NULL,
+  seen_at TIMESTAMP NOT NULL,
+  count INTEGER NOT NULL DEFAULT 1,
+  notes TEXT NOT NULL DEFAULT '',
+
+  FOREIGN KEY (user_id) REFERENCES user (id),
+  FOREIGN KEY (creature_id) REFERENCES creature (id)
+);
+
+CREATE INDEX sighting_user_seen_idx ON sighting (user_id, seen_at);
+CREATE INDEX sighting_creature_id_idx ON sighting (creature_id);
+
+CREATE TRIGGER sighting_creature_keep BEFORE DELETE ON creature
+WHEN EXISTS (SELECT 1 FROM sighting WHERE creature_id = old.id) BEGIN
+  SELECT RAISE(ABORT, 'Creature has sightings.');
+END;
+
+-- Summaries of the sightings, kept up to date by the triggers below so
+-- that pages never count sightings. seen_creature counts each user's
+-- sightings of each creature, checklist_progress the creatures of each
+-- type a user has seen, and creature_day the sightings of each
+-- creature per day. checklist_version changes with each user's
+-- sightings, for the page cache and ETags.
+CREATE TABLE seen_creature (
+  user_id INTEGER NOT NULL,
+  creature_id INTEGER NOT NULL,
+  type_id TEXT NOT NULL,
+  sightings INTEGER NOT NULL,
+  PRIMARY KEY (user_id, creature_id)
+) WITHOUT ROWID;
+
+CREATE INDEX seen_creature_creature_id_idx ON seen_creature (creature_id);
+
+CREATE TABLE checklist_progress (
+  user_id INTEGER NOT NULL,
+  type_id TEXT NOT NULL,
+  seen INTEGER NOT NULL,
+  PRIMARY KEY (user_id, type_id)
+) WITHOUT ROWID;
+
+CREATE TABLE checklist_version (
+  user_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL
+);
+
+CREATE TABLE creature_day (
+  creature_id INTEGER NOT NULL,
+  day TEXT NOT NULL,
+  sightings INTEGER NOT NULL,
+  individuals INTEGER NOT NULL,
+  PRIMARY KEY (day, creature_id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER sighting_summary_insert AFTER INSERT ON sighting BEGIN
+  INSERT INTO seen_creature (user_id, creature_id, type_id, sightings)
+  SELECT new.user_id, id, type_id, 1 FROM creature
+  WHERE id = new.creature_id
+  ON CONFLICT (user_id, creature_id) DO UPDATE
+  SET sightings = sightings + 1;
+  INSERT INTO checklist_progress (user_id, type_id, seen)
+  SELECT user_id, type_id, 1 FROM seen_creature
+  WHERE user_id = new.user_id AND creature_id = new.creature_id
+  AND sightings = 1
+  ON CONFLICT (user_id, type_id) DO UPDATE SET seen = seen + 1;
+  INSERT INTO creature_day (creature_id, day, sightings, individuals)
+  VALUES (new.creature_id, date(new.seen_at), 1, new.count)
+  ON CONFLICT (day, creature_id) DO UPDATE
+  SET sightings = sightings + 1,
+      individuals = individuals + excluded.individuals;
+  INSERT INTO checklist_version (user_id, version)
+  VALUES (new.user_id, 1)
+  ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER sighting_summary_delete AFTER DELETE ON sighting BEGIN
+  UPDATE checklist_progress SET seen = seen - 1
+  WHERE (user_id, type_id) = (
+    SELECT user_id, type_id FROM seen_creature
+    WHERE user_id = old.user_id AND creature_id = old.creature_id
+    AND sightings = 1);
+  DELETE FROM checklist_progress WHERE user_id = old.user_id AND seen = 0;
+  DELETE FROM seen_creature
+  WHERE user_id = old.user_id AND creature_id = old.creature_id
+  AND sightings = 1;
+  UPDATE seen_creature SET sightings = sightings - 1
+  WHERE user_id = old.user_id AND creature_id = old.creature_id;
+  UPDATE creature_day
+  SET sightings = sightings - 1, individuals = individuals - old.count
+  WHERE creature_id = old.creature_id AND day = date(old.seen_at);
+  DELETE FROM creature_day
+  WHERE creature_id = old.creature_id AND day = date(old.seen_at)
+  AND sightings = 0;
+  UPDATE checklist_version SET version = version + 1
+  WHERE user_id = old.user_id;
+END;
+
+-- A creature moved to another type counts towards that type for the
+-- users who have seen it.
+CREATE TRIGGER seen_creature_retype AFTER UPDATE OF type_id ON creature
+WHEN new.type_id IS NOT old.type_id BEGIN
+  UPDATE checklist_progress SET seen = seen - 1
+  WHERE type_id = old.type_id AND user_id IN (
+    SELECT user_id FROM seen_creature WHERE creature_id = old.id);
+  DELETE FROM checklist_progress WHERE type_id = old.type_id AND seen = 0;
+  INSERT INTO checklist_progress (user_id, type_id, seen)
+  SELECT user_id, new.type_id, 1 FROM seen_creature
+  WHERE creature_id = new.id
+  ON CONFLICT (user_id, type_id) DO UPDATE SET seen = seen + 1;
+  UPDATE seen_creature SET type_id = new.type_id WHERE creature_id = new.id;
+END;
+
+-- Positions of the sightings recorded with one. tile_x and tile_y are
+-- the Web Mercator map tile at zoom 16 containing the position.
+CREATE TABLE sighting_location (
+  sighting_id INTEGER PRIMARY KEY,
+  latitude REAL NOT NULL,
+  longitude REAL NOT NULL,
+  tile_x INTEGER NOT NULL,
+  tile_y INTEGER NOT NULL
+);
+
+-- Spatial index of the positions, kept in step by the triggers below.
+-- Its boxes are rounded outwards, so the exact position, the creature
+-- and the count are kept alongside.
+CREATE VIRTUAL TABLE sighting_rtree USING rtree(
+  id, min_lat, max_lat, min_lon, max_lon,
+  +latitude, +longitude, +creature_id, +count
+);
+
+-- The zoom levels sighting_tile counts sightings at, up to 16.
+CREATE TABLE tile_zoom (zoom INTEGER PRIMARY KEY);
+
+INSERT INTO tile_zoom (zoom)
+VALUES (0), (1), (2), (3), (4), (5), (6), (7), (8),
+       (9), (10), (11), (12), (13), (14), (15), (16);
+
+-- Sightings and individuals of each creature per map tile.
+CREATE TABLE sighting_tile (
+  zoom INTEGER NOT NULL,
+  x INTEGER NOT NULL,
+  y INTEGER NOT NULL,
+  creature_id INTEGER NOT NULL,
+  sightings INTEGER NOT NULL,
+  individuals INTEGER NOT NULL,
+  PRIMARY KEY (zoom, x, y, creature_id)
+) WITHOUT ROWID;
+
+CREATE TRIGGER sighting_location_insert
+AFTER INSERT ON sighting_location BEGIN
+  INSERT INTO sighting_rtree (id, min_lat, max_lat, min_lon, max_lon,
+                              latitude, longitude, creature_id, count)
+  SELECT id, new.latitude, new.latitude, new.longitude, new.longitude,
+         new.latitude, new.longitude, creature_id, count
+  FROM sighting WHERE id = new.sighting_id;
+  INSERT INTO sighting_tile (zoom, x, y, creature_id, sightings,
+                             individuals)
+  SELECT zoom, new.tile_x >> (16 - zoom), new.tile_y >> (16 - zoom),
+         creature_id, 1, count
+  FROM sighting, tile_zoom WHERE sighting.id = new.sighting_id
+  ON CONFLICT (zoom, x, y, creature_id) DO UPDATE
+  SET sightings = sightings + 1,
+      individuals = individuals + excluded.individuals;
+END;
+
+CREATE TRIGGER sighting_location_delete AFTER DELETE ON sighting BEGIN
+  UPDATE sighting_tile
+  SET sightings = sightings - 1, individuals = individuals - old.count
+  WHERE (zoom, x, y, creature_id) IN (
+    SELECT zoom, tile_x >> (16 - zoom), tile_y >> (16 - zoom),
+           old.creature_id
+    FROM sighting_location, tile_zoom WHERE sighting_id = old.id);
+  DELETE FROM sighting_tile
+  WHERE (zoom, x, y, creature_id) IN (
+    SELECT zoom, tile_x >> (16 - zoom), tile_y >> (16 - zoom),
+           old.creature_id
+    FROM sighting_location, tile_zoom WHERE sighting_id = old.id)
+  AND sightings = 0;
+  DELETE FROM sighting_rtree WHERE id = old.id;
+  DELETE FROM sighting_location WHERE sighting_id = old.id;
+END;
+
+-- A single row recording changes to the creature catalogue. The epoch
+-- is new every time the database is built, so versions from a previous
+-- build never match.
+CREATE TABLE catalogue (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  epoch TEXT NOT NULL,
+  version INTEGER NOT NULL
+);
+
+INSERT INTO catalogue (id, epoch, version)
+VALUES (1, lower(hex(randomblob(8))), 1);
+
+PRAGMA user_version = 11;
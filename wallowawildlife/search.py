@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Creature Search
+
+This module describes functions for searching creature names through
+the creature_fts full-text index. Every word of a search matches as a
+prefix, so results can be shown while the user is still typing.
+"""
+
+import re
+
+from flask import current_app
+
+from wallowawildlife.db import get_db
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# The first matches of a query, with their bm25 rank.
+CANDIDATES = 'SELECT * FROM (SELECT rowid, rank FROM creature_fts \
+                             WHERE creature_fts MATCH ? LIMIT ?)'
+
+
+def fts_query(text, prefix=True):
+    """Turn free text into an FTS5 query matching every word
+
+    Each word matches as a prefix, or as a whole word if prefix is
+    false. Return None if the text has no words to search for.
+    """
+    words = WORD_RE.findall(text)
+    if not words:
+        return None
+
+    # Quoting each word keeps FTS5 syntax in the text from being used.
+    return ' '.join('"%s"%s' % (w, '*' if prefix else '') for w in words)
+
+
+def search_creatures(text, limit, type_id=None):
+    """Return up to limit creatures whose names match text, best first
+
+    Only creatures of type_id are returned if it is given.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+
+    # Ranking every match of a short prefix in a large catalogue takes
+    # hundreds of milliseconds, so only the first SEARCH_CANDIDATES
+    # matches are ranked. Matches of the whole words are gathered apart
+    # from the prefixes, so an exact name is found however many longer
+    # names share its start. The category is checked on the candidates
+    # alone, by their primary key.
+    candidates = current_app.config['SEARCH_CANDIDATES']
+    sql = 'SELECT creature.*, min(candidate.rank) AS rank \
+           FROM (%s UNION ALL %s) AS candidate \
+           JOIN creature ON creature.id = candidate.rowid' \
+        % (CANDIDATES, CANDIDATES)
+    params = [fts_query(text, prefix=False), candidates, query, candidates]
+    if type_id is not None:
+        sql += ' WHERE creature.type_id = ?'
+        params.append(type_id)
+    sql += ' GROUP BY creature.id ORDER BY rank LIMIT ?'
+    params.append(limit)
+
+    return get_db().execute(sql, params).fetchall()
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""Sightings Blueprint
+
+This module describes the blueprint for checking creatures off a
+user's checklist, and the writer that saves those sightings.
+
+Sightings are not inserted by the request that records them. They are
+queued for a single writer thread, which inserts everything waiting
+in one transaction and commits it with one sync, so a burst of
+sightings from many users shares a few commits instead of waiting on
+one each. The request still waits until its sighting is committed
+before answering, so an acknowledged sighting is on disk.
+"""
+
+import collections
+import datetime
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from flask import (
+    Blueprint, current_app, flash, g, jsonify, redirect, render_template,
+    request, url_for
+)
+
+from wallowawildlife.auth import login_required
+from wallowawildlife.db import connect, get_creature, get_db
+from wallowawildlife.geo import MAX_TILE_ZOOM, tile_of
+from wallowawildlife.pagination import page_size
+
+bp = Blueprint('sightings', __name__)
+
+# Seconds the writer thread waits for more sightings before it stops.
+IDLE_TIMEOUT = 1.0
+
+MAX_COUNT = 10000
+MAX_NOTES = 1000
+
+# The fields of a recorded sighting. Its position is only stored if
+# the latitude and longitude are not None.
+SIGHTING_FIELDS = ('user_id', 'creature_id', 'seen_at', 'count', 'notes',
+                   'latitude', 'longitude')
+
+
+class SightingWriter(object):
+    """Insert queued sightings in shared transactions
+
+    One thread does all the writing, and takes up to SIGHTING_BATCH_SIZE
+    sightings per transaction. It is started by the first sighting and
+    stops once it has been idle for IDLE_TIMEOUT.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.batch_size = config['SIGHTING_BATCH_SIZE']
+        self.batches = 0
+        self.written = 0
+        self._queue = collections.deque()
+        self._ready = threading.Condition()
+        self._thread = None
+
+    def submit(self, sighting):
+        """Queue a tuple of SIGHTING_FIELDS for writing
+
+        Return a Future of its id, which is set once it is committed.
+        """
+        future = Future()
+        with self._ready:
+            self._queue.append((sighting, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name='sighting-writer',
+                                                daemon=True)
+                self._thread.start()
+            else:
+                self._ready.notify()
+
+        return future
+
+    def _run(self):
+        """Write batches until the queue has been empty for a while"""
+        db = connect(self.config)
+        db.execute('PRAGMA synchronous = %s'
+                   % self.config['SIGHTING_SYNCHRONOUS'])
+        try:
+            while True:
+                with self._ready:
+                    if not self._queue:
+                        self._ready.wait(IDLE_TIMEOUT)
+                    if not self._queue:
+                        self._thread = None
+                        return
+                    batch = [self._queue.popleft() for _ in
+                             range(min(len(self._queue), self.batch_size))]
+                # Sightings whose request gave up waiting were
+                # cancelled, and are not written.
+                batch = [(sighting, future) for sighting, future in batch
+                         if future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                try:
+                    self._write(db, batch)
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            db.close()
+            with self._ready:
+                # After an unexpected error, the next sighting starts
+                # another thread.
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _write(self, db, batch):
+        """Insert a batch in one transaction and report each result
+
+        If the transaction fails, its sightings are written one at a
+        time so that only the bad ones fail.
+        """
+        try:
+            with db:
+                ids = [insert_sighting(db, sighting)
+                       for sighting, _ in batch]
+        except sqlite3.Error:
+            for sighting, future in batch:
+                try:
+                    with db:
+                        sighting_id = insert_sighting(db, sighting)
+                except sqlite3.Error as e:
+                    future.set_exception(e)
+                else:
+                    self.written += 1
+                    future.set_result(sighting_id)
+                self.batches += 1
+            return
+
+        self.batches += 1
+        self.written += len(ids)
+        for (_, future), sighting_id in zip(batch, ids):
+            future.set_result(sighting_id)
+
+
+def insert_sighting(db, sighting):
+    """Insert a tuple of SIGHTING_FIELDS and return its id"""
+    sighting_id = db.execute(
+        'INSERT INTO sighting (user_id, creature_id, seen_at, count, notes) \
+         VALUES (?, ?, ?, ?, ?)', sighting[:5]).lastrowid
+
+    latitude, longitude = sighting[5:]
+    if latitude is not None:
+        tile_x, tile_y = tile_of(latitude, longitude, MAX_TILE_ZOOM)
+        db.execute('INSERT INTO sighting_location (sighting_id, latitude, \
+                                                   longitude, tile_x, tile_y) \
+                    VALUES (?, ?, ?, ?, ?)',
+                   (sighting_id, latitude, longitude, tile_x, tile_y))
+
+    return sighting_id
+
+
+def read_position(item):
+    """Return the latitude and longitude of a sighting, or an error
+
+    Both are None if the sighting has no position.
+    """
+    latitude = item.get('latitude')
+    longitude = item.get('longitude')
+    if latitude is None and longitude is None:
+        return None, None
+
+    for value in (latitude, longitude):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return 'latitude and longitude must both be numbers.'
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return 'latitude and longitude must be a position in degrees.'
+
+    return float(latitude), float(longitude)
+
+
+def get_writer():
+    """Return the sighting writer of the current app"""
+    writer = current_app.extensions.get('sighting_writer')
+    if writer is None:
+        writer = current_app.extensions.setdefault(
+            'sighting_writer', SightingWriter(current_app.config))
+
+    return writer
+
+
+def record_sightings(sightings):
+    """Save tuples of SIGHTING_FIELDS and wait until they are committed
+
+    Return the id of each sighting, or None for any that failed or
+    were still queued after SIGHTING_WRITE_TIMEOUT seconds. Those are
+    cancelled, so a client that tries again doesn't record them twice.
+    """
+    writer = get_writer()
+    futures = [writer.submit(s) for s in sightings]
+    end = time.monotonic() + current_app.config['SIGHTING_WRITE_TIMEOUT']
+
+    ids = []
+    for future in futures:
+        try:
+            try:
+                ids.append(future.result(max(end - time.monotonic(), 0)))
+            except TimeoutError:
+                if future.cancel():
+                    ids.append(None)
+                else:
+                    # It is being written already, so wait for it.
+                    ids.append(future.result())
+        except sqlite3.Error:
+            ids.append(None)
+
+    return ids
+
+
+def now():
+    """Return the current UTC time as SQLite's CURRENT_TIMESTAMP does"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+def read_sighting(item):
+    """Check one sighting from a form or JSON object
+
+    Return a tuple of SIGHTING_FIELDS, or an error message.
+    """
+    # JSON true and false would otherwise pass for 1 and 0.
+    creature_id = item.get('creature_id')
+    if isinstance(creature_id, bool) or not isinstance(creature_id, int) \
+            or get_creature(creature_id) is None:
+        return 'This entry does not exist.'
+
+    count = item.get('count', 1)
+    if isinstance(count, bool) or not isinstance(count, int) \
+            or not 0 < count <= MAX_COUNT:
+        return 'Count must be between 1 and %d.' % MAX_COUNT
+
+    notes = item.get('notes', '')
+    if not isinstance(notes, str) or len(notes) > MAX_NOTES:
+        return 'Notes must be text of up to %d characters.' % MAX_NOTES
+
+    seen_at = item.get('seen_at')
+    if seen_at is None:
+        seen_at = now()
+    else:
+        try:
+            seen_at = datetime.datetime.fromisoformat(seen_at)
+        except (TypeError, ValueError):
+            return 'seen_at must be an ISO 8601 time.'
+        if seen_at.tzinfo is not None:
+            seen_at = seen_at.astimezone(datetime.timezone.utc)
+        seen_at = seen_at.strftime('%Y-%m-%d %H:%M:%S')
+
+    position = read_position(item)
+    if isinstance(position, str):
+        return position
+
+    return (g.user_id, creature_id, seen_at, count, notes) + position
+
+
+def sighting_json(s):
+    """Return the JSON representation of a sighting row"""
+    return {'id': s['id'],
+            'creature_id': s['creature_id'],
+            'name_common': s['name_common'],
+            'seen_at': s['seen_at'].isoformat() + 'Z',
+            'count': s['count'],
+            'notes': s['notes'],
+            'latitude': s['latitude'],
+            'longitude': s['longitude']}
+
+
+def user_sightings(limit):
+    """Return the logged-in user's latest sightings, newest first"""
+    return get_db().execute(
+        'SELECT sighting.*, creature.name_common, \
+                sighting_location.latitude, sighting_location.longitude \
+         FROM sighting \
+         JOIN creature ON creature.id = sighting.creature_id \
+         LEFT JOIN sighting_location \
+         ON sighting_location.sighting_id = sighting.id \
+         WHERE sighting.user_id = ? \
+         ORDER BY sighting.seen_at DESC, sighting.id DESC LIMIT ?',
+        (g.user_id, limit)).fetchall()
+
+
+@bp.route('/wildlife/<int:creature_id>/seen', methods=['POST'])
+@login_required
+def recordSighting(creature_id):
+    """Check a creature off the user's checklist"""
+    item = {'creature_id': creature_id,
+            'notes': request.form.get('notes', '')}
+    if request.form.get('count'):
+        item['count'] = request.form.get('count', type=int)
+
+    sighting = read_sighting(item)
+    if isinstance(sighting, str):
+        flash(sighting)
+    elif record_sightings([sighting])[0] is None:
+        flash("Your sighting could not be saved. Please try again.")
+    else:
+        flash("Checked off " + get_creature(creature_id)['name_common'])
+
+    return redirect(url_for('lists.showCreature', creature_id=creature_id))
+
+
+@bp.route('/sightings')
+@login_required
+def listSightings():
+    """List the user's latest sightings"""
+    return render_template('sightings/list.html',
+                           sightings=user_sightings(page_size()))
+
+
+@bp.route('/sightings/<int:sighting_id>/delete', methods=['POST'])
+@login_required
+def deleteSighting(sighting_id):
+    """Remove one of the user's sightings"""
+    db = get_db()
+    deleted = db.execute('DELETE FROM sighting WHERE id = ? AND user_id = ?',
+                         (sighting_id, g.user_id)).rowcount
+    db.commit()
+
+    if deleted:
+        flash("Sighting removed.")
+    else:
+        flash("You may only remove your own sightings.")
+    return redirect(url_for('sightings.listSightings'))
+
+
+@bp.route('/sightings/JSON', methods=['GET', 'POST'])
+@login_required
+def sightingsJSON():
+    """Create JSON endpoint
+
+    GET returns the user's latest sightings, newest first. POST takes
+    one sighting or a list of them, with a creature_id and optional
+    count, notes, seen_at, latitude and longitude, and lists the
+    result of each, in order.
+    """
+    if request.method == 'GET':
+        return jsonify([sighting_json(s)
+                        for s in user_sightings(page_size())])
+
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list) or not items:
+        return jsonify(error='Expected a JSON sighting or list.'), 400
+    if len(items) > current_app.config['MAX_PAGE_SIZE']:
+        return jsonify(error='At most %d sightings per request.'
+                       % current_app.config['MAX_PAGE_SIZE']), 400
+
+    results = [read_sighting(item) if isinstance(item, dict)
+               else 'Not a sighting.' for item in items]
+    ids = iter(record_sightings([r for r in results
+                                 if not isinstance(r, str)]))
+    for i, r in enumerate(results):
+        if isinstance(r, str):
+            results[i] = {'status': 'error', 'error': r}
+            continue
+        sighting_id = next(ids)
+        if sighting_id is None:
+            results[i] = {'status': 'error',
+                          'error': 'Could not be saved.'}
+        else:
+            results[i] = {'status': 'created', 'id': sighting_id}
+
+    return jsonify(results=results)
+
+
+def init_app(app):
+    """Take the application and register the blueprint"""
+    app.register_blueprint(bp)
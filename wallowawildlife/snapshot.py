@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Catalogue Snapshot
+
+This module describes an immutable, in-process copy of the creature
+table for the read routes. Creatures are kept as slotted records,
+indexed by id and, for all creatures and for each type, in the
+(name_common COLLATE NOCASE, id) order the list pages use, so a page
+is a binary search and a slice.
+
+A snapshot is never changed once it is made. When the catalogue
+version moves on, a new one is made from the creatures in
+creature_change, or read afresh after init_db, and swapped in; a
+request that already holds the old one finishes with it.
+"""
+
+import string
+import threading
+from bisect import bisect_left, bisect_right
+
+# The creature columns, in the order records are built from.
+FIELDS = ('id', 'name_common', 'name_latin', 'photo_url', 'photo_attr',
+          'wiki_url', 'user_id', 'type_id')
+
+COLUMNS = ', '.join('creature.' + f for f in FIELDS)
+
+# SQLite's NOCASE collation only folds ASCII letters.
+_NOCASE = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Above this fraction of the catalogue changed, a snapshot is read
+# afresh rather than patched.
+MAX_PATCH_FRACTION = 0.25
+
+
+class Creature(object):
+    """One creature of a snapshot, read like a sqlite3.Row"""
+
+    __slots__ = FIELDS
+
+    def __init__(self, id, name_common, name_latin, photo_url, photo_attr,
+                 wiki_url, user_id, type_id):
+        self.id = id
+        self.name_common = name_common
+        self.name_latin = name_latin
+        self.photo_url = photo_url
+        self.photo_attr = photo_attr
+        self.wiki_url = wiki_url
+        self.user_id = user_id
+        self.type_id = type_id
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def keys(self):
+        return list(FIELDS)
+
+
+def sort_key(name_common, creature_id):
+    """Return the key a creature is ordered by on the list pages"""
+    return (name_common.translate(_NOCASE), creature_id)
+
+
+def _key(creature):
+    return sort_key(creature.name_common, creature.id)
+
+
+class Snapshot(object):
+    """The creatures at one catalogue version"""
+
+    def __init__(self, version, by_id, orders):
+        self.version = version
+        self.epoch, number = version.split('-')
+        self.number = int(number)
+        self.by_id = by_id
+        # Maps None and each type_id to its creatures in name order
+        # and, alongside, their sort keys.
+        self._orders = orders
+
+    @classmethod
+    def build(cls, version, creatures):
+        """Make a snapshot holding creatures"""
+        by_id = {c.id: c for c in creatures}
+        ordered = sorted(by_id.values(), key=_key)
+        orders = {None: (ordered, [_key(c) for c in ordered])}
+        for c in ordered:
+            order = orders.get(c.type_id)
+            if order is None:
+                order = orders[c.type_id] = ([], [])
+            order[0].append(c)
+            order[1].append(_key(c))
+
+        return cls(version, by_id, orders)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def covers(self, version):
+        """Check whether this snapshot is at version or later"""
+        epoch, number = version.split('-')
+        return epoch == self.epoch and int(number) <= self.number
+
+    def patched(self, version, changes):
+        """Return a snapshot with changes applied
+
+        changes maps creature ids to their new records, or to None if
+        they were deleted. This snapshot is left as it is.
+        """
+        by_id = dict(self.by_id)
+        orders = {}
+
+        def order(type_id):
+            """Return a copy of an order that may be changed"""
+            if type_id not in orders:
+                ordered, keys = self._orders.get(type_id, ([], []))
+                orders[type_id] = (list(ordered), list(keys))
+            return orders[type_id]
+
+        for creature_id, new in changes.items():
+            old = by_id.pop(creature_id, None)
+            if old is not None:
+                key = _key(old)
+                for ordered, keys in (order(None), order(old.type_id)):
+                    i = bisect_left(keys, key)
+                    del ordered[i]
+                    del keys[i]
+            if new is not None:
+                by_id[creature_id] = new
+                key = _key(new)
+                for ordered, keys in (order(None), order(new.type_id)):
+                    i = bisect_left(keys, key)
+                    ordered.insert(i, new)
+                    keys.insert(i, key)
+
+        unchanged = {t: o for t, o in self._orders.items()
+                     if t not in orders}
+        unchanged.update(orders)
+        return Snapshot(version, by_id, unchanged)
+
+    def get(self, creature_id):
+        """Return the creature with the given id, or None"""
+        return self.by_id.get(creature_id)
+
+    def get_many(self, ids):
+        """Return the creatures with the given ids, ordered by id"""
+        found = (self.by_id.get(i) for i in sorted(set(ids)))
+        return [c for c in found if c is not None]
+
+    def seek(self, type_id, key, descending, count):
+        """Return up to count creatures beside key in name order
+
+        Creatures after key are returned, or those before it, nearest
+        first, if descending is set. With no key, they are taken
+        from the start or the end. Only creatures of type_id are
+        included if it is given.
+        """
+        ordered, keys = self._orders.get(type_id, ([], []))
+        if descending:
+            end = len(keys) if key is None else bisect_left(keys, key)
+            return ordered[max(end - count, 0):end][::-1]
+
+        start = 0 if key is None else bisect_right(keys, key)
+        return ordered[start:start + count]
+
+
+def _records(cursor):
+    """Yield records from a cursor over (extra, *FIELDS) rows"""
+    for row in cursor:
+        yield row[0], None if row[1] is None else Creature(*row[1:])
+
+
+def read_snapshot(db, previous=None):
+    """Read the current catalogue into a snapshot
+
+    The changes since previous are applied to it if it is from the
+    same epoch and few enough creatures have changed.
+    """
+    cursor = db.cursor()
+    cursor.row_factory = None
+    # One read transaction, so the version matches the rows.
+    cursor.execute('BEGIN')
+    try:
+        epoch, number = cursor.execute('SELECT epoch, version \
+                                        FROM catalogue').fetchone()
+        version = '%s-%d' % (epoch, number)
+
+        if previous is not None and previous.epoch == epoch:
+            # Changes are recorded with the version they were made at,
+            # which becomes current once they are committed.
+            changes = dict(_records(cursor.execute(
+                'SELECT creature_change.creature_id, %s \
+                 FROM creature_change \
+                 LEFT JOIN creature \
+                 ON creature.id = creature_change.creature_id \
+                 WHERE creature_change.version >= ?' % COLUMNS,
+                (previous.number,))))
+            if len(changes) <= len(previous) * MAX_PATCH_FRACTION:
+                return previous.patched(version, changes)
+
+        cursor.execute('SELECT 0, %s FROM creature' % COLUMNS)
+        return Snapshot.build(version, (c for _, c in _records(cursor)))
+    finally:
+        db.rollback()
+
+
+class SnapshotHolder(object):
+    """The latest snapshot of an app, made again as the catalogue changes"""
+
+    def __init__(self):
+        self.current = None
+        self._lock = threading.Lock()
+
+    def get(self, version, connect):
+        """Return a snapshot at version, or later
+
+        connect is called for a connection context manager if the
+        snapshot has to be read. Only one thread reads it at a time.
+        """
+        snapshot = self.current
+        if snapshot is not None and snapshot.covers(version):
+            return snapshot
+
+        with self._lock:
+            snapshot = self.current
+            if snapshot is None or not snapshot.covers(version):
+                with connect() as db:
+                    snapshot = read_snapshot(db, snapshot)
+                self.current = snapshot
+
+        return snapshot
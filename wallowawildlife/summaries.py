@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Sighting Summaries
+
+This module describes the summary tables of the sightings, which
+triggers on the sighting table update with every sighting recorded or
+removed, so checklist progress and the most seen creatures are read
+from a few rows however many sightings there are:
+
+    seen_creature       sightings per user and creature
+    checklist_progress  creatures seen per user and creature type
+    creature_day        sightings and individuals per creature and day
+    sighting_tile       sightings per creature and map tile
+    checklist_version   a counter per user, changed by every sighting
+
+'flask checksummaries' compares the tables with the sightings and
+'flask rebuildsummaries' fills them in from scratch.
+"""
+
+import sys
+
+import click
+from flask import current_app, g
+from flask.cli import with_appcontext
+
+from wallowawildlife.db import get_catalogue_version, get_db
+from wallowawildlife.geo import MAX_TILE_ZOOM
+
+# Each summary table, its columns, and the query that computes it
+# from the sightings.
+SUMMARIES = [
+    ('seen_creature', 'user_id, creature_id, type_id, sightings',
+     'SELECT sighting.user_id, sighting.creature_id, creature.type_id, \
+             COUNT(*) \
+      FROM sighting JOIN creature ON creature.id = sighting.creature_id \
+      GROUP BY sighting.user_id, sighting.creature_id'),
+    ('checklist_progress', 'user_id, type_id, seen',
+     'SELECT sighting.user_id, creature.type_id, \
+             COUNT(DISTINCT sighting.creature_id) \
+      FROM sighting JOIN creature ON creature.id = sighting.creature_id \
+      GROUP BY sighting.user_id, creature.type_id'),
+    ('creature_day', 'creature_id, day, sightings, individuals',
+     'SELECT creature_id, date(seen_at), COUNT(*), SUM(count) \
+      FROM sighting GROUP BY creature_id, date(seen_at)'),
+    ('sighting_tile', 'zoom, x, y, creature_id, sightings, individuals',
+     'SELECT zoom, tile_x >> (%(max)d - zoom), tile_y >> (%(max)d - zoom), \
+             sighting.creature_id, COUNT(*), SUM(sighting.count) \
+      FROM sighting_location \
+      JOIN sighting ON sighting.id = sighting_location.sighting_id, \
+      tile_zoom GROUP BY 1, 2, 3, 4' % {'max': MAX_TILE_ZOOM}),
+]
+
+# Days counted by most_seen.
+RECENT_DAYS = 7
+
+
+def get_checklist_version():
+    """Return a string identifying the logged-in user's sightings
+
+    It is empty for anonymous users. The version is read once per
+    request.
+    """
+    if g.user_id is None:
+        return ''
+
+    if 'checklist_version' not in g:
+        row = get_db().execute('SELECT version FROM checklist_version \
+                                WHERE user_id = ?', (g.user_id,)).fetchone()
+        g.checklist_version = str(row['version'] if row else 0)
+
+    return g.checklist_version
+
+
+def get_progress():
+    """Return the number of creatures of each type the user has seen"""
+    if g.user_id is None:
+        return {}
+
+    rows = get_db().execute('SELECT type_id, seen FROM checklist_progress \
+                             WHERE user_id = ?', (g.user_id,)).fetchall()
+    return dict((r['type_id'], r['seen']) for r in rows)
+
+
+def get_type_totals():
+    """Return the number of creatures of each type
+
+    The counts are read once per catalogue version.
+    """
+    version = get_catalogue_version()
+    cached = current_app.extensions.get('type_totals')
+    if cached is None or cached[0] != version:
+        rows = get_db().execute('SELECT type_id, COUNT(*) AS total \
+                                 FROM creature GROUP BY type_id').fetchall()
+        cached = (version, dict((r['type_id'], r['total']) for r in rows))
+        current_app.extensions['type_totals'] = cached
+
+    return cached[1]
+
+
+def most_seen(days=RECENT_DAYS, limit=10):
+    """Return the creatures with the most sightings in the last days"""
+    return get_db().execute(
+        "SELECT creature.id, creature.name_common, \
+                SUM(creature_day.sightings) AS sightings, \
+                SUM(creature_day.individuals) AS individuals \
+         FROM creature_day JOIN creature \
+         ON creature.id = creature_day.creature_id \
+         WHERE creature_day.day > date('now', ?) \
+         GROUP BY creature_day.creature_id \
+         ORDER BY sightings DESC, creature.name_common LIMIT ?",
+        ('-%d days' % days, limit)).fetchall()
+
+
+def check_summaries():
+    """Compare the summary tables with the sightings
+
+    Return a dict of the tables that differ, each with the number of
+    rows that are missing or wrong and the number that should not be
+    there.
+    """
+    db = get_db()
+    differences = {}
+    # One read transaction, so sightings recorded meanwhile don't
+    # show up as differences.
+    db.execute('BEGIN')
+    try:
+        for table, columns, query in SUMMARIES:
+            stored = 'SELECT %s FROM %s' % (columns, table)
+            missing = db.execute('SELECT COUNT(*) FROM (%s EXCEPT %s)'
+                                 % (query, stored)).fetchone()[0]
+            extra = db.execute('SELECT COUNT(*) FROM (%s EXCEPT %s)'
+                               % (stored, query)).fetchone()[0]
+            if missing or extra:
+                differences[table] = (missing, extra)
+    finally:
+        db.rollback()
+
+    return differences
+
+
+def rebuild_summaries():
+    """Fill in the summary tables from the sightings in one transaction
+
+    The spatial index of the sighting positions is rebuilt too. Every
+    user's checklist version changes, so no page rendered from the old
+    summaries is served again.
+    """
+    db = get_db()
+    for table, columns, query in SUMMARIES:
+        db.execute('DELETE FROM %s' % table)
+        db.execute('INSERT INTO %s (%s) %s' % (table, columns, query))
+    db.execute('DELETE FROM sighting_rtree')
+    db.execute('INSERT INTO sighting_rtree (id, min_lat, max_lat, \
+                                            min_lon, max_lon, latitude, \
+                                            longitude, creature_id, count) \
+                SELECT id, latitude, latitude, longitude, longitude, \
+                       latitude, longitude, creature_id, count \
+                FROM sighting_location \
+                JOIN sighting ON sighting.id = sighting_location.sighting_id')
+    db.execute('UPDATE checklist_version SET version = version + 1')
+    db.commit()
+
+
+@click.command('checksummaries')
+@with_appcontext
+def check_summaries_command():
+    """Check the sighting summaries against the sightings"""
+    differences = check_summaries()
+    for table, (missing, extra) in sorted(differences.items()):
+        click.echo('%s: %d rows missing or wrong, %d extra'
+                   % (table, missing, extra), err=True)
+    if differences:
+        sys.exit(1)
+    click.echo('Sighting summaries are consistent.')
+
+
+@click.command('rebuildsummaries')
+@with_appcontext
+def rebuild_summaries_command():
+    """Recompute the sighting summaries from the sightings"""
+    rebuild_summaries()
+    click.echo('Rebuilt the sighting summaries.')
+
+
+def init_app(app):
+    """Register the summary commands"""
+    app.cli.add_command(check_summaries_command)
+    app.cli.add_command(rebuild_summaries_command)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Google Token Verification
+
+This module describes the component that turns a Google sign-in
+authorization code into a verified gplus_id. It keeps one HTTP
+session with a pool of keep-alive connections to Google, reads
+client_secrets.json once, and bounds every request with a timeout.
+It is only imported when someone signs in, as requests is slow to
+load and most workers never need it.
+
+ID tokens signed with RS256 are checked locally against Google's
+public keys, which are fetched once and kept for as long as Google
+allows, so most logins make no request beyond the code exchange.
+Other tokens fall back to the tokeninfo endpoint, whose answers are
+kept for a short while.
+"""
+
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from flask import current_app
+
+try:
+    import rsa
+except ImportError:
+    rsa = None
+
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+# Seconds Google's keys are kept if its response doesn't say.
+DEFAULT_CERTS_MAX_AGE = 3600
+
+# Seconds a token is still accepted after it expires, as our clock may
+# be ahead of Google's.
+CLOCK_SKEW = 60
+
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class VerificationError(Exception):
+    """Raised when a code or token cannot be verified"""
+
+
+def _b64decode(segment):
+    """Decode unpadded base64url, as used in JWTs and JWKs"""
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _b64int(segment):
+    """Decode a base64url big-endian integer from a JWK"""
+    return int.from_bytes(_b64decode(segment), 'big')
+
+
+def decode_jwt(token):
+    """Split a JWT into its header, claims, signed part and signature
+
+    Nothing is verified here.
+    """
+    try:
+        header, claims, signature = token.split('.')
+        decoded = (json.loads(_b64decode(header)),
+                   json.loads(_b64decode(claims)),
+                   ('%s.%s' % (header, claims)).encode('ascii'),
+                   _b64decode(signature))
+    except (ValueError, UnicodeError):
+        raise VerificationError('Malformed ID token.')
+    if not isinstance(decoded[0], dict) or not isinstance(decoded[1], dict):
+        raise VerificationError('Malformed ID token.')
+
+    return decoded
+
+
+class TTLCache(object):
+    """Least-recently-used cache whose entries expire after ttl seconds"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored under key, or None if it expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used if full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+class TokenVerifier(object):
+    """Exchange authorization codes and verify Google tokens"""
+
+    def __init__(self, config):
+        with open(config['CLIENT_SECRETS']) as f:
+            secrets = json.load(f)['web']
+        self.client_id = config['CLIENT_ID'] or secrets['client_id']
+        self.client_secret = secrets['client_secret']
+        self.token_uri = secrets['token_uri']
+
+        self.tokeninfo_url = config['TOKENINFO_URL']
+        self.certs_url = config['GOOGLE_CERTS_URL']
+        self.timeout = (config['GOOGLE_CONNECT_TIMEOUT'],
+                        config['GOOGLE_READ_TIMEOUT'])
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4, pool_maxsize=config['GOOGLE_POOL_SIZE'])
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.tokeninfo_cache = TTLCache(config['TOKENINFO_CACHE_SIZE'],
+                                        config['TOKENINFO_CACHE_TTL'])
+        self._keys = {}
+        self._keys_expire = 0
+        self._keys_lock = threading.Lock()
+
+    def _get_json(self, method, url, **kwargs):
+        """Make a request to Google and return the response and its JSON"""
+        try:
+            response = self.session.request(method, url,
+                                            timeout=self.timeout, **kwargs)
+            return response, response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise VerificationError(str(e))
+
+    def exchange(self, code):
+        """Exchange an authorization code for Google's token response"""
+        _, tokens = self._get_json('POST', self.token_uri, data={
+            'grant_type': 'authorization_code',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'code': code,
+            'redirect_uri': 'postmessage',
+        })
+        if 'access_token' not in tokens or 'id_token' not in tokens:
+            raise VerificationError(tokens.get('error', 'No token.'))
+
+        return tokens
+
+    def tokeninfo(self, access_token):
+        """Return what the tokeninfo endpoint says about an access token
+
+        Answers without an error are kept for TOKENINFO_CACHE_TTL
+        seconds, under a hash of the token.
+        """
+        key = hashlib.sha256(access_token.encode('utf-8')).hexdigest()
+        result = self.tokeninfo_cache.get(key)
+        if result is None:
+            _, result = self._get_json('GET', self.tokeninfo_url,
+                                       params={'access_token': access_token})
+            if result.get('error') is None:
+                self.tokeninfo_cache.put(key, result)
+
+        return result
+
+    def signing_key(self, kid):
+        """Return Google's public key with the given id, or None
+
+        The keys are fetched again once they expire, or when a token
+        names a key that isn't known yet.
+        """
+        with self._keys_lock:
+            if kid not in self._keys or self._keys_expire < time.time():
+                response, certs = self._get_json('GET', self.certs_url)
+                if not response.ok:
+                    raise VerificationError("Could not fetch Google's keys.")
+                match = MAX_AGE_RE.search(
+                    response.headers.get('Cache-Control', ''))
+                max_age = int(match.group(1)) if match \
+                    else DEFAULT_CERTS_MAX_AGE
+                self._keys = {k['kid']: rsa.PublicKey(_b64int(k['n']),
+                                                      _b64int(k['e']))
+                              for k in certs.get('keys', [])
+                              if k.get('kty') == 'RSA'}
+                self._keys_expire = time.time() + max_age
+
+            return self._keys.get(kid)
+
+    def verify_id_token(self, id_token):
+        """Check an ID token's signature and claims without tokeninfo
+
+        Return its claims, or None if the token can't be checked
+        locally, or Google's keys can't be fetched, and tokeninfo must
+        be asked instead. Raise VerificationError if it is checked and
+        found invalid.
+        """
+        header, claims, signed, signature = decode_jwt(id_token)
+        if header.get('alg') != 'RS256' or rsa is None \
+                or not self.certs_url:
+            return None
+
+        try:
+            key = self.signing_key(header.get('kid'))
+        except VerificationError:
+            return None
+        if key is None:
+            raise VerificationError('Unknown signing key.')
+        # rsa takes the hash from the signature itself, so a token
+        # signed with SHA-1 or MD5 would pass for RS256 unless checked.
+        try:
+            method = rsa.verify(signed, signature, key)
+        except rsa.VerificationError:
+            raise VerificationError('Bad ID token signature.')
+        if method != 'SHA-256':
+            raise VerificationError('Bad ID token signature.')
+
+        if claims.get('aud') != self.client_id:
+            raise VerificationError("Token's client ID does not match app's.")
+        if claims.get('iss') not in ISSUERS:
+            raise VerificationError('Token not issued by Google.')
+        if claims.get('exp', 0) + CLOCK_SKEW < time.time():
+            raise VerificationError('Token has expired.')
+
+        return claims
+
+
+def get_verifier():
+    """Return the token verifier of the current app
+
+    It is made on first use, so it picks up the config as it is then.
+    """
+    verifier = current_app.extensions.get('token_verifier')
+    if verifier is None:
+        verifier = TokenVerifier(current_app.config)
+        current_app.extensions['token_verifier'] = verifier
+
+    return verifier
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Worker Warmup
+
+This module describes how a worker gets ready to serve. Compiled
+templates are kept in TEMPLATE_CACHE, so a new worker loads them
+instead of compiling them again. With WARMUP on, create_app also
+compiles every template and reads the creature types and image
+manifest before returning, so the first requests a worker takes are
+no slower than the rest. The connection used for that is closed
+again, so workers forked from the app after create_app, as with
+gunicorn --preload, never share an SQLite handle.
+
+'flask warmup' compiles the templates into TEMPLATE_CACHE ahead of
+time, for example when deploying.
+"""
+
+import os
+import sqlite3
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+from wallowawildlife.db import get_catalogue_version, get_creature_types
+from wallowawildlife.images import get_manifest
+
+
+def compile_templates(app):
+    """Load every template, filling the bytecode cache if it is on
+
+    Return the number of templates loaded.
+    """
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names)
+
+
+def warm_up(app):
+    """Compile the templates and prime the per-app caches"""
+    compile_templates(app)
+
+    with app.app_context():
+        try:
+            get_catalogue_version()
+            get_creature_types()
+        except sqlite3.OperationalError:
+            # The database has not been initialized yet.
+            pass
+        get_manifest()
+
+    # SQLite connections must not be carried across a fork.
+    if 'db_pool' in app.extensions:
+        app.extensions['db_pool'].close_all()
+
+
+@click.command('warmup')
+@with_appcontext
+def warmup_command():
+    """Compile the templates into the template cache"""
+    count = compile_templates(current_app)
+    click.echo('Compiled %d templates.' % count)
+
+
+def init_app(app):
+    """Cache compiled templates and register the warmup command"""
+    if app.config['TEMPLATE_CACHE']:
+        os.makedirs(app.config['TEMPLATE_CACHE'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE'])
+
+    app.cli.add_command(warmup_command)